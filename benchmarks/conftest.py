@@ -0,0 +1,95 @@
+import os
+import uuid
+
+import numpy as np
+import pytest
+import shapely
+from sqlalchemy import func, inspect, select, text
+
+from matchmakeo.catalogues import NasaCMR
+from matchmakeo.databases import PostGISDatabase, SpatialiteDatabase, state_metadata
+from matchmakeo.matching import FootprintIndex
+from matchmakeo.product import Product
+
+from mock_cmr import MockCMR
+
+# footprint counts for the matching benchmarks, e.g. MATCHMAKEO_BENCH_SIZES=10000,100000
+SIZES = [int(n) for n in os.environ.get("MATCHMAKEO_BENCH_SIZES", "10000,100000,1000000").split(",")]
+
+
+@pytest.fixture(scope="session")
+def mock_cmr():
+    with MockCMR() as server:
+        yield server
+
+
+@pytest.fixture
+def catalogue(mock_cmr):
+    return NasaCMR(client_id="matchmakeo-benchmarks", url=mock_cmr.url, pool_maxsize=16)
+
+
+@pytest.fixture
+def database(tmp_path):
+    """PostGIS at MATCHMAKEO_BENCH_DB_URL if it is set, otherwise a new Spatialite file. Skips if neither works."""
+    url = os.environ.get("MATCHMAKEO_BENCH_DB_URL")
+    if url:
+        database = PostGISDatabase(database=None, username=None, password=None, db_url=url)
+        version = func.PostGIS_Version()
+    else:
+        database = SpatialiteDatabase(tmp_path / "benchmark.db")
+        version = func.spatialite_version()
+
+    try:
+        with database.pooled_connection() as connection:
+            connection.execute(select(version))
+    except Exception as e:
+        pytest.skip(f"No spatial database available: {e}")
+
+    yield database
+    database.close()
+
+
+@pytest.fixture
+def new_product(database):
+    """Makes products with tables of their own, dropped along with their harvest state afterwards."""
+    products = []
+
+    def make(short_name:str = "MOCK") -> Product:
+        products.append(Product(short_name=short_name, table=f"benchmark_{uuid.uuid4().hex[:8]}"))
+        return products[-1]
+
+    yield make
+
+    with database.transaction() as connection:
+        existing = inspect(connection).get_table_names()
+        for product in products:
+            connection.execute(text(f'DROP TABLE IF EXISTS "{product.table}"'))
+            for table in state_metadata.sorted_tables:
+                if table.name in existing:
+                    connection.execute(table.delete().where(table.c.product == product.table))
+
+
+def record_throughput(benchmark, granules:int):
+    """Add the granules per second of the benchmark's mean time to its results, if it was timed, which it isn't
+    when run with --benchmark-disable."""
+    if benchmark.stats:
+        benchmark.extra_info["granules_per_second"] = granules / benchmark.stats.stats.mean
+
+
+def synthetic_index(n:int, seed:int = 0) -> FootprintIndex:
+    """n swath-sized footprints, 5 minutes apart along a ground track, jittered by `seed` so two products overlap."""
+    rng = np.random.default_rng(seed)
+    index = np.arange(n)
+    orbit = index * 5 / 99 + rng.uniform(0, 0.01, n)
+    lat = 80 * np.sin(2 * np.pi * orbit)
+    lon = (-25 * orbit - 360 * (orbit % 1)) % 360 - 180
+
+    half_width = np.minimum(10 / np.maximum(np.cos(np.radians(lat)), 0.2), 60)
+    geometries = shapely.box(np.maximum(lon - half_width, -180), np.maximum(lat - 9, -89),
+                             np.minimum(lon + half_width, 180), np.minimum(lat + 9, 89))
+
+    start = np.datetime64("2020-01-01T00:00") + (index * 5 + rng.integers(0, 3, n)).astype("timedelta64[m]")
+    return FootprintIndex(ids=[f"{seed}-{i}" for i in index],
+                          geometries=geometries,
+                          datetime_start=start,
+                          datetime_end=start + np.timedelta64(5, "m"))
@@ -0,0 +1,135 @@
+"""Local stand-in for the CMR granule search API, serving synthetic granule feeds for benchmarks."""
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import math
+import threading
+from urllib.parse import parse_qs, urlparse
+
+EPOCH = datetime(2000, 1, 1)
+
+
+class MockCMR:
+    """CMR granule search served from a local HTTP server in a background thread.
+
+    Granules follow a sun-synchronous-like ground track, one every `granule_minutes`, each with a swath polygon of
+    `vertices` points per side like a MODIS 5 minute granule. Requests are answered like CMR's granules.json: the
+    `temporal` and `page_size` parameters are honoured, `CMR-Hits` is always sent and pages are linked by the
+    `CMR-Search-After` header. The feed is deterministic, so runs are comparable.
+
+    Use as a context manager, pointing a catalogue at `url`.
+    """
+
+    def __init__(self, granule_minutes:int = 5, vertices:int = 10):
+        self.granule_minutes = granule_minutes
+        self.vertices = vertices
+        self.requests = 0
+        self._lock = threading.Lock()
+
+        handler = type("Handler", (_Handler,), {"cmr": self})
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address
+        return f"http://{host}:{port}/search/granules.json"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def granules_per_day(self) -> int:
+        return 24 * 60 // self.granule_minutes
+
+    def search(self, params:dict, search_after:str = None) -> tuple[list[dict], dict]:
+        """Entries and response headers for a request."""
+        with self._lock:
+            self.requests += 1
+
+        start, end = (_parse_time(t) for t in params["temporal"].split(","))
+        page_size = int(params.get("page_size", 10))
+
+        step = timedelta(minutes=self.granule_minutes)
+        first = math.ceil((start - EPOCH) / step)
+        stop = math.ceil((end - EPOCH) / step)
+        headers = {"CMR-Hits": str(max(stop - first, 0))}
+
+        if search_after:
+            first = int(search_after)
+        last = min(first + page_size, stop)
+
+        entries = [self.entry(i) for i in range(first, last)]
+        if page_size and last < stop:
+            headers["CMR-Search-After"] = str(last)
+        return entries, headers
+
+    @lru_cache(maxsize=100_000)
+    def entry(self, index:int) -> dict:
+        """The synthetic granule entry with the given sequence number."""
+        start = EPOCH + index * timedelta(minutes=self.granule_minutes)
+        end = start + timedelta(minutes=self.granule_minutes)
+
+        # ~14.5 orbits a day, the track moving ~25 degrees west per orbit
+        orbit = index * self.granule_minutes / 99
+        lat = 80 * math.sin(2 * math.pi * orbit)
+        lon = (-25 * orbit - 360 * (orbit % 1)) % 360 - 180
+        ring = _swath(lat, lon, self.vertices)
+
+        return {
+            "id": f"G{index:010d}-MOCK",
+            "title": f"MOCK.A{start:%Y%j.%H%M}.061",
+            "producer_granule_id": f"MOCK.A{start:%Y%j.%H%M}.061.hdf",
+            "time_start": f"{start:%Y-%m-%dT%H:%M:%S}.000Z",
+            "time_end": f"{end:%Y-%m-%dT%H:%M:%S}.000Z",
+            "updated": f"{start + timedelta(days=1):%Y-%m-%dT%H:%M:%S}.000Z",
+            "granule_size": "41.2",
+            "day_night_flag": "DAY" if math.cos(2 * math.pi * orbit) > 0 else "NIGHT",
+            "cloud_cover": str(index % 100),
+            "online_access_flag": True,
+            "polygons": [[" ".join(f"{y:.4f} {x:.4f}" for x, y in ring)]],
+        }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    cmr: MockCMR
+
+    def do_GET(self):
+        params = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+        entries, headers = self.cmr.search(params, search_after=self.headers.get("CMR-Search-After"))
+        body = json.dumps({"feed": {"entry": entries}}).encode()
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _parse_time(value:str) -> datetime:
+    return datetime.fromisoformat(value.replace("Z", "+00:00")).astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _swath(lat:float, lon:float, vertices:int, along:float = 18.0, across:float = 20.0) -> list[tuple[float, float]]:
+    """Closed anticlockwise (lon, lat) ring of a swath centred on (lon, lat), clipped to valid latitudes."""
+    south, north = max(lat - along / 2, -89.0), min(lat + along / 2, 89.0)
+    # swaths widen in longitude towards the poles
+    half_width = min(across / 2 / max(math.cos(math.radians(lat)), 0.2), 60.0)
+    west, east = max(lon - half_width, -180.0), min(lon + half_width, 180.0)
+
+    steps = [i / (vertices - 1) for i in range(vertices)]
+    ring = ([(west + (east - west) * s, south) for s in steps]
+            + [(east, south + (north - south) * s) for s in steps[1:]]
+            + [(east - (east - west) * s, north) for s in steps[1:]]
+            + [(west, north - (north - south) * s) for s in steps[1:]])
+    return ring
@@ -0,0 +1,63 @@
+"""Granules per second and memory high-water mark of harvesting from the mock CMR."""
+from datetime import date
+import tracemalloc
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+from matchmakeo.product import Product
+from matchmakeo.queryset import NasaCMRQueryset
+
+from conftest import record_throughput
+
+DAYS = 7
+
+
+def queryset(days:int = DAYS) -> NasaCMRQueryset:
+    return NasaCMRQueryset(start_date=date(2020, 1, 1), end_date=date(2020, 1, days), page_size=500)
+
+
+@pytest.mark.parametrize("max_workers", [1, 4])
+def test_download_footprints(benchmark, catalogue, database, new_product, mock_cmr, max_workers):
+    granules = DAYS * mock_cmr.granules_per_day()
+
+    def run(product):
+        return catalogue.download_footprints(product, queryset(), database, batch_size=2000, max_workers=max_workers)
+
+    rows = benchmark.pedantic(run, setup=lambda: ((new_product(),), {}), rounds=3)
+
+    assert rows == granules
+    record_throughput(benchmark, granules)
+
+
+@pytest.mark.parametrize("max_workers", [1, 4])
+def test_iter_footprints(benchmark, catalogue, mock_cmr, max_workers):
+    granules = DAYS * mock_cmr.granules_per_day()
+    product = Product(short_name="MOCK", table="mock")
+
+    def run():
+        return sum(1 for _ in catalogue.iter_footprints(product, queryset(), max_workers=max_workers))
+
+    assert benchmark.pedantic(run, rounds=3) == granules
+    record_throughput(benchmark, granules)
+
+
+def test_iter_footprints_memory(catalogue):
+    """Streaming should keep peak memory flat however many days are harvested."""
+    product = Product(short_name="MOCK", table="mock")
+    peaks = {}
+
+    # the mock runs in this process, so fill its entry cache first to measure only the harvest
+    for _ in catalogue.iter_footprints(product, queryset(4 * DAYS), max_workers=4):
+        pass
+
+    for days in (DAYS, 4 * DAYS):
+        tracemalloc.start()
+        for _ in catalogue.iter_footprints(product, queryset(days), max_workers=4):
+            pass
+        peaks[days] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    assert peaks[4 * DAYS] < 2 * peaks[DAYS], (f"peak memory grew from {peaks[DAYS] / 2**20:.1f}MB for {DAYS} days "
+                                               f"to {peaks[4 * DAYS] / 2**20:.1f}MB for {4 * DAYS} days")
@@ -0,0 +1,47 @@
+"""Latency of matching two products' footprints, in memory and in the database."""
+from datetime import timedelta
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+from matchmakeo.parsing import to_wkb_elements
+
+from conftest import SIZES, synthetic_index
+
+MAX_TIME_DELTA = timedelta(minutes=30)
+
+
+@pytest.mark.parametrize("n", SIZES)
+def test_footprint_index_match(benchmark, n):
+    a, b = synthetic_index(n, seed=1), synthetic_index(n, seed=2)
+
+    def run():
+        return sum(len(chunk) for chunk in a.match(b, max_time_delta=MAX_TIME_DELTA))
+
+    pairs = benchmark.pedantic(run, rounds=3 if n <= 100_000 else 1)
+    benchmark.extra_info["pairs"] = pairs
+
+
+@pytest.mark.parametrize("n", SIZES)
+def test_database_match(benchmark, catalogue, database, new_product, n):
+    products = [new_product(), new_product()]
+
+    with database.pooled_connection() as connection, database.bulk_load(connection):
+        for product, seed in zip(products, (1, 2)):
+            index = synthetic_index(n, seed=seed)
+            table = catalogue._create_table(connection, product, primary_key="id")
+            for start in range(0, n, 50_000):
+                block = slice(start, start + 50_000)
+                rows = [{"id": i, "geometry": g, "datetime_start": s, "datetime_end": e}
+                        for i, g, s, e in zip(index.ids[block], to_wkb_elements(index.geometries[block]),
+                                              index.datetime_start[block].tolist(), index.datetime_end[block].tolist())]
+                database.insert_footprints(connection, table, rows)
+            database.create_indexes(connection, table)
+            database.analyze(connection, table)
+
+    def run():
+        return sum(len(chunk) for chunk in database.match(*products, max_time_delta=MAX_TIME_DELTA))
+
+    pairs = benchmark.pedantic(run, rounds=3 if n <= 100_000 else 1)
+    benchmark.extra_info["pairs"] = pairs
@@ -0,0 +1,46 @@
+"""Throughput of decoding and parsing CMR granule pages."""
+import copy
+import json
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+from matchmakeo.catalogues import NasaCMR
+from matchmakeo.parsing import decode_cmr_feed, parse_cmr_geometries
+
+from conftest import record_throughput
+
+PAGE_SIZE = 2000
+
+
+@pytest.fixture(scope="module")
+def page(mock_cmr) -> list[dict]:
+    return [mock_cmr.entry(i) for i in range(PAGE_SIZE)]
+
+
+@pytest.mark.parametrize("decoder", ["json", "decode_cmr_feed"])
+def test_decode_page(benchmark, page, decoder):
+    body = json.dumps({"feed": {"entry": page}}).encode()
+
+    # decode_cmr_feed uses orjson if it is installed
+    benchmark(json.loads if decoder == "json" else decode_cmr_feed, body)
+    record_throughput(benchmark, PAGE_SIZE)
+
+
+def test_parse_cmr_geometries(benchmark, page):
+    benchmark(parse_cmr_geometries, page)
+    record_throughput(benchmark, PAGE_SIZE)
+
+
+def test_parse_page(benchmark, page):
+    # parsing takes the polygons out of the entries, so each round gets fresh ones
+    benchmark.pedantic(NasaCMR._parse_page, setup=lambda: ((copy.deepcopy(page),), {}), rounds=20)
+    record_throughput(benchmark, PAGE_SIZE)
+
+
+def test_footprints_to_rows(benchmark, catalogue, page):
+    footprints = NasaCMR._parse_page(copy.deepcopy(page))
+
+    benchmark(catalogue._footprints_to_rows, footprints)
+    record_throughput(benchmark, PAGE_SIZE)
@@ -0,0 +1,197 @@
+from datetime import timedelta
+import hashlib
+import json
+from pathlib import Path
+import sqlite3
+import threading
+import time
+import zlib
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from .utils import setUpLogging
+
+log = setUpLogging(__name__)
+
+__all__ = [
+    "CacheMissError",
+    "ResponseCache",
+]
+
+
+class CacheMissError(LookupError):
+    "Raised by a cache in offline mode when a request has no cached response."
+
+
+class ResponseCache:
+    """On-disk cache of catalogue responses, stored compressed in a single SQLite file.
+
+    Responses are keyed by the request URL, its parameters and the headers in `KEY_HEADERS`, so re-running a query
+    for the same windows is served from disk. Only successful responses are cached.
+
+    Params:
+        path(str|Path): SQLite file to keep the cache in, created if it doesn't exist.
+        ttl(timedelta): how long a response stays fresh, forever by default.
+        max_size(int): largest total size of the compressed responses in bytes. The least recently used responses
+            are evicted to stay below it.
+        offline(bool): serve requests only from the cache, raising CacheMissError for anything not in it.
+            Stale responses are still served, since there is nothing to refresh them from.
+    """
+
+    # request headers which change the response, and so are part of the key
+    KEY_HEADERS = ("CMR-Search-After",)
+
+    def __init__(self,
+                 path: str|Path,
+                 ttl: timedelta = None,
+                 max_size: int = 1024 ** 3,
+                 offline: bool = False,
+                 ):
+        self.path = path
+        self.ttl = ttl
+        self.max_size = max_size
+        self.offline = offline
+
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode = WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                status_code INTEGER NOT NULL,
+                headers TEXT NOT NULL,
+                body BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS ix_responses_accessed_at ON responses (accessed_at)")
+        self._size = self._db.execute("SELECT coalesce(sum(size), 0) FROM responses").fetchone()[0]
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT count(*) FROM responses").fetchone()[0]
+
+    @property
+    def size(self) -> int:
+        "Total size of the compressed responses in bytes."
+        return self._size
+
+    def key(self, url:str, params:dict = None, headers:dict = None) -> str:
+        """Normalised key of a request, independent of parameter and header order."""
+        headers = CaseInsensitiveDict(headers or {})
+        request = {
+            "url": url,
+            "params": sorted((str(k), str(v)) for k, v in (params or {}).items() if v is not None),
+            "headers": [(name, headers[name]) for name in self.KEY_HEADERS if headers.get(name)],
+        }
+        return hashlib.sha256(json.dumps(request).encode()).hexdigest()
+
+    def get(self, session:requests.Session, url:str, params:dict = None, headers:dict = None, send=None) -> requests.Response:
+        """Response to a GET request, from the cache if there is a fresh one, otherwise sent with the session and cached.
+
+        Params:
+            send(callable): called before a request goes to the network, e.g. to wait for a rate limiter.
+        """
+        key = self.key(url, params, headers)
+
+        response = self._load(key)
+        if response is not None:
+            self.hits += 1
+            return response
+
+        self.misses += 1
+        if self.offline:
+            raise CacheMissError(f"No cached response for {url} with {params} in offline mode.")
+
+        if send:
+            send()
+        response = session.get(url, params=params, headers=headers)
+
+        if response.status_code == 200:
+            self._store(key, response)
+
+        return response
+
+    def clear(self):
+        """Remove every cached response."""
+        with self._lock:
+            self._db.execute("DELETE FROM responses")
+            self._size = 0
+
+    def close(self):
+        self._db.close()
+
+    def __getstate__(self):
+        # reopened by each process it is sent to, SQLite handles concurrent access to the file
+        return {"path": self.path, "ttl": self.ttl, "max_size": self.max_size, "offline": self.offline}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def _load(self, key:str) -> requests.Response|None:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT url, status_code, headers, body, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+
+            url, status_code, headers, body, created_at = row
+            if self.ttl is not None and not self.offline and time.time() - created_at > self.ttl.total_seconds():
+                self._delete([key])
+                return None
+
+            self._db.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (time.time(), key))
+
+        response = requests.Response()
+        response.url = url
+        response.status_code = status_code
+        response.headers = CaseInsensitiveDict(json.loads(headers))
+        response._content = zlib.decompress(body)
+        response.encoding = "utf-8"
+        response.from_cache = True
+        return response
+
+    def _store(self, key:str, response:requests.Response):
+        body = zlib.compress(response.content)
+        # the body is stored decompressed by requests, so the transfer headers no longer apply
+        headers = {k: v for k, v in response.headers.items() if k.lower() not in ("content-encoding", "content-length", "transfer-encoding")}
+        now = time.time()
+
+        with self._lock:
+            previous = self._db.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, response.url, response.status_code, json.dumps(headers), body, len(body), now, now),
+            )
+            self._size += len(body) - (previous[0] if previous else 0)
+
+            if self._size > self.max_size:
+                self._evict()
+
+    def _evict(self):
+        """Delete the least recently used responses until the cache fits in max_size. Call with the lock held."""
+        excess = self._size - self.max_size
+        keys = []
+        for key, size in self._db.execute("SELECT key, size FROM responses ORDER BY accessed_at"):
+            if excess <= 0:
+                break
+            keys.append(key)
+            excess -= size
+
+        log.debug(f"Evicting {len(keys)} responses from the cache")
+        self._delete(keys)
+
+    def _delete(self, keys:list[str]):
+        """Delete responses by key. Call with the lock held."""
+        for key in keys:
+            size = self._db.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            if size:
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._size -= size[0]
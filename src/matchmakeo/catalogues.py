@@ -1,22 +1,41 @@
 from abc import ABC, abstractmethod
+from dataclasses import replace
 from datetime import date, datetime, timedelta
+from functools import partial
+import hashlib
 import itertools
+import json
 from pathlib import Path
 import os
+import socket
 from tempfile import TemporaryFile
+import time
+from typing import Iterable, Iterator, NamedTuple
 import warnings
 
 from geoalchemy2 import Geometry
 import requests
+from requests.adapters import HTTPAdapter
+import numpy as np
+import shapely
 from shapely import Polygon
-from sqlalchemy import create_engine, Table, Column, Integer, String, MetaData, DateTime, Float, Connection
+from sqlalchemy import create_engine, Table, Column, Integer, String, MetaData, DateTime, Float, Boolean, Connection, JSON, inspect
+from sqlalchemy.dialects.postgresql import JSONB
 from tqdm import tqdm
+from urllib3.util.retry import Retry
 
+from .cache import ResponseCache
 from .databases import Database
 from .field import Field
+from .footprint import Footprint
+from .matching import MaterialisedMatch
+from .metrics import Metrics
 from .product import Product
 from .queryset import Queryset, NasaCMRQueryset
-from .utils import coords_to_polygon, daterange, setUpLogging
+from .parsing import decode_cmr_feed, normalise_geometries, parse_cmr_geometries, to_wkb_elements
+from .pipeline import Pipeline, ordered_chain
+from .utils import RateLimiter, parse_date, parse_datetime, setUpLogging, utcnow
+from .windows import Window
 
 log = setUpLogging(__name__)
 
@@ -29,9 +48,38 @@ __all__ = [
 
 class Catalogue(ABC):
 
-    def __init__(self, url, queryset_type: Queryset = None):
+    # responses worth retrying: rate limiting and transient server errors
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+    def __init__(self,
+                 url,
+                 queryset_type: Queryset = None,
+                 rate_limit: float = None,
+                 max_retries: int = 5,
+                 backoff_factor: float = 1.0,
+                 pool_maxsize: int = 10,
+                 cache: ResponseCache = None,
+                 metrics: Metrics = None,
+                 ):
+        """
+        Params:
+            rate_limit(float): maximum number of requests per second sent to the catalogue, shared by all worker threads.
+            max_retries(int): number of times a failed request is retried before giving up.
+            backoff_factor(float): base of the exponential backoff (with jitter) between retries, in seconds.
+                A Retry-After header sent by the server takes precedence.
+            pool_maxsize(int): number of keep-alive connections kept open to the catalogue,
+                should be at least the number of worker threads.
+            cache(ResponseCache): on-disk cache to serve repeated requests from, and to store responses in.
+            metrics(Metrics): where to record request and parsing metrics, a new one by default.
+        """
         self.url = url
+        self.cache = cache
+        self.metrics = metrics if metrics is not None else Metrics()
         self.fields = []
+        self.rate_limiter = RateLimiter(rate_limit) if rate_limit else None
+        self.session = self._create_session(max_retries=max_retries,
+                                            backoff_factor=backoff_factor,
+                                            pool_maxsize=pool_maxsize)
         
         if queryset_type:
             self.queryset_type = queryset_type
@@ -46,6 +94,48 @@ class Catalogue(ABC):
         """Abstract method"""
         self._check_queryset_type(queryset=queryset)
     
+    def _create_session(self, max_retries:int, backoff_factor:float, pool_maxsize:int) -> requests.Session:
+        """Create a session with pooled keep-alive connections that retries transient failures."""
+        retry = Retry(
+            total=max_retries,
+            backoff_factor=backoff_factor,
+            backoff_jitter=backoff_factor,
+            status_forcelist=self.RETRY_STATUSES,
+            allowed_methods=frozenset({"GET"}),
+            respect_retry_after_header=True,
+        )
+        adapter = HTTPAdapter(max_retries=retry, pool_connections=1, pool_maxsize=pool_maxsize)
+
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def _get(self, params:dict, headers:dict = None) -> requests.Response:
+        """Send a GET request to the catalogue, through the response cache if there is one, and record its metrics."""
+        if self.cache is not None:
+            response = self.cache.get(self.session, self.url, params=params, headers=headers, send=self._throttle)
+        else:
+            self._throttle()
+            response = self.session.get(self.url, params=params, headers=headers)
+
+        if getattr(response, "from_cache", False):
+            self.metrics.increment("cache_hits")
+            return response
+
+        # time until the response headers arrived, including any retries
+        self.metrics.observe("http_request", response.elapsed.total_seconds())
+        self.metrics.increment("http_bytes_received", len(response.content))
+        retries = getattr(getattr(response.raw, "retries", None), "history", ())
+        if retries:
+            self.metrics.increment("http_retries", len(retries))
+        return response
+
+    def _throttle(self):
+        """Wait for the rate limiter, if one is configured, before sending a request."""
+        if self.rate_limiter:
+            self.rate_limiter.wait()
+
     def _check_queryset_type(self, queryset:Queryset):
         """Raise UserWarning if queryset type does not match catalogue type."""
         if type(queryset) is not self.queryset_type:
@@ -53,19 +143,66 @@ class Catalogue(ABC):
                           UserWarning)
             
     def _create_table(self, connection:Connection, product:Product, primary_key:str='pk'):
+        """Create the product's footprint table if it doesn't exist.
+
+        If one of the fields is named `primary_key` it is used as the primary key, otherwise an integer key is added.
+        The product's overflow column, if it has one, is added as JSON, or JSONB on PostgreSQL, and its bounding box
+        columns if it asks for them.
+
+        Tables of products with `partition_by` are created range partitioned on `datetime_start` (PostgreSQL only),
+        which then has to be part of the primary key. Their partitions are created by `Database.ensure_partitions`.
+        """
+        partition_options = {}
+        if product.partition_by:
+            if product.partition_by not in Database.PARTITION_INTERVALS:
+                raise ValueError(f"partition_by must be one of {Database.PARTITION_INTERVALS}, got {product.partition_by}")
+            if connection.dialect.name != "postgresql":
+                raise ValueError(f"Partitioned footprint tables need PostGIS, not {connection.dialect.name}.")
+            partition_options["postgresql_partition_by"] = "RANGE (datetime_start)"
+
+        fields = self.fields + product.extra_fields
+        key_columns = {primary_key, "datetime_start"} if product.partition_by else {primary_key}
+        columns = [f._as_column(primary_key=f.column_name in key_columns) for f in fields]
+
+        if primary_key not in [f.column_name for f in fields]:
+            columns.insert(0, Column(primary_key, Integer, primary_key=True))
+
+        if product.overflow_column:
+            columns.append(Column(product.overflow_column, JSON().with_variant(JSONB(), "postgresql")))
+
+        if product.bbox_columns:
+            columns.extend(Column(name, Float) for name in ("xmin", "ymin", "xmax", "ymax"))
+            columns.append(Column("polar", Boolean))
 
         metadata = MetaData()
-        table = Table(product.table, metadata,
-            Column(primary_key, Integer, primary_key=True),
-            *[f._as_column() for f in self.fields],
-            *[f._as_column() for f in product.extra_fields],
-        )
+        table = Table(product.table, metadata, *columns, **partition_options)
 
+        existed = inspect(connection).has_table(product.table)
         table.create(connection, checkfirst=True)
         connection.commit()
 
+        if existed:
+            self._check_primary_key(connection, table)
+
         return table
 
+    @staticmethod
+    def _check_primary_key(connection:Connection, table:Table):
+        """Raise ValueError if an existing table has no unique constraint on the primary key that rows are upserted on,
+        as footprint tables created with an integer `pk` column by earlier versions don't."""
+        key = {c.name for c in table.primary_key.columns}
+        inspector = inspect(connection)
+        unique_keys = [inspector.get_pk_constraint(table.name)["constrained_columns"]]
+        unique_keys += [u["column_names"] for u in inspector.get_unique_constraints(table.name)]
+        unique_keys += [i["column_names"] for i in inspector.get_indexes(table.name) if i["unique"]]
+
+        if not any(set(columns) == key for columns in unique_keys):
+            columns = ", ".join(sorted(key))
+            raise ValueError(f"{table.name} has no primary key or unique constraint on ({columns}), which harvests need "
+                             f"to skip or update granules already stored. Tables created by earlier versions of matchmakeo "
+                             f"have an integer pk column instead. Remove any duplicate granules and run "
+                             f"CREATE UNIQUE INDEX ON {table.name} ({columns}), or harvest into a new table.")
+
 
 class NasaCMR(Catalogue):
     """Interface to download from the NASA Common Metadata Repository (CMR) (<https://cmr.earthdata.nasa.gov/>) for all Earth Observing System Data and Information System (EOSDIS) metadata including MODIS footprints."
@@ -76,23 +213,32 @@ class NasaCMR(Catalogue):
                  client_id: str = None,
                  url:str = "https://cmr.sit.earthdata.nasa.gov/search/granules.json", #"https://cmr.earthdata.nasa.gov/search/granules.json",
                  queryset_type: Queryset = NasaCMRQueryset,
+                 rate_limit: float = None,
+                 **kwargs,
                  ):
         """_summary_
         Params:
             client_id(str): Client ids are strongly encouraged by NASA CMR, we suggest using your name or research group.
+                Sent as the Client-Id header on every request.
+            rate_limit(float): maximum number of requests per second sent to CMR across all worker threads.
+            **kwargs: HTTP retry, pooling and response cache options passed to `Catalogue`.
         """
 
-        super().__init__(url=url, queryset_type=queryset_type)
+        super().__init__(url=url, queryset_type=queryset_type, rate_limit=rate_limit, **kwargs)
 
+        self.client_id = client_id
         if client_id is None:
             log.warning("No client_id set. Client ids are strongly encouraged by NASA CMR, we suggest using your name or research group's name, for example.")
+        else:
+            self.session.headers.update({"Client-Id": client_id})
 
         # add fields specific to this catalogue
         additional_fields = [
             Field('id', 'id', String),
-            Field('geometry', 'geometry', Geometry('POLYGON', srid=4326)),
-            Field('datetime_start', 'datetime_start', DateTime),
-            Field('datetime_end', 'datetime_end', DateTime),
+            # polygons or multipolygons, spatial indexes are managed by Database.create_indexes
+            Field('geometry', 'geometry', Geometry('GEOMETRY', srid=4326, spatial_index=False)),
+            Field('datetime_start', 'datetime_start', DateTime, source='time_start'),
+            Field('datetime_end', 'datetime_end', DateTime, source='time_end'),
         ]
         self.fields.extend(additional_fields)
 
@@ -101,132 +247,738 @@ class NasaCMR(Catalogue):
                 queryset: Queryset,
                 database: Database,
                 primary_key:str = "id",
+                batch_size:int = 1000,
+                max_workers:int = 1,
+                resume:bool = True,
+                incremental:bool = False,
+                defer_indexes:bool = False,
+                time_index:str = "btree",
+                progress_position:int = None,
+                work_queue:bool = False,
+                worker:str = None,
+                claim_timeout:timedelta = timedelta(hours=1),
+                matches:list[MaterialisedMatch] = None,
                 ):
+        """Download footprints for a product over the queryset's date range and write them to the database.
+
+        Params:
+            batch_size(int): number of granules accumulated before they are written to the database
+                in a single multi-row insert and committed together. Larger batches mean fewer round-trips
+                and commits, at the cost of holding more rows in memory.
+            max_workers(int): number of temporal windows fetched from CMR in parallel. Paging within a window stays
+                sequential and results are written by this thread in date order, so inserts are unaffected.
+                Combine with the catalogue's `rate_limit` to stay polite to CMR.
+            resume(bool): skip windows which a previous run of this product completed and continue an interrupted
+                window from its last committed page. Progress is checkpointed in the database as batches are committed.
+                Only runs with the same filters, the queryset's version, spatial parameters and post filtering, are
+                resumed from, so harvesting a region doesn't stand in for harvesting the whole globe.
+            incremental(bool): only fetch granules added or updated in CMR since the last completed harvest of the
+                same dates with the same filters, overwriting rows that already exist. Dates no such harvest has covered
+                are fetched in full.
+            defer_indexes(bool): create the spatial and datetime indexes after ingestion rather than with the table,
+                then refresh the table statistics. Faster for bulk loads into a new table.
+            time_index(str): index type for the datetime columns, "btree" or "brin" (PostGIS only).
+            progress_position(int): line of the terminal to draw the progress bar on, for several harvests at once.
+            work_queue(bool): claim windows one at a time from a work queue table in the database rather than
+                harvesting all of them, so any number of processes, on any number of machines sharing the database,
+                can harvest the product together. Each worker adds the queryset's windows missing from the queue,
+                which may have been planned already by `plan_harvest`, and only claims windows within its dates.
+                Batches end with each window, which is marked done in the queue as soon as its rows are committed.
+                Deferred indexes are created, and the harvest recorded as complete, by the worker which finishes
+                the last window.
+            worker(str): name recorded against the windows this worker claims, the host and process id by default.
+            claim_timeout(timedelta): time after which a window claimed but not completed, e.g. by a worker which
+                crashed, is handed out again.
+            matches(list[MaterialisedMatch]): match tables involving this product to keep up to date. After each batch
+                is written, only its footprints are matched against the other product and the pairs they make are
+                added to the match table, recorded against a run of this harvest. Matches with a product which has
+                no table yet are skipped.
+
+        Windows are chosen by the queryset's `window_policy`, one day each by default.
+        Granules which already exist in the table are skipped, so re-running over the same dates is safe.
+
+        The product's `extra_fields` are filled from each granule's properties. Unless the product has a projection,
+        every other property also gets a column of its own, named after it, as it is first seen with a value, and
+        is stored there as it is.
+
+        Fetching, parsing, converting to rows and writing run as concurrent pipeline stages connected by
+        bounded queues, so memory use depends on the page and batch sizes, not on how many granules a window holds.
+        """
         super().download_footprints(product=product, queryset=queryset, database=database, primary_key=primary_key)
 
-        try:
-            connection = database.connect()
-        except ConnectionError:
-            raise ConnectionError(f"Database connection failed. Aborting.")
+        if work_queue and incremental:
+            raise ValueError("Incremental harvests can't use the work queue, windows in it are only harvested once.")
+
+        # harvests filtered differently, e.g. to another region, keep their progress apart
+        query_digest = self._query_digest(product, queryset)
+
+        with database.pooled_connection() as connection:
+            table = self._create_table(connection, product, primary_key=primary_key)
+            if not defer_indexes:
+                database.create_indexes(connection, table, time_index=time_index)
+            database.create_state_tables(connection)
+
+            harvest_started = utcnow()
+
+            if incremental:
+                # windows within a range harvested before only fetch what changed since, the rest are fetched in full
+                last_harvests = database.get_harvests(connection, product.table, query_digest=query_digest)
+                log.info(f"Incremental harvest of {product.table}: {len(last_harvests)} previously harvested ranges")
+                # windows only hold changes since the last harvest, so they are not checkpointed as complete
+                saved_checkpoints = {}
+            else:
+                last_harvests = {}
+                saved_checkpoints = (database.get_checkpoints(connection, product.table, query_digest=query_digest)
+                                     if resume else {})
+
+            if matches and primary_key not in [f.column_name for f in self.fields + product.extra_fields]:
+                raise ValueError(f"Match tables are updated by primary key, so {primary_key} has to be one of the fields "
+                                 f"rather than a generated key.")
+
+            runs = []
+            for match in matches or []:
+                if product.table not in (match.product_a.table, match.product_b.table):
+                    raise ValueError(f"{product.table} is neither of the products matched in {match.table_name}.")
+                other = match.product_b if match.product_a.table == product.table else match.product_a
+                if not inspect(connection).has_table(other.table):
+                    log.warning(f"Not updating {match.table_name}, {other.table} hasn't been harvested yet.")
+                    continue
+                database.create_match_table(connection, match)
+                runs.append((match, database.start_match_run(connection, match)))
+
+            if work_queue:
+                # windows already queued, by plan_harvest or other workers, are left as they are
+                database.enqueue_windows(connection, product.table, self._pending_windows(product, queryset, saved_checkpoints),
+                                         query_digest=query_digest)
+                windows = self._claim_windows(database, product.table,
+                                              worker=worker or f"{socket.gethostname()}:{os.getpid()}",
+                                              claim_timeout=claim_timeout,
+                                              date_range=self._date_range(queryset),
+                                              query_digest=query_digest)
+            else:
+                windows = self._pending_windows(product, queryset, saved_checkpoints)
+
+            pipeline = Pipeline(
+                partial(self._fetch_pages, product=product, queryset=queryset,
+                        max_workers=max_workers, checkpoints=saved_checkpoints, last_harvests=last_harvests),
+                partial(self._parse_pages, queryset=queryset, product=product),
+                partial(self._rows_from_pages, product=product),
+            )
+
+            writer = _FootprintWriter(
+                database=database,
+                connection=connection,
+                table=table,
+                product=product,
+                batch_size=batch_size,
+                on_conflict="update" if incremental else "nothing",
+                checkpoint=not incremental,
+                work_queue=work_queue,
+                matches=runs,
+                primary_key=primary_key,
+                query_digest=query_digest,
+            )
+
+            progress = tqdm(
+                desc=f"{product.table} windows ",
+                unit=" window",
+                colour="green",
+                position=progress_position,
+            )
+            with database.bulk_load(connection):
+                found = 0
+                for page in pipeline(windows):
+
+                    if page.complete:
+                        log.info(f"{found} found for {page.window.start} to {page.window.end}")
+                        writer.window_done(page.window)
+                        progress.update()
+                        found = 0
+                        continue
+
+                    found += len(page.rows)
+
+                    if not product.projected:
+                        database.create_columns_from_footprint_props(table_name=product.table,
+                                                                    catalogue_fields=self.fields,
+                                                                    product_fields = product.extra_fields,
+                                                                    props=[f.properties for f in page.footprints],
+                                                                    connection=connection,
+                                                                    )
+                        database.schema.sync_table(connection, table)
+                        self._fill_property_columns(page.rows, page.footprints, table)
+
+                    writer.add(page.rows, window=page.window, search_after=page.search_after)
+                    if writer.rows_written:
+                        progress.set_postfix(rows=writer.rows_written, rows_per_sec=f"{writer.rows_per_second:.0f}")
+
+                progress.close()
+
+                # flush whatever is left over from the final windows
+                writer.flush()
+
+            for match, run_id in runs:
+                database.finish_match_run(connection, run_id)
+            if runs:
+                log.info(f"Added {writer.pairs_matched} pairs to {', '.join(m.table_name for m, _ in runs)}")
+
+            if writer.rows_written:
+                log.info(f"Wrote {writer.rows_written} footprints to {table.name} in {writer.write_seconds:.2f}s of database time "
+                         f"({writer.rows_per_second:.0f} rows/s, batch_size={batch_size})")
+
+            if work_queue:
+                # only the worker which finds the dates' windows all done finishes the harvest off
+                status = database.get_queue_status(connection, product.table, *self._date_range(queryset),
+                                                   query_digest=query_digest)
+                if status["pending"] or status["claimed"]:
+                    log.info(f"Leaving {table.name} to the other workers, {status['pending']} windows are pending "
+                             f"and {status['claimed']} claimed")
+                    return writer.rows_written
+
+            if defer_indexes:
+                log.info(f"Creating indexes on {table.name}")
+                database.create_indexes(connection, table, time_index=time_index)
+                database.analyze(connection, table)
+
+            database.save_last_harvest(connection, product.table, *self._date_range(queryset), harvest_started,
+                                       query_digest=query_digest)
+
+            return writer.rows_written
+
+    def plan_harvest(self,
+                     product: Product,
+                     queryset: Queryset,
+                     database: Database,
+                     primary_key: str = "id",
+                     defer_indexes: bool = False,
+                     time_index: str = "btree",
+                     ) -> int:
+        """Create the product's table and fill the work queue with the windows still to harvest, ready for
+        `download_footprints(work_queue=True)` workers.
+
+        Run once before starting the workers, so they don't race to create the table and plan the windows.
+        Returns the number of windows queued.
+        """
+        query_digest = self._query_digest(product, queryset)
+
+        with database.pooled_connection() as connection:
+            table = self._create_table(connection, product, primary_key=primary_key)
+            if not defer_indexes:
+                database.create_indexes(connection, table, time_index=time_index)
+            database.create_state_tables(connection)
+
+            saved_checkpoints = database.get_checkpoints(connection, product.table, query_digest=query_digest)
+            queued = database.enqueue_windows(connection, product.table,
+                                              list(self._pending_windows(product, queryset, saved_checkpoints)),
+                                              query_digest=query_digest)
+
+        log.info(f"Queued {queued} windows of {product.table}")
+        return queued
+
+    def iter_footprints(self,
+                        product: Product,
+                        queryset: Queryset,
+                        max_workers: int = 1,
+                        ) -> Iterator[Footprint]:
+        """Lazily yield the footprints of a product over the queryset's date range, without a database.
+
+        Pages are fetched and parsed ahead of the consumer in background threads, a bounded number at a time.
+        """
+        self._check_queryset_type(queryset=queryset)
 
-        table = self._create_table(connection, product)
+        pipeline = Pipeline(
+            partial(self._fetch_pages, product=product, queryset=queryset, max_workers=max_workers),
+            partial(self._parse_pages, queryset=queryset, product=product),
+        )
+        for page in pipeline(self._windows(product=product, queryset=queryset)):
+            if page.footprints:
+                yield from page.footprints
+
+    def _fetch_pages(self,
+                     windows: Iterable[Window],
+                     product: Product,
+                     queryset: Queryset,
+                     max_workers: int = 1,
+                     checkpoints: dict = None,
+                     last_harvests: dict = None,
+                     ) -> Iterator["_Page"]:
+        """Fetch stage: yield a page of raw CMR entries for each response, in window order, and a marker once each
+        window is complete.
 
-        # Iterate through years and months
-        for date in tqdm(daterange(queryset.start_date, queryset.end_date),
-            desc="Days to query ",
-            unit=" day",
-            colour="green",
-        ):
+        Params:
+            max_workers(int): number of windows fetched at once, each paged sequentially.
+            checkpoints(dict): saved `{(window_start, window_end): (search_after, completed)}` progress to resume from.
+            last_harvests(dict): `{(range_start, range_end): last_harvest}` of completed harvests. Windows within
+                one of the ranges only fetch granules updated since it was last harvested.
+        """
+        checkpoints = checkpoints or {}
+
+        def window_pages(window:Window):
+            window_queryset = self._incremental_queryset(queryset, window, last_harvests)
+            # continue an interrupted window from its last committed page
+            search_after = checkpoints.get((window.start, window.end), (None, False))[0]
+            for entries, next_search_after in self._iter_window_pages(product=product, queryset=window_queryset,
+                                                                      start=window.start, end=window.end,
+                                                                      search_after=search_after):
+                yield _Page(window, entries=entries, search_after=next_search_after)
+            yield _Page(window, complete=True)
+
+        if max_workers > 1:
+            yield from ordered_chain(window_pages, windows, max_workers=max_workers)
+        else:
+            for window in windows:
+                yield from window_pages(window)
+
+    def _parse_pages(self, pages:Iterable["_Page"], queryset:Queryset = None, product:Product = None) -> Iterator["_Page"]:
+        """Parse stage: turn each page's raw entries into typed footprints, dropping any outside the queryset's region
+        if it asks for post filtering."""
+        region = self._post_filter_region(queryset)
+        simplify_tolerance = product.simplify_tolerance if product else None
+        for page in pages:
+            if page.entries is not None:
+                with self.metrics.timer("parse"):
+                    footprints = self._parse_page(page.entries, simplify_tolerance=simplify_tolerance)
+                    parsed = len(footprints)
+                    if region is not None:
+                        footprints = self._filter_region(footprints, region)
+                self.metrics.increment("granules_parsed", parsed)
+                if parsed > len(footprints):
+                    self.metrics.increment("granules_filtered", parsed - len(footprints))
+                page = page._replace(entries=None, footprints=footprints)
+            yield page
+
+    def _rows_from_pages(self, pages:Iterable["_Page"], product:Product = None) -> Iterator["_Page"]:
+        """Transform stage: convert each page's footprints into rows for the footprint table."""
+        for page in pages:
+            if page.footprints is not None:
+                page = page._replace(rows=self._footprints_to_rows(page.footprints, product=product))
+            yield page
+
+    def _footprints_to_rows(self, footprints:list[Footprint], product:Product = None) -> list[dict]:
+        """Convert footprints into rows for the footprint table, with geometries serialised to WKB in bulk.
+
+        The product's extra fields are read from the footprints' properties, and any properties without a field are
+        gathered into its overflow column if it has one. Bounding boxes are added if the product stores them.
+        """
+        geometries = to_wkb_elements([f.geometry for f in footprints])
+        rows = [{
+            "id": f.id,
+            "geometry": geometry,
+            "datetime_start": f.datetime_start,
+            "datetime_end": f.datetime_end,
+        } for geometry, f in zip(geometries, footprints)]
+
+        if product is None:
+            return rows
+
+        for field in product.extra_fields:
+            for row, f in zip(rows, footprints):
+                row[field.column_name] = field.value(f.properties)
+
+        if product.bbox_columns:
+            for row, f in zip(rows, footprints):
+                row["xmin"], row["ymin"], row["xmax"], row["ymax"] = f.bbox or (None, None, None, None)
+                row["polar"] = f.polar
+
+        if product.overflow_column:
+            stored = {field.source_key for field in self.fields + product.extra_fields}
+            for row, f in zip(rows, footprints):
+                row[product.overflow_column] = {k: v for k, v in f.properties.items() if k not in stored} or None
+
+        return rows
+
+    @staticmethod
+    def _fill_property_columns(rows:list[dict], footprints:list[Footprint], table:Table):
+        """Fill the table's columns which the rows don't have a value for yet, the ones added for properties
+        without a field, from the footprints' properties."""
+        if not rows:
+            return
+        columns = [c.name for c in table.columns if c.name not in rows[0] and not c.primary_key]
+        for row, f in zip(rows, footprints):
+            for name in columns:
+                row[name] = f.properties.get(name)
+
+    def _pending_windows(self, product:Product, queryset:Queryset, checkpoints:dict) -> Iterator[Window]:
+        """The queryset's windows, less those which checkpoints record as completed."""
+        completed = [w for w, (_, done) in checkpoints.items() if done]
+        return (w for w in self._windows(product=product, queryset=queryset)
+                if not any(start <= w.start and w.end <= end for start, end in completed))
+
+    @staticmethod
+    def _claim_windows(database:Database,
+                       product:str,
+                       worker:str,
+                       claim_timeout:timedelta,
+                       date_range:tuple[datetime, datetime] = (None, None),
+                       query_digest:str = "",
+                       ) -> Iterator[Window]:
+        """Claim windows within the date range, queued with the same query digest, from the work queue one at a time,
+        as they are needed, until there are none left."""
+        start, end = date_range
+        while True:
+            with database.pooled_connection() as connection:
+                window = database.claim_window(connection, product, worker=worker, claim_timeout=claim_timeout,
+                                               start=start, end=end, query_digest=query_digest)
+            if window is None:
+                return
+            log.debug(f"{worker} claimed {window.start} to {window.end} of {product}")
+            yield window
+
+    @staticmethod
+    def _incremental_queryset(queryset:Queryset, window:Window, last_harvests:dict = None) -> Queryset:
+        """The queryset for a window, limited to granules updated since the latest completed harvest of a range
+        covering the window. Unchanged if no harvest covered all of it."""
+        covering = [harvested_at for (start, end), harvested_at in (last_harvests or {}).items()
+                    if start <= window.start and window.end <= end]
+        if not covering:
+            return queryset
+        if getattr(queryset, "updated_since", None):
+            covering.append(queryset.updated_since)
+        return replace(queryset, updated_since=max(covering))
+
+    @staticmethod
+    def _date_range(queryset:Queryset) -> tuple[datetime, datetime]:
+        """Start and end of the queryset's dates, inclusive of the end date."""
+        start = datetime.combine(parse_date(queryset.start_date), datetime.min.time())
+        end = datetime.combine(parse_date(queryset.end_date) + timedelta(days=1), datetime.min.time())
+        return start, end
+
+    def _windows(self, product:Product, queryset:Queryset):
+        """Temporal windows covering the queryset's dates, inclusive of the end date, chosen by its window policy."""
+        start, end = self._date_range(queryset)
+
+        def count_hits(window_start:datetime, window_end:datetime) -> int:
+            return self._count_hits(product=product, queryset=queryset, start=window_start, end=window_end)
+
+        return queryset.window_policy.windows(start, end, count_hits=count_hits)
+
+    def _count_hits(self,
+                    product: Product,
+                    queryset: Queryset,
+                    start: date|datetime,
+                    end: date|datetime,
+                    ) -> int:
+        """Number of granules between `start` and `end`, from the CMR-Hits header of an empty page."""
+        params = self._query_params(product=product, queryset=queryset, start=start, end=end)
+        params.update({"page_size": 0})
+
+        response = self._get(params)
+        response.raise_for_status()
+
+        return int(response.headers["CMR-Hits"])
+
+    def _query_params(self,
+                      product: Product,
+                      queryset: Queryset,
+                      start: date|datetime,
+                      end: date|datetime,
+                      ) -> dict:
+        """CMR search parameters for a product and queryset within a temporal window."""
+        params = self._filter_params(product=product, queryset=queryset)
+        params.update({
+            "page_size": queryset.page_size,
+            "temporal": f"{self._cmr_datetime(start)},{self._cmr_datetime(end)}",
+        })
+
+        if getattr(queryset, "updated_since", None):
+            params.update({"updated_since": self._cmr_datetime(queryset.updated_since)})
+
+        return params
+
+    def _filter_params(self, product:Product, queryset:Queryset) -> dict:
+        """CMR search parameters choosing which of a product's granules are harvested, whatever their dates."""
+        params = {"short_name": product.short_name}
+
+        if getattr(queryset, "version", None):
+            params.update({"version": queryset.version})
+
+        if getattr(queryset, "concept_id", None):
+            params.update({"concept_id": queryset.concept_id})
+
+        params.update(self._spatial_params(queryset))
+
+        return params
+
+    def _query_digest(self, product:Product, queryset:Queryset) -> str:
+        """Digest of the filters a harvest of the product applies, its CMR parameters other than dates and whether it
+        post filters, which its checkpoints, work queue windows and last harvests are recorded against."""
+        query = {"params": self._filter_params(product=product, queryset=queryset), "post_filter": queryset.post_filter}
+        return hashlib.sha256(json.dumps(query, sort_keys=True).encode()).hexdigest()
+
+    @staticmethod
+    def _spatial_params(queryset:Queryset) -> dict:
+        """CMR spatial search parameters for the queryset's bounding box, polygon and circle.
+
+        CMR requires all spatial parameters to match, except that any of the polygons of a MultiPolygon may.
+        """
+        params = {}
 
-            granules = self._download_single_date(product=product, queryset=queryset, date=date)
+        number = NasaCMR._cmr_number
 
-            log.info(f"{len(granules)} found for {date}")
+        if queryset.bounding_box is not None:
+            params["bounding_box"] = ",".join(number(c) for c in queryset.bounding_box)
 
-            database.create_columns_from_footprint_props(table_name=product.table,
-                                                        catalogue_fields=self.fields,
-                                                        product_fields = product.extra_fields,
-                                                        props=[g[1] for g in granules],
-                                                        )
+        if queryset.polygon is not None:
+            # CMR takes exteriors only, as closed anticlockwise rings of lon,lat pairs
+            polygons = shapely.get_parts(queryset.polygon)
+            params["polygon[]"] = [",".join(f"{number(x)},{number(y)}" for x, y in shapely.geometry.polygon.orient(p, 1.0).exterior.coords)
+                                   for p in polygons]
+            if len(polygons) > 1:
+                params["options[polygon][or]"] = "true"
 
-            for granule in granules:
-                insertion = table.insert().values(
-                    name=granule[1]['id'],
-                    geometry=coords_to_polygon(granule[0][0]),
-                    )
-                connection.execute(insertion)
-                connection.commit()
+        if queryset.circle is not None:
+            params["circle"] = ",".join(number(c) for c in queryset.circle)
 
+        return params
+
+    @staticmethod
+    def _cmr_number(value:float) -> str:
+        """Format a coordinate or radius for CMR as a plain decimal, without losing precision or using exponents."""
+        return np.format_float_positional(float(value), trim="-")
 
     def _download_single_date(self,
                               product: Product,
                               queryset: Queryset,
                               date: date,
-                              ):
-        
+                              ) -> list[Footprint]:
+        """Download all granules for a single day, following CMR-Search-After paging to the end."""
         next_day = date + timedelta(days=1)
+        return self._download_window(product=product, queryset=queryset, start=date, end=next_day)
+
+    def _download_window(self,
+                         product: Product,
+                         queryset: Queryset,
+                         start: date|datetime,
+                         end: date|datetime,
+                         ) -> list[Footprint]:
+        """Download all granules with a temporal extent within `start` and `end`."""
+        region = self._post_filter_region(queryset)
+        footprints = []
+        for entries, _ in self._iter_window_pages(product=product, queryset=queryset, start=start, end=end):
+            page = self._parse_page(entries, simplify_tolerance=product.simplify_tolerance)
+            footprints.extend(self._filter_region(page, region) if region is not None else page)
+        return footprints
+
+    def _iter_window_pages(self,
+                           product: Product,
+                           queryset: Queryset,
+                           start: date|datetime,
+                           end: date|datetime,
+                           search_after: str = None,
+                           ):
+        """Yield the raw granule entries of each page of CMR results, with the CMR-Search-After token
+        for the following page (None for the last page).
+
+        Pages are requested sequentially using the CMR-Search-After header
+        as recommended by CMR https://wiki.earthdata.nasa.gov/display/CMR/CMR+Harvesting+Best+Practices
 
-        more_data = True
-
-        geojson = {
-            "type": "FeatureCollection",
-            "features": []
-        }
+        Params:
+            search_after(str): token from a previous response, to continue paging part way through the window.
+        """
+        params = self._query_params(product=product, queryset=queryset, start=start, end=end)
+        keys = self._entry_keys(product)
 
         # iterate through pages of data
-        while more_data:
-            # Query parameters
-            params = {
-                "short_name": product.short_name,
-                "page_size": queryset.page_size,
-                'temporal': f"{date.strftime('%Y-%m-%d')}T00:00:00Z,{next_day.strftime('%Y-%m-%d')}T00:00:00Z"
-            }
-
+        while True:
             headers = {}
 
-            if queryset.version:
-                params.update({"version": self.queryset.version})
-
-            if getattr(queryset, "concept_id", None):
-                params.update(self.queryset.concept_id)
-
-            # if there is a previous response, check for additional available pages
-            # as recommended by CMR https://wiki.earthdata.nasa.gov/display/CMR/CMR+Harvesting+Best+Practices
-            if 'response' in locals():
-
-                # if previous response has CMR-Search-After header, add details to request headers
-                search_after = response.headers.get("CMR-Search-After", None)
-                if search_after:
-                    headers.update({
-                        "CMR-Search-After": search_after,
-                    })
+            # if the previous response had a CMR-Search-After header, pass it on to get the next page
+            if search_after:
+                headers.update({
+                    "CMR-Search-After": search_after,
+                })
 
-                else:
-                # if there is a previous response and does not have CMR-Search-After header, there is no more data
-                    more_data = False
-            
-            # Request granule metadata
-            response = requests.get(self.url, params=params, headers=headers)
+            # Request granule metadata, transient failures are retried by the session
+            response = self._get(params, headers=headers)
 
             if response.status_code != 200:
-                log.info(f"Error: {response.text}")
-                return
-
-            granules = response.json()
-
-            log.info(response.text)
-
-            more_data = len(granules["feed"]["entry"]) > 0
-
-            footprints = []
-            for g in granules["feed"]["entry"]:
-
-                coords = None
-                for poly in g["polygons"][0]:
-                    vals   =  list ( map (float, poly.split() ) )
-                    coords = [list ( zip( vals[1::2], vals[::2] ) )]
+                log.error(f"CMR responded with {response.status_code}: {response.text[:500]}")
+                response.raise_for_status()
 
-                props = {}
+            entries = decode_cmr_feed(response.content, keys=keys)
 
-                for prop in g:
-                    if not prop in ["polygons"]:
-                        props[prop] = g[prop]
+            if not entries:
+                return
 
-                # if coords:
-                #     geojson["features"].append({
-                #         "type": "Feature",
-                #         "geometry": {
-                #             "type": "Polygon",
-                #             "coordinates": coords
-                #         },
-                #         "properties": props
-                #     })
+            # no CMR-Search-After header means there is no more data
+            search_after = response.headers.get("CMR-Search-After", None)
 
-                footprints.append((coords, props))
+            yield entries, search_after
 
-            # if not geojson["features"]:
-            #     print(f"No footprints found for {date}")
-            #     return
-            
-            return footprints
+            if not search_after:
+                return
 
+    def _entry_keys(self, product:Product) -> set[str]|None:
+        """Keys of CMR entries which a projected product stores, None if it keeps every property."""
+        if not product.projected or product.overflow_column:
+            return None
+        return {"polygons", "boxes"} | {f.source_key for f in self.fields + product.extra_fields}
+
+    @staticmethod
+    def _post_filter_region(queryset:Queryset) -> shapely.Geometry|None:
+        """The region footprints are filtered by on the client, if the queryset asks for it."""
+        if queryset is None or not queryset.post_filter:
+            return None
+        region = queryset.region()
+        if region is not None:
+            shapely.prepare(region)
+        return region
+
+    @staticmethod
+    def _filter_region(footprints:list[Footprint], region:shapely.Geometry) -> list[Footprint]:
+        """The footprints which intersect the region exactly, in one vectorised test."""
+        geometries = np.array([f.geometry for f in footprints], dtype=object)
+        keep = shapely.intersects(region, geometries)
+        return [f for f, k in zip(footprints, keep) if k]
+
+    @staticmethod
+    def _parse_page(entries:list[dict], simplify_tolerance:float = None) -> list[Footprint]:
+        """Turn a page of CMR granule entries into footprints, building all geometries at once and normalising them
+        with `normalise_geometries`."""
+        geometries, bounds, polar = normalise_geometries(parse_cmr_geometries(entries), simplify_tolerance=simplify_tolerance)
+
+        footprints = []
+        for geometry, bbox, is_polar, entry in zip(geometries, bounds.tolist(), polar.tolist(), entries):
+            # the entry itself becomes the properties, without the raw polygon strings
+            entry.pop("polygons", None)
+            footprints.append(Footprint(
+                id=entry["id"],
+                geometry=geometry,
+                datetime_start=parse_datetime(entry.get("time_start")),
+                datetime_end=parse_datetime(entry.get("time_end")),
+                properties=entry,
+                bbox=tuple(bbox) if geometry is not None else None,
+                polar=is_polar,
+            ))
+
+        return footprints
+
+    @staticmethod
+    def _cmr_datetime(d:date|datetime) -> str:
+        """Format a date or datetime as a CMR temporal string."""
+        if not isinstance(d, datetime):
+            d = datetime(d.year, d.month, d.day)
+        return d.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+class _Page(NamedTuple):
+    "A page of granules from one window as it moves through the download pipeline."
+
+    window: Window
+    # CMR-Search-After token for the page after this one
+    search_after: str = None
+    # marks the end of the window rather than a page of granules
+    complete: bool = False
+    entries: list[dict] = None
+    footprints: list[Footprint] = None
+    rows: list[dict] = None
+
+
+class _FootprintWriter:
+    """Accumulates footprint rows into batches, writes each batch with a single insert and records harvest
+    checkpoints, and completes work queue windows, once the rows they cover are committed. Each batch written is
+    matched into the materialised match tables being kept up to date."""
 
+    def __init__(self,
+                 database: Database,
+                 connection: Connection,
+                 table: Table,
+                 product: Product,
+                 batch_size: int,
+                 on_conflict: str = "nothing",
+                 checkpoint: bool = True,
+                 work_queue: bool = False,
+                 matches: list[tuple[MaterialisedMatch, str]] = (),
+                 primary_key: str = "id",
+                 query_digest: str = "",
+                 ):
+        self.database = database
+        self.connection = connection
+        self.table = table
+        self.product = product
+        self.batch_size = batch_size
+        self.on_conflict = on_conflict
+        self.checkpoint = checkpoint
+        self.work_queue = work_queue
+        # (match, run id) of each match table to add the batches' pairs to
+        self.matches = matches
+        self.primary_key = primary_key
+        self.query_digest = query_digest
+
+        self.batch = []
+        # checkpoints which become true once the current batch is committed
+        self.pending_checkpoints = {}
+
+        self.rows_written = 0
+        self.write_seconds = 0.0
+        self.pairs_matched = 0
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows_written / self.write_seconds if self.write_seconds else 0.0
+
+    def add(self, rows:list[dict], window:Window, search_after:str = None):
+        """Add a page of rows from a window, writing a batch whenever it is full."""
+        self.batch.extend(rows)
+        if search_after:
+            self.pending_checkpoints[(window.start, window.end)] = (search_after, False)
+
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def window_done(self, window:Window):
+        """Mark a window complete, recorded with the batch holding its last rows.
+
+        Work queue windows are written and completed straight away, rather than staying claimed while a batch fills
+        up, which could outlast the claim timeout and have them handed out to other workers again.
+        """
+        self.pending_checkpoints[(window.start, window.end)] = (None, True)
+        if self.work_queue or not self.batch:
+            self.flush()
+
+    def flush(self):
+        """Write the current batch and then the checkpoints it satisfies."""
+        if self.batch:
+            columns = set().union(*self.batch)
+            if any(len(row) < len(columns) for row in self.batch):
+                # columns were added for new properties part way through the batch
+                for row in self.batch:
+                    for name in columns - row.keys():
+                        row[name] = None
+
+            if self.product.partition_by:
+                self.database.ensure_partitions(self.connection, self.table.name, self.product.partition_by,
+                                                [row["datetime_start"] for row in self.batch])
+
+            start = time.perf_counter()
+            rows = self.database.insert_footprints(self.connection, self.table, self.batch, on_conflict=self.on_conflict)
+            seconds = time.perf_counter() - start
+
+            self.rows_written += rows
+            self.write_seconds += seconds
+            log.debug(f"Wrote batch of {rows} rows to {self.table.name} in {seconds:.3f}s ({rows / seconds:.0f} rows/s)")
+
+            if self.matches:
+                self.match([row[self.primary_key] for row in self.batch])
+            self.batch = []
+
+        if self.checkpoint and self.pending_checkpoints:
+            self.database.save_checkpoints(self.connection, self.product.table,
+                [(start, end, search_after, completed)
+                 for (start, end), (search_after, completed) in self.pending_checkpoints.items()],
+                query_digest=self.query_digest)
+        if self.work_queue:
+            self.database.complete_windows(self.connection, self.product.table,
+                [window for window, (_, completed) in self.pending_checkpoints.items() if completed],
+                query_digest=self.query_digest)
+        self.pending_checkpoints = {}
+
+    def match(self, ids:list):
+        """Add the pairs made by newly written footprints to the match tables, from whichever side they are on."""
+        for match, run_id in self.matches:
+            if match.product_a.table == self.product.table:
+                self.pairs_matched += self.database.update_matches(self.connection, match, run_id, ids_a=ids,
+                                                                   key=self.primary_key)
+            if match.product_b.table == self.product.table:
+                self.pairs_matched += self.database.update_matches(self.connection, match, run_id, ids_b=ids,
+                                                                   key=self.primary_key)
@@ -1,23 +1,100 @@
 from abc import ABC
+from contextlib import contextmanager
 from dataclasses import dataclass
+from datetime import datetime, timedelta
 from pathlib import Path
 import os
+import re
+import uuid
+from typing import Iterable, Iterator
 
 from geoalchemy2 import Geometry
+from geoalchemy2.elements import WKBElement
 from geopandas import GeoDataFrame
-from sqlalchemy import create_engine, Engine, Connection, Table, MetaData
+import shapely
+from sqlalchemy import create_engine, Engine, Connection, Table, MetaData, Column, String, Text, DateTime, Boolean, Float, Integer, Index, select, insert, update, and_, or_, func, tuple_, table, column, literal, literal_column, text, event
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql import Select
 
 from .field import Field
-from .utils import infer_sql_type, setUpLogging
+from .matching import MaterialisedMatch
+from .metrics import Metrics
+from .product import Product
+from .schema import SchemaManager
+from .utils import setUpLogging, utcnow
+from .windows import Window
 
 log = setUpLogging(__name__)
 
+# harvest state managed by matchmakeo alongside the footprint tables. Harvest state is kept per query digest, of the
+# catalogue parameters filtering a product's granules, so differently filtered harvests of a product don't mistake
+# each others' progress for their own
+state_metadata = MetaData()
+
+checkpoints = Table("matchmakeo_checkpoints", state_metadata,
+    Column("product", String, primary_key=True),
+    Column("query_digest", String, primary_key=True, default=""),
+    Column("window_start", DateTime, primary_key=True),
+    Column("window_end", DateTime, primary_key=True),
+    # token to continue paging a window which was interrupted part way through
+    Column("search_after", Text, nullable=True),
+    Column("completed", Boolean, nullable=False, default=False),
+    Column("updated_at", DateTime, nullable=False),
+)
+
+# windows shared out between harvest workers, possibly on several machines
+work_queue = Table("matchmakeo_work_queue", state_metadata,
+    Column("product", String, primary_key=True),
+    Column("query_digest", String, primary_key=True, default=""),
+    Column("window_start", DateTime, primary_key=True),
+    Column("window_end", DateTime, primary_key=True),
+    Column("hits", Integer, nullable=True),
+    Column("claimed_by", String, nullable=True),
+    Column("claimed_at", DateTime, nullable=True),
+    Column("done", Boolean, nullable=False, default=False),
+)
+
+harvests = Table("matchmakeo_harvested_ranges", state_metadata,
+    Column("product", String, primary_key=True),
+    Column("query_digest", String, primary_key=True, default=""),
+    Column("range_start", DateTime, primary_key=True),
+    Column("range_end", DateTime, primary_key=True),
+    # start time of the last harvest of the range that ran to completion, used for incremental harvests
+    Column("last_harvest", DateTime, nullable=False),
+)
+
+# provenance of the pairs in materialised match tables
+match_runs = Table("matchmakeo_match_runs", state_metadata,
+    Column("run_id", String, primary_key=True),
+    Column("match_table", String, nullable=False),
+    Column("product_a", String, nullable=False),
+    Column("product_b", String, nullable=False),
+    Column("max_time_delta", Float, nullable=False),  # seconds
+    Column("min_overlap", Float, nullable=False),
+    Column("started_at", DateTime, nullable=False),
+    Column("finished_at", DateTime, nullable=True),
+    Column("pairs", Integer, nullable=False, default=0),
+)
+
 class Database(ABC):
 
     """Abstract class for database connections.
 
+    Each database owns a single engine, and so a single connection pool, created the first time it is needed.
+
     db_url (str): full custom connect string for database, will be used if specified
+    echo (bool): log every SQL statement, for debugging
+    pool_size (int): number of connections kept open in the pool
+    max_overflow (int): number of extra connections allowed beyond pool_size when the pool is busy
+    pool_pre_ping (bool): check connections are alive before handing them out, so dropped connections are replaced
+    metrics (Metrics): where to record write and schema change metrics, a new one by default
     """
+
+    # periods footprint tables can be range partitioned by, see `Product.partition_by`
+    PARTITION_INTERVALS = ("month", "year")
+
     def __init__(self,
                 database: str,
                 username: str,
@@ -27,6 +104,11 @@ class Database(ABC):
                 dialect: str = None,
                 driver: str = None,
                 db_url: str = None,
+                echo: bool = False,
+                pool_size: int = 5,
+                max_overflow: int = 10,
+                pool_pre_ping: bool = True,
+                metrics: Metrics = None,
             ):
         self.database = database
         self.username = username
@@ -36,9 +118,15 @@ class Database(ABC):
         self.dialect = dialect
         self.driver = driver
         self.db_url = db_url
+        self.echo = echo
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.pool_pre_ping = pool_pre_ping
+        self.metrics = metrics if metrics is not None else Metrics()
         
         self.engine = None
         self.connection = None
+        self.schema = SchemaManager()
         
     @property
     def url(self):
@@ -53,32 +141,654 @@ class Database(ABC):
             return f"{dialect_driver}://{self.username}:{self.password}@{self.host}:{self.port}/{self.database}"
     
     def create_engine(self) -> Engine:
-        self.engine = create_engine(
-            self.url,
-            echo=True,
-            plugins=["geoalchemy2"],
-        )
+        """Returns the database's engine, creating it on first use."""
+        if self.engine is None:
+            url = make_url(self.url)
+            pool_options = {}
+            # only queue pools are sized, in-memory SQLite databases get a single connection per thread instead
+            if issubclass(url.get_dialect().get_pool_class(url), QueuePool):
+                pool_options.update(pool_size=self.pool_size, max_overflow=self.max_overflow)
+
+            self.engine = create_engine(
+                url,
+                echo=self.echo,
+                pool_pre_ping=self.pool_pre_ping,
+                plugins=["geoalchemy2"],
+                **pool_options,
+            )
         return self.engine
     
     def connect(self) -> Connection:
-        if self.engine:
-            try:
-                self.connection = self.engine.connect()
-            except ConnectionError:
-                raise ConnectionError(f"Database connection failed. Aborting.")
-            
+        """Returns the database's shared connection, opening it if there isn't one open already.
+
+        Use `pooled_connection()` or `transaction()` for a connection of your own which is returned to the pool afterwards.
+        """
+        if self.connection is not None and not self.connection.closed:
             return self.connection
-        
-        else:
+
+        if not self.engine:
             log.info(f"No connection available yet. Trying to connect to {self.url}")
-            self.create_engine()
-            return self.connect()
+
+        try:
+            self.connection = self.create_engine().connect()
+        except ConnectionError:
+            raise ConnectionError(f"Database connection failed. Aborting.")
+
+        return self.connection
+
+    @contextmanager
+    def pooled_connection(self) -> Iterator[Connection]:
+        """Context manager for a connection from the pool, returned to the pool on exit."""
+        with self.create_engine().connect() as connection:
+            yield connection
+
+    @contextmanager
+    def transaction(self) -> Iterator[Connection]:
+        """Context manager for a connection from the pool in a transaction, committed on exit or rolled back on error."""
+        with self.create_engine().begin() as connection:
+            yield connection
+
+    def pool_status(self) -> dict:
+        """Statistics for the engine's connection pool, empty if the engine hasn't been created yet."""
+        if self.engine is None:
+            return {}
+
+        pool = self.engine.pool
+        stats = {"status": pool.status()}
+        for stat in ("size", "checkedin", "checkedout", "overflow"):
+            if hasattr(pool, stat):
+                stats[stat] = getattr(pool, stat)()
+        return stats
+
+    def close(self):
+        """Close the shared connection and all pooled connections. The engine is recreated if needed again."""
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+        if self.engine is not None:
+            self.engine.dispose()
+            self.engine = None
+
+    def __enter__(self):
+        return self
+
+    def __getstate__(self):
+        # engines and connections can't be sent to other processes, they are recreated there on first use
+        return {**self.__dict__, "engine": None, "connection": None}
+
+    def __exit__(self, *exc_info):
+        self.close()
 
     def write_gdf(self, gdf:GeoDataFrame, table:str):
         pass
 
-    def create_columns_from_footprint_props(self, table:Table, props:dict):
-        pass
+    @contextmanager
+    def bulk_load(self, connection:Connection) -> Iterator[Connection]:
+        """Context manager tuning a connection for a large ingest, with its previous settings restored on exit.
+
+        Does nothing by default, databases override it where relaxing durability for the ingest pays off.
+        """
+        yield connection
+
+    def insert_footprints(self,
+                          connection:Connection,
+                          table:Table,
+                          rows:list[dict],
+                          on_conflict:str = None,
+                          ) -> int:
+        """Insert a batch of footprint rows as a single multi-row insert and commit once.
+
+        The rows are sent as one executemany call (pipelined by psycopg on PostgreSQL, a single transaction on SQLite)
+        rather than one statement and commit per row.
+
+        on_conflict (str): what to do with rows whose primary key already exists, "nothing" to keep the existing row
+            or "update" to overwrite it. By default conflicts raise an error.
+
+        Returns the number of rows written, which leaves out rows skipped by on_conflict="nothing".
+        """
+        if not rows:
+            return 0
+
+        try:
+            with self.metrics.timer("db_write", table=table.name):
+                result = connection.execute(self._insert(connection, table, on_conflict=on_conflict), rows)
+                connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+
+        # drivers which can't count the rows of an executemany report -1
+        written = result.rowcount if result.rowcount >= 0 else len(rows)
+        self.metrics.increment("rows_written", written, table=table.name)
+        return written
+
+    @staticmethod
+    def _insert(connection:Connection, table:Table, on_conflict:str = None, update_columns:list[str] = None):
+        """Build an insert for the table, optionally resolving primary key conflicts with ON CONFLICT.
+
+        update_columns (list[str]): columns overwritten when on_conflict is "update", defaults to all non-key columns.
+        """
+        if on_conflict is None:
+            return insert(table)
+
+        dialects = {
+            "postgresql": postgresql.insert,
+            "sqlite": sqlite.insert,
+        }
+        try:
+            statement = dialects[connection.dialect.name](table)
+        except KeyError:
+            raise NotImplementedError(f"Upserts are not supported for {connection.dialect.name} databases.")
+
+        index_elements = [c.name for c in table.primary_key.columns]
+
+        if on_conflict == "nothing":
+            return statement.on_conflict_do_nothing(index_elements=index_elements)
+        elif on_conflict == "update":
+            if update_columns is None:
+                update_columns = [c.name for c in table.columns if c.name not in index_elements]
+            return statement.on_conflict_do_update(
+                index_elements=index_elements,
+                set_={name: statement.excluded[name] for name in update_columns},
+            )
+        else:
+            raise ValueError(f"on_conflict must be 'nothing' or 'update', got {on_conflict}")
+
+    def create_state_tables(self, connection:Connection):
+        """Create the tables recording harvest checkpoints, the work queue, last harvests and match runs, if they don't
+        already exist."""
+        state_metadata.create_all(connection, checkfirst=True)
+        connection.commit()
+
+    def get_checkpoints(self, connection:Connection, product:str, query_digest:str = "") -> dict:
+        """Returns `{(window_start, window_end): (search_after, completed)}` for all recorded windows of a product's
+        harvests with the given query digest."""
+        result = connection.execute(
+            select(checkpoints.c.window_start, checkpoints.c.window_end, checkpoints.c.search_after, checkpoints.c.completed)
+            .where(checkpoints.c.product == product, checkpoints.c.query_digest == query_digest)
+        )
+        return {(r.window_start, r.window_end): (r.search_after, r.completed) for r in result}
+
+    def save_checkpoints(self, connection:Connection, product:str, windows:list[tuple], query_digest:str = ""):
+        """Record progress for a product's windows and commit.
+
+        windows (list[tuple]): `(window_start, window_end, search_after, completed)` for each window.
+        query_digest (str): digest of the query the windows were harvested with, see `NasaCMR._query_digest`.
+        """
+        if not windows:
+            return
+
+        now = utcnow()
+        rows = [{
+            "product": product,
+            "query_digest": query_digest,
+            "window_start": start,
+            "window_end": end,
+            "search_after": search_after,
+            "completed": completed,
+            "updated_at": now,
+        } for start, end, search_after, completed in windows]
+
+        connection.execute(self._insert(connection, checkpoints, on_conflict="update"), rows)
+        connection.commit()
+
+    def enqueue_windows(self, connection:Connection, product:str, windows:list[Window], query_digest:str = "") -> int:
+        """Add a product's windows to the work queue for harvest workers to claim and commit.
+
+        Windows already in the queue for the same query digest are left as they are. Returns the number of windows given.
+        """
+        rows = [{"product": product, "query_digest": query_digest, "window_start": w.start, "window_end": w.end,
+                 "hits": w.hits, "done": False}
+                for w in windows]
+        if rows:
+            connection.execute(self._insert(connection, work_queue, on_conflict="nothing"), rows)
+        connection.commit()
+        return len(rows)
+
+    def claim_window(self,
+                     connection:Connection,
+                     product:str,
+                     worker:str,
+                     claim_timeout:timedelta,
+                     start:datetime = None,
+                     end:datetime = None,
+                     query_digest:str = "",
+                     ) -> Window|None:
+        """Claim the earliest unclaimed window of a product from the work queue and commit, or None if none are left.
+
+        Windows claimed more than `claim_timeout` ago without being completed are assumed to belong to a worker
+        which died and are handed out again. On PostGIS concurrent workers skip each others' locked rows rather
+        than waiting for them, on SQLite claims are serialised by the database lock.
+
+        start, end (datetime): only claim windows within these dates, so workers harvesting different date ranges
+            of a product don't take each others' windows.
+        query_digest (str): only claim windows queued by harvests with this query digest.
+        """
+        now = utcnow()
+        candidate = (
+            select(work_queue.c.product, work_queue.c.query_digest, work_queue.c.window_start, work_queue.c.window_end)
+            .where(work_queue.c.product == product,
+                   work_queue.c.query_digest == query_digest,
+                   work_queue.c.done.is_(False),
+                   or_(work_queue.c.claimed_at.is_(None), work_queue.c.claimed_at < now - claim_timeout),
+                   *self._queue_range(start, end))
+            .order_by(work_queue.c.window_start)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+        )
+        claimed = connection.execute(
+            update(work_queue)
+            .where(tuple_(work_queue.c.product, work_queue.c.query_digest, work_queue.c.window_start,
+                          work_queue.c.window_end).in_(candidate))
+            .values(claimed_by=worker, claimed_at=now)
+            .returning(work_queue.c.window_start, work_queue.c.window_end, work_queue.c.hits)
+        ).first()
+        connection.commit()
+
+        return Window(claimed.window_start, claimed.window_end, claimed.hits) if claimed else None
+
+    @staticmethod
+    def _queue_range(start:datetime = None, end:datetime = None) -> list:
+        """Conditions limiting the work queue to windows between start and end."""
+        conditions = []
+        if start is not None:
+            conditions.append(work_queue.c.window_start >= start)
+        if end is not None:
+            conditions.append(work_queue.c.window_end <= end)
+        return conditions
+
+    def complete_windows(self, connection:Connection, product:str, windows:list[tuple], query_digest:str = ""):
+        """Mark a product's windows in the work queue as done and commit.
+
+        windows (list[tuple]): `(window_start, window_end)` of each window.
+        """
+        if not windows:
+            return
+
+        for start, end in windows:
+            connection.execute(
+                update(work_queue)
+                .where(work_queue.c.product == product, work_queue.c.query_digest == query_digest,
+                       work_queue.c.window_start == start, work_queue.c.window_end == end)
+                .values(done=True)
+            )
+        connection.commit()
+
+    def get_queue_status(self,
+                         connection:Connection,
+                         product:str,
+                         start:datetime = None,
+                         end:datetime = None,
+                         query_digest:str = "",
+                         ) -> dict:
+        """Number of a product's windows in the work queue with the given query digest which are pending, claimed
+        and done, optionally only counting the windows between start and end."""
+        row = connection.execute(
+            select(
+                func.count().label("total"),
+                func.count().filter(work_queue.c.done.is_(True)).label("done"),
+                func.count().filter(and_(work_queue.c.done.is_(False), work_queue.c.claimed_at.is_not(None))).label("claimed"),
+            ).where(work_queue.c.product == product, work_queue.c.query_digest == query_digest,
+                    *self._queue_range(start, end))
+        ).one()
+        return {"pending": row.total - row.done - row.claimed, "claimed": row.claimed, "done": row.done}
+
+    def get_harvests(self, connection:Connection, product:str, query_digest:str = "") -> dict:
+        """Returns `{(range_start, range_end): last_harvest}` for the date ranges of a product which have been
+        harvested to completion with the given query digest."""
+        result = connection.execute(
+            select(harvests.c.range_start, harvests.c.range_end, harvests.c.last_harvest)
+            .where(harvests.c.product == product, harvests.c.query_digest == query_digest)
+        )
+        return {(r.range_start, r.range_end): r.last_harvest for r in result}
+
+    def save_last_harvest(self,
+                          connection:Connection,
+                          product:str,
+                          start:datetime,
+                          end:datetime,
+                          harvested_at:datetime,
+                          query_digest:str = "",
+                          ):
+        """Record the start time of a harvest of a product from `start` to `end` which ran to completion and commit."""
+        connection.execute(
+            self._insert(connection, harvests, on_conflict="update"),
+            [{"product": product, "query_digest": query_digest, "range_start": start, "range_end": end,
+              "last_harvest": harvested_at}],
+        )
+        connection.commit()
+
+    def create_columns_from_footprint_props(
+            self,
+            table_name:str,
+            catalogue_fields:list[Field],
+            product_fields:list[Field],
+            props:list[dict],
+            connection:Connection = None,
+            ):
+        """Add columns to the table for any properties in the batch which don't have one yet.
+
+        Properties with predefined fields already have columns, all others get a column with the same name.
+        Once a table's columns are known this costs no database queries.
+        """
+        if not props:
+            return
+
+        if connection is None:
+            connection = self.connection or self.connect()
+
+        # the *catalogue* names of all fields with names and types defined internally or by the user,
+        # and the properties they are read from
+        predefined_fields_catalogue_names = ({f.catalogue_name for f in catalogue_fields + product_fields}
+                                             | {f.source_key for f in catalogue_fields + product_fields})
+
+        added = self.schema.ensure_columns(connection, table_name, props, ignore=predefined_fields_catalogue_names)
+        if added:
+            self.metrics.increment("schema_changes", len(added), table=table_name)
+
+    def create_indexes(self, connection:Connection, table:Table, time_index:str = "btree"):
+        """Create the spatial index on a footprint table's geometry and indexes on its datetime columns and commit.
+
+        Tables with bounding box columns also get an index on them. Indexes which already exist are left as they are.
+
+        time_index (str): "btree", or "brin" for compact block range indexes on PostGIS,
+            which suit footprints inserted in roughly chronological order.
+        """
+        if time_index not in ("btree", "brin"):
+            raise ValueError(f"time_index must be 'btree' or 'brin', got {time_index}")
+
+        self._create_spatial_index(connection, table, "geometry")
+
+        for column_name in ("datetime_start", "datetime_end"):
+            index = Index(f"ix_{table.name}_{column_name}", table.c[column_name], postgresql_using=time_index)
+            index.create(connection, checkfirst=True)
+
+        if "ymin" in table.c:
+            # latitude first, longitude ranges wrap at the antimeridian
+            index = Index(f"ix_{table.name}_bbox", *(table.c[name] for name in ("ymin", "ymax", "xmin", "xmax")))
+            index.create(connection, checkfirst=True)
+
+        connection.commit()
+
+    def _create_spatial_index(self, connection:Connection, table:Table, column_name:str):
+        raise NotImplementedError
+
+    def ensure_partitions(self, connection:Connection, table_name:str, partition_by:str, datetimes:Iterable[datetime]) -> list[str]:
+        """Create the partitions of a partitioned footprint table needed to hold rows starting at `datetimes`."""
+        raise NotImplementedError(f"{type(self).__name__} doesn't support partitioned footprint tables.")
+
+    def detach_partitions(self, connection:Connection, table_name:str, before:datetime) -> list[str]:
+        """Detach the partitions of a partitioned footprint table holding only rows from before `before`."""
+        raise NotImplementedError(f"{type(self).__name__} doesn't support partitioned footprint tables.")
+
+    def analyze(self, connection:Connection, table:Table):
+        """Refresh the query planner's statistics for a table, e.g. after a bulk load, and commit."""
+        connection.execute(text(f'ANALYZE "{table.name}"'))
+        connection.commit()
+
+    def match(self,
+              product_a: Product,
+              product_b: Product,
+              max_time_delta: timedelta,
+              min_overlap: float = 0.0,
+              with_overlap: bool = False,
+              with_geometry: bool = False,
+              chunk_size: int = 10_000,
+              start: datetime = None,
+              end: datetime = None,
+              ) -> Iterator[list[dict]]:
+        """Find pairs of footprints from two products which intersect and were acquired within `max_time_delta`
+        of each other.
+
+        The join runs in the database and results are streamed back in chunks of up to `chunk_size` pairs,
+        so arbitrarily large match sets never have to fit in memory.
+
+        Params:
+            max_time_delta(timedelta): largest allowed gap between the two footprints' acquisition periods.
+            min_overlap(float): smallest fraction of product_a's footprint area covered by the intersection.
+            with_overlap(bool): include the overlap fraction in the results as "overlap".
+            with_geometry(bool): include the intersection as a shapely geometry in the results as "geometry".
+            start(datetime), end(datetime): only match footprints of product_a starting in [start, end), against
+                footprints of product_b starting up to max_time_delta either side. Lets PostGIS skip the partitions
+                of time partitioned tables outside the period, and any table use its datetime indexes.
+
+        Yields lists of dicts with keys id_a, id_b, datetime_start_a, datetime_start_b and optionally overlap, geometry.
+        """
+        query = self._match_query(product_a, product_b,
+                                  max_time_delta=max_time_delta,
+                                  min_overlap=min_overlap,
+                                  with_overlap=with_overlap,
+                                  with_geometry=with_geometry,
+                                  start=start,
+                                  end=end)
+
+        with self.pooled_connection() as connection:
+            result = connection.execution_options(stream_results=True, yield_per=chunk_size).execute(query)
+
+            for partition in result.mappings().partitions():
+                pairs = [dict(row) for row in partition]
+
+                if with_geometry:
+                    geometries = shapely.from_wkb([bytes(p["geometry"]) if p["geometry"] is not None else None for p in pairs])
+                    for pair, geometry in zip(pairs, geometries):
+                        pair["geometry"] = geometry
+
+                yield pairs
+
+    def create_match_table(self, connection:Connection, match:MaterialisedMatch) -> Table:
+        """Create the table holding a materialised match's pairs, and the state tables, if they don't exist and commit.
+
+        Pairs are keyed by (id_a, id_b), with the run which found them.
+        """
+        self.create_state_tables(connection)
+
+        table = self._match_table(match.table_name)
+        table.create(connection, checkfirst=True)
+        connection.commit()
+        return table
+
+    def start_match_run(self, connection:Connection, match:MaterialisedMatch) -> str:
+        """Record the start of a run adding pairs to a match table, with its parameters, and commit.
+
+        Returns the run id, stored against every pair the run adds.
+        """
+        run_id = uuid.uuid4().hex
+        connection.execute(insert(match_runs), [{
+            "run_id": run_id,
+            "match_table": match.table_name,
+            "product_a": match.product_a.table,
+            "product_b": match.product_b.table,
+            "max_time_delta": match.max_time_delta.total_seconds(),
+            "min_overlap": match.min_overlap,
+            "started_at": utcnow(),
+            "pairs": 0,
+        }])
+        connection.commit()
+        return run_id
+
+    def finish_match_run(self, connection:Connection, run_id:str):
+        """Record the end of a match run and commit."""
+        connection.execute(update(match_runs).where(match_runs.c.run_id == run_id).values(finished_at=utcnow()))
+        connection.commit()
+
+    def update_matches(self,
+                       connection: Connection,
+                       match: MaterialisedMatch,
+                       run_id: str,
+                       ids_a: list = None,
+                       ids_b: list = None,
+                       key: str = "id",
+                       ) -> int:
+        """Add the pairs involving new footprints to a match table in a single INSERT ... SELECT, and commit.
+
+        Only footprints of product a with ids in `ids_a`, or of product b with ids in `ids_b`, are joined against
+        the whole of the other product, so the cost depends on the new footprints rather than the size of the tables.
+        With neither, every pair is found. Pairs already in the table are kept as they are.
+
+        key (str): column of the footprint tables which `ids_a` and `ids_b` are values of, their primary key.
+
+        Returns the number of pairs added.
+        """
+        query = self._match_query(match.product_a, match.product_b,
+                                  max_time_delta=match.max_time_delta,
+                                  min_overlap=match.min_overlap,
+                                  with_overlap=True,
+                                  ids_a=ids_a,
+                                  ids_b=ids_b,
+                                  key=key)
+        query = query.add_columns(literal(run_id, String).label("run_id"))
+
+        table = self._match_table(match.table_name)
+        statement = self._insert(connection, table, on_conflict="nothing").from_select(
+            ["id_a", "id_b", "datetime_start_a", "datetime_start_b", "overlap", "run_id"], query)
+
+        try:
+            with self.metrics.timer("match_update", table=table.name):
+                pairs = connection.execute(statement).rowcount
+                connection.execute(update(match_runs).where(match_runs.c.run_id == run_id)
+                                   .values(pairs=match_runs.c.pairs + pairs))
+                connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+
+        self.metrics.increment("pairs_matched", pairs, table=table.name)
+        return pairs
+
+    def refresh_matches(self, match:MaterialisedMatch) -> int:
+        """Add every pair between the two products' tables as they are to the match table, creating it if needed,
+        e.g. to start a match table for products which have already been harvested.
+
+        Returns the number of pairs added.
+        """
+        with self.pooled_connection() as connection:
+            self.create_match_table(connection, match)
+            run_id = self.start_match_run(connection, match)
+            pairs = self.update_matches(connection, match, run_id)
+            self.finish_match_run(connection, run_id)
+
+        log.info(f"Added {pairs} pairs to {match.table_name}")
+        return pairs
+
+    @staticmethod
+    def _match_table(name:str) -> Table:
+        """Definition of a materialised match table, pairs keyed by (id_a, id_b) with the run which found them."""
+        return Table(name, MetaData(),
+            Column("id_a", String, primary_key=True),
+            Column("id_b", String, primary_key=True),
+            Column("datetime_start_a", DateTime),
+            Column("datetime_start_b", DateTime),
+            Column("overlap", Float),
+            Column("run_id", String, nullable=False),
+            Index(f"ix_{name}_id_b", "id_b"),
+        )
+
+    def _match_query(self,
+                     product_a: Product,
+                     product_b: Product,
+                     max_time_delta: timedelta,
+                     min_overlap: float = 0.0,
+                     with_overlap: bool = False,
+                     with_geometry: bool = False,
+                     start: datetime = None,
+                     end: datetime = None,
+                     ids_a: list = None,
+                     ids_b: list = None,
+                     key: str = "id",
+                     ) -> Select:
+        """Build the spatio-temporal join used by `match`, optionally limited to footprints whose `key` column is
+        one of the given ids."""
+        bbox = product_a.bbox_columns and product_b.bbox_columns
+        a = self._footprint_table(product_a.table, bbox=bbox, key=key).alias("a")
+        b = self._footprint_table(product_b.table, bbox=bbox, key=key).alias("b")
+
+        intersection = func.ST_Intersection(a.c.geometry, b.c.geometry)
+        # fraction of a's footprint covered by b, NULL for degenerate footprints with no area
+        overlap = func.ST_Area(intersection) / func.nullif(func.ST_Area(a.c.geometry), 0)
+
+        columns = [
+            a.c.id.label("id_a"),
+            b.c.id.label("id_b"),
+            a.c.datetime_start.label("datetime_start_a"),
+            b.c.datetime_start.label("datetime_start_b"),
+        ]
+        if with_overlap or min_overlap:
+            columns.append(overlap.label("overlap"))
+        if with_geometry:
+            columns.append(func.ST_AsBinary(intersection).label("geometry"))
+
+        # look up the candidates of the side limited to given ids, if only one is, in the other side's spatial index
+        if ids_a is not None and ids_b is None:
+            intersects = self._intersects_predicate(b, a, product_b.table)
+        else:
+            intersects = self._intersects_predicate(a, b, product_a.table)
+
+        query = select(*columns).where(
+            intersects,
+            self._time_window_predicate(a, b, max_time_delta),
+        )
+        if bbox:
+            query = query.where(self._bbox_predicate(a, b))
+        # constant bounds on both tables' datetime_start, so partitions outside them are pruned when planning
+        if start is not None:
+            query = query.where(a.c.datetime_start >= start, b.c.datetime_start >= start - max_time_delta)
+        if end is not None:
+            query = query.where(a.c.datetime_start < end, b.c.datetime_start < end + max_time_delta)
+        if ids_a is not None:
+            query = query.where(a.c[key].in_(ids_a))
+        if ids_b is not None:
+            query = query.where(b.c[key].in_(ids_b))
+        if min_overlap:
+            query = query.where(overlap >= min_overlap)
+
+        return query
+
+    @staticmethod
+    def _footprint_table(name:str, bbox:bool = False, key:str = "id"):
+        """Lightweight reference to the columns of a footprint table needed for matching, without reflection."""
+        columns = [
+            column("id"),
+            column("geometry", Geometry),
+            column("datetime_start", DateTime),
+            column("datetime_end", DateTime),
+        ]
+        if key != "id":
+            columns.append(column(key))
+        if bbox:
+            columns.extend(column(name, Float) for name in ("xmin", "ymin", "xmax", "ymax"))
+        return table(name, *columns)
+
+    @staticmethod
+    def _bbox_predicate(a, b):
+        """True where the bounding boxes of a and b overlap, a cheap numeric prefilter for the exact intersection test.
+
+        Boxes across the antimeridian have xmin > xmax and cover both [xmin, 180] and [-180, xmax].
+        """
+        a_wraps = a.c.xmin > a.c.xmax
+        b_wraps = b.c.xmin > b.c.xmax
+        return and_(
+            a.c.ymin <= b.c.ymax,
+            b.c.ymin <= a.c.ymax,
+            or_(
+                and_(a.c.xmin <= b.c.xmax, b.c.xmin <= a.c.xmax),
+                # a box across the antimeridian overlaps another box reaching past either of its edges
+                and_(or_(a_wraps, b_wraps), or_(a.c.xmin <= b.c.xmax, b.c.xmin <= a.c.xmax)),
+                # two boxes across the antimeridian both contain it
+                and_(a_wraps, b_wraps),
+            ),
+        )
+
+    def _intersects_predicate(self, indexed, other, indexed_table:str):
+        """True where the footprints of `indexed` and `other` intersect, found through the spatial index of
+        `indexed_table` where it has to be queried explicitly."""
+        return func.ST_Intersects(indexed.c.geometry, other.c.geometry)
+
+    def _time_window_predicate(self, a, b, max_time_delta:timedelta):
+        """True where the acquisition periods of a and b are no more than max_time_delta apart."""
+        return and_(
+            a.c.datetime_start <= b.c.datetime_end + max_time_delta,
+            b.c.datetime_start <= a.c.datetime_end + max_time_delta,
+        )
 
 class PostGISDatabase(Database):
     """Database connection for PostGIS databases.
@@ -94,6 +804,7 @@ class PostGISDatabase(Database):
             db_url = None,
             dialect = "postgresql",
             driver = "psycopg",
+            **kwargs,
             ):
 
         super().__init__(
@@ -105,67 +816,145 @@ class PostGISDatabase(Database):
             db_url=db_url,
             dialect=dialect,
             driver=driver,
+            **kwargs,
             )
+        # names of each partitioned table's partitions, read from the catalog the first time they are needed
+        self._partitions = {}
         
     def write_gdf(self, gdf: GeoDataFrame, table:str):
-        engine = self.create_engine()
-        gdf.to_postgis(table, engine)
+        gdf.to_postgis(table, self.create_engine())
 
-    def create_columns_from_footprint_props(
-            self,
-            table_name:str,
-            catalogue_fields:list[dict],
-            product_fields:list[dict],
-            props:dict,
-            ):
-        
-        # get the existing table and its columns
-        metadata = MetaData()
-        table = Table(table_name, metadata, autoload_with=self.engine)
-        existing_column_names = set([c.name for c in table.columns])
+    def ensure_partitions(self, connection:Connection, table_name:str, partition_by:str, datetimes:Iterable[datetime]) -> list[str]:
+        """Create the partitions of a table range partitioned on datetime_start needed to hold rows starting at
+        `datetimes`, one per month or year, and commit.
 
-        gdf = GeoDataFrame(props)
-        properties = gdf.iloc[0].to_dict()
+        Partitions are named `<table>_<YYYY>` or `<table>_<YYYY>_<MM>`. Indexes on the partitioned table, including the
+        spatial and datetime indexes from `create_indexes`, are created on each new partition by PostgreSQL.
+        Once a table's partitions are known, checking a batch whose periods all have partitions costs no queries.
 
-        #TODO test
+        Returns the names of the partitions created.
+        """
+        periods = {self._partition_bounds(d, partition_by) for d in datetimes if d is not None}
+        wanted = {self._partition_name(table_name, start, partition_by): (start, end) for start, end in periods}
 
-        # get the corresponding *catalogue* names for all fields with names and types defined internally or by the user
-        predefined_fields_catalogue_names = [c.catalogue_name for c in catalogue_fields + product_fields]
+        missing = set(wanted) - self._known_partitions(connection, table_name)
+        if not missing:
+            return []
 
-        # work out which fields are in the data but are NOT already defined above
-        extra_fields = [f for f in list(properties.keys()) if f not in predefined_fields_catalogue_names]
+        try:
+            for name in sorted(missing):
+                start, end = wanted[name]
+                connection.execute(text(
+                    f'CREATE TABLE IF NOT EXISTS "{name}" PARTITION OF "{table_name}" '
+                    f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+                ))
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            # another worker may have created the same partitions in the meantime
+            if missing <= self._known_partitions(connection, table_name, refresh=True):
+                return []
+            raise
+
+        log.info(f"Created partitions of {table_name}: {sorted(missing)}")
+        self._partitions[table_name] = self._partitions[table_name] | missing
+        return sorted(missing)
+
+    def detach_partitions(self, connection:Connection, table_name:str, before:datetime) -> list[str]:
+        """Detach the partitions of a partitioned footprint table holding only rows from before `before`, and commit.
+
+        Detached partitions become ordinary tables with the same names, which can be archived, e.g. with pg_dump,
+        and dropped without vacuuming the rest of the table. They are no longer seen by queries on the table.
+
+        Returns the names of the partitions detached.
+        """
+        bounds = connection.execute(text(
+            "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent "
+            "WHERE p.relname = :table_name"
+        ), {"table_name": table_name}).all()
+
+        detached = []
+        for name, bound in bounds:
+            # e.g. FOR VALUES FROM ('2020-01-01 00:00:00') TO ('2020-02-01 00:00:00')
+            upper = re.search(r"TO \('([^']+)'\)", bound)
+            if upper and datetime.fromisoformat(upper.group(1)) <= before:
+                connection.execute(text(f'ALTER TABLE "{table_name}" DETACH PARTITION "{name}"'))
+                detached.append(name)
+        connection.commit()
+
+        if detached:
+            log.info(f"Detached partitions of {table_name}: {sorted(detached)}")
+            self._known_partitions(connection, table_name, refresh=True)
+        return sorted(detached)
+
+    def _known_partitions(self, connection:Connection, table_name:str, refresh:bool = False) -> set[str]:
+        if refresh or table_name not in self._partitions:
+            self._partitions[table_name] = set(connection.execute(text(
+                "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                "JOIN pg_class p ON p.oid = i.inhparent WHERE p.relname = :table_name"
+            ), {"table_name": table_name}).scalars())
+        return self._partitions[table_name]
+
+    @staticmethod
+    def _partition_bounds(d:datetime, partition_by:str) -> tuple[datetime, datetime]:
+        """Start and end of the month or year containing `d`."""
+        if partition_by == "month":
+            start = datetime(d.year, d.month, 1)
+            return start, datetime(d.year + d.month // 12, d.month % 12 + 1, 1)
+        elif partition_by == "year":
+            return datetime(d.year, 1, 1), datetime(d.year + 1, 1, 1)
+        raise ValueError(f"partition_by must be one of {Database.PARTITION_INTERVALS}, got {partition_by}")
+
+    @staticmethod
+    def _partition_name(table_name:str, start:datetime, partition_by:str) -> str:
+        return f"{table_name}_{start:%Y}" if partition_by == "year" else f"{table_name}_{start:%Y_%m}"
+
+    def _create_spatial_index(self, connection:Connection, table:Table, column_name:str):
+        # same name geoalchemy2 uses, so indexes it created are recognised
+        connection.execute(text(
+            f'CREATE INDEX IF NOT EXISTS "idx_{table.name}_{column_name}" ON "{table.name}" USING GIST ("{column_name}")'
+        ))
 
-        # get the *column* names
-        all_required_column_names = set([c.column_name for c in catalogue_fields + product_fields] + extra_fields)
 
-        # if all the columns we need already exist
-        if existing_column_names.issuperset(all_required_column_names):
-            return
-        else:
-            raw_connection = self.create_engine().raw_connection()
-            cursor = raw_connection.cursor()
-            # create new columns with types for any which do not already exist
-            for col_name in all_required_column_names.difference(existing_column_names):
-                data = properties.get(col_name, None)
-                if data is not None:
-                    sql_col_type = infer_sql_type(data)
-                    sql_cmd = f'ALTER TABLE {table_name} ADD COLUMN IF NOT EXISTS "{col_name}" {sql_col_type};'
-                    cursor.execute(sql_cmd)
-            
-            raw_connection.commit()
-            raw_connection.close()
-                
-        
 class SpatialiteDatabase(Database):
+    """Single file SQLite database with the Spatialite extension, loaded on every connection.
+
+    New databases are initialised with only the WGS84 spatial reference systems in a single transaction,
+    which takes a moment rather than the minutes a full initialisation does.
+
+    Params:
+        pragmas (dict): SQLite pragmas set on every connection, overriding the defaults in `PRAGMAS`.
+        bulk_pragmas (dict): pragmas set only for the duration of `bulk_load`, overriding `BULK_PRAGMAS`.
+    """
+
+    # write ahead logging lets readers carry on during ingests, and with it synchronous=NORMAL is still crash safe
+    PRAGMAS = {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -256 * 1024,  # negative sizes are in KiB, so 256MB
+        "mmap_size": 1024 ** 3,
+        "temp_store": "MEMORY",
+    }
+    # skips fsyncs altogether, a crash during the ingest can lose the rows written since the last checkpoint
+    BULK_PRAGMAS = {
+        "synchronous": "OFF",
+        "cache_size": -1024 * 1024,
+    }
 
     def __init__(
         self,
         filename: str|Path,
         db_url = None,
         dialect = "sqlite",
+        pragmas: dict = None,
+        bulk_pragmas: dict = None,
+        **kwargs,
         ):
 
         self.filename = filename
+        self.pragmas = {**self.PRAGMAS, **(pragmas or {})}
+        self.bulk_pragmas = {**self.BULK_PRAGMAS, **(bulk_pragmas or {})}
 
         os.environ["SPATIALITE_LIBRARY_PATH"] = "mod_spatialite"
 
@@ -178,6 +967,7 @@ class SpatialiteDatabase(Database):
             db_url=db_url,
             dialect=dialect,
             driver=None,
+            **kwargs,
             )
         
     @property
@@ -186,12 +976,132 @@ class SpatialiteDatabase(Database):
         if self.db_url:
             return self.db_url
         else:
+            # read by geoalchemy2's plugin when it loads mod_spatialite and initialises the spatial metadata
+            return (f"sqlite:///{self.filename}"
+                    "?geoalchemy2_connect_sqlite_init_mode=WGS84"
+                    "&geoalchemy2_connect_sqlite_transaction=true")
+
+    def create_engine(self) -> Engine:
+        """Returns the database's engine, creating it on first use with `pragmas` set on each new connection."""
+        if self.engine is None:
+            engine = super().create_engine()
+            event.listen(engine, "connect", self._set_pragmas)
+        return self.engine
+
+    def _set_pragmas(self, dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in self.pragmas.items():
+                cursor.execute(f"PRAGMA {name} = {value}")
+        finally:
+            cursor.close()
 
-            return f"sqlite:///{self.filename}"
-        
     def connect(self):
-        log.info(f"Connecting to {self.url}. Note that creating a new db can take a few minutes.")
+        log.info(f"Connecting to {self.url}")
         return super().connect()
+
+    @contextmanager
+    def bulk_load(self, connection:Connection) -> Iterator[Connection]:
+        """Context manager applying `bulk_pragmas` to the connection for an ingest, restoring their previous values on exit."""
+        # pragmas can't be changed inside a transaction, so start from a clean slate
+        connection.commit()
+        previous = {name: connection.exec_driver_sql(f"PRAGMA {name}").scalar() for name in self.bulk_pragmas}
+        for name, value in self.bulk_pragmas.items():
+            connection.exec_driver_sql(f"PRAGMA {name} = {value}")
+        try:
+            yield connection
+        finally:
+            connection.rollback()
+            for name, value in previous.items():
+                connection.exec_driver_sql(f"PRAGMA {name} = {value}")
+            connection.commit()
     
     def write_gdf(self, gdf:GeoDataFrame, table:str):
         gdf.to_file(self.filename, driver='SQLite', spatialite=True)
+
+    def insert_footprints(self,
+                          connection:Connection,
+                          table:Table,
+                          rows:list[dict],
+                          on_conflict:str = None,
+                          ) -> int:
+        """Insert a batch of footprint rows as a single multi-row insert and commit once, see `Database.insert_footprints`.
+
+        Geometries given as extended WKB, as `to_wkb_elements` makes them, are handed to Spatialite's `GeomFromEWKB`
+        as they are. geoalchemy2 would otherwise parse each of them with shapely to write it out again as EWKT.
+        """
+        geometry_columns = [c.name for c in table.columns if isinstance(c.type, Geometry)]
+        if all(row.get(name) is None or (isinstance(row[name], WKBElement) and row[name].extended)
+               for row in rows for name in geometry_columns):
+            table = self._ewkb_table(table)
+
+        return super().insert_footprints(connection, table, rows, on_conflict=on_conflict)
+
+    @staticmethod
+    def _ewkb_table(table:Table) -> Table:
+        """Copy of a table for inserts, with geometry columns bound as extended WKB."""
+        columns = [Column(c.name,
+                          _EWKBGeometry(c.type.geometry_type, srid=c.type.srid, spatial_index=False)
+                          if isinstance(c.type, Geometry) else c.type,
+                          primary_key=c.primary_key)
+                   for c in table.columns]
+        return Table(table.name, MetaData(), *columns)
+
+    def _create_spatial_index(self, connection:Connection, table:Table, column_name:str):
+        # Spatialite keeps R*Tree spatial indexes in virtual tables registered in geometry_columns
+        enabled = connection.execute(
+            text("SELECT spatial_index_enabled FROM geometry_columns "
+                 "WHERE f_table_name = lower(:table_name) AND f_geometry_column = lower(:column_name)"),
+            {"table_name": table.name, "column_name": column_name},
+        ).scalar()
+
+        if enabled is None:
+            # tables not created through geoalchemy2 have to be registered before they can be indexed
+            geometry_type = table.c[column_name].type
+            connection.execute(select(func.RecoverGeometryColumn(
+                table.name, column_name, geometry_type.srid, geometry_type.geometry_type, "XY")))
+
+        if not enabled:
+            connection.execute(select(func.CreateSpatialIndex(table.name, column_name)))
+
+    def _intersects_predicate(self, indexed, other, indexed_table:str):
+        # Spatialite doesn't use R*Tree indexes implicitly, they have to be queried through the SpatialIndex virtual table
+        candidates = (
+            select(column("rowid"))
+            .select_from(table("SpatialIndex"))
+            .where(column("f_table_name") == indexed_table,
+                   column("f_geometry_column") == "geometry",
+                   column("search_frame") == other.c.geometry)
+        )
+        return and_(
+            literal_column(f"{indexed.name}.rowid").in_(candidates),
+            func.ST_Intersects(indexed.c.geometry, other.c.geometry) == 1,
+        )
+
+    def _time_window_predicate(self, a, b, max_time_delta:timedelta):
+        # SQLite stores datetimes as text, so each side's start is compared as it is, where its datetime index can be
+        # used, with the other side's end shifted by max_time_delta and formatted like the stored values
+        modifier = f"{max_time_delta.total_seconds():+} seconds"
+
+        def shifted_end(footprints):
+            # SQLite keeps milliseconds, pad to the stored microseconds rounding up so the bound stays inclusive
+            return func.strftime("%Y-%m-%d %H:%M:%f", footprints.c.datetime_end, modifier).concat("999")
+
+        return and_(
+            a.c.datetime_start <= shifted_end(b),
+            b.c.datetime_start <= shifted_end(a),
+        )
+
+
+class _EWKBGeometry(Geometry):
+    """Geometry type binding `WKBElement`s to Spatialite as hex extended WKB, converted by `GeomFromEWKB`."""
+
+    cache_ok = True
+
+    def bind_expression(self, bindvalue):
+        return func.GeomFromEWKB(bindvalue, type_=self)
+
+    def bind_processor(self, dialect):
+        def process(value):
+            return value.desc if isinstance(value, WKBElement) else value
+        return process
@@ -1,18 +1,101 @@
-from sqlalchemy import Column
+from typing import Any, Callable
+import warnings
+
+from sqlalchemy import Boolean, Column, DateTime, Float, Integer
 from sqlalchemy.sql.type_api import TypeEngine
 
+from .utils import parse_datetime, setUpLogging
+
+log = setUpLogging(__name__)
+
+__all__ = [
+    "Field",
+    "to_bool",
+]
+
+
+def to_bool(value) -> bool:
+    """Converts CMR style flags such as "true", "TRUE", "1", "Y" or "DAY" to a bool."""
+    if isinstance(value, str):
+        return value.strip().lower() in ("true", "t", "1", "y", "yes", "day")
+    return bool(value)
+
 
 class Field(dict):
-    """Fields to be created in database."""
-    def __init__(self, catalogue_name:str, column_name:str, column_type:TypeEngine):
+    """Fields to be created in database.
+
+    Params:
+        catalogue_name(str): name of the property in the catalogue's metadata.
+        column_name(str): name of the column in the footprint table.
+        column_type(TypeEngine): SQL Alchemy type of the column.
+        source(str): dotted path to the value in the granule's properties, e.g. "time_start" or "links.0.href",
+            `catalogue_name` by default.
+        converter(callable): turns the raw value into the column's type, e.g. `to_bool` for "DAY"/"NIGHT" flags.
+            By default ISO 8601 strings are parsed for DateTime columns, and numeric and boolean columns are cast.
+            Missing and null values are stored as NULL without being converted.
+    """
+    def __init__(self,
+                 catalogue_name:str,
+                 column_name:str,
+                 column_type:TypeEngine,
+                 source:str = None,
+                 converter:Callable[[Any], Any] = None,
+                 ):
         self.catalogue_name = catalogue_name
         self.column_name = column_name
+        self.source = source or catalogue_name
+        self._path = self.source.split(".")
 
         if isinstance(column_type, TypeEngine) or issubclass(column_type, TypeEngine):
             self.type = column_type
         else:
             warnings.warn(f"Custom field types must be SQL Alchemy types. Got {type(column_type)} for {column_name}.\n\
                           Unexpected behaviour may occur.")
-            
-    def _as_column(self):
-        return Column(self.column_name, self.type)
\ No newline at end of file
+
+        self.converter = converter or self._default_converter()
+
+    @property
+    def source_key(self) -> str:
+        "The top level property the field is read from."
+        return self._path[0]
+
+    def value(self, properties:dict):
+        """The field's value for a granule, read from its properties and converted, None if it is missing or
+        can't be converted."""
+        value = properties
+        for key in self._path:
+            try:
+                value = value[int(key)] if isinstance(value, list) else value[key]
+            except (KeyError, IndexError, ValueError, TypeError):
+                return None
+
+        if value is None:
+            return None
+        try:
+            return self.converter(value)
+        except (ValueError, TypeError) as e:
+            log.warning(f"Couldn't convert {value!r} for {self.column_name}: {e}")
+            return None
+
+    def _default_converter(self) -> Callable[[Any], Any]:
+        column_type = getattr(self, "type", None)
+        if column_type is None:
+            return _identity
+        column_type = column_type if isinstance(column_type, type) else type(column_type)
+
+        if issubclass(column_type, DateTime):
+            return parse_datetime
+        elif issubclass(column_type, Boolean):
+            return to_bool
+        elif issubclass(column_type, Integer):
+            return int
+        elif issubclass(column_type, Float):
+            return float
+        return _identity
+
+    def _as_column(self, primary_key:bool = False):
+        return Column(self.column_name, self.type, primary_key=primary_key)
+
+
+def _identity(value):
+    return value
@@ -0,0 +1,23 @@
+from dataclasses import dataclass, field
+from datetime import datetime
+
+import shapely
+
+__all__ = [
+    "Footprint",
+]
+
+@dataclass(slots=True)
+class Footprint:
+    "A single granule's footprint as returned by a catalogue."
+
+    id: str
+    geometry: shapely.Geometry | None
+    datetime_start: datetime | None
+    datetime_end: datetime | None
+    # remaining catalogue metadata for the granule
+    properties: dict = field(default_factory=dict)
+    # (xmin, ymin, xmax, ymax), with xmin > xmax for footprints across the antimeridian
+    bbox: tuple[float, float, float, float] | None = None
+    # whether the footprint covers a pole
+    polar: bool = False
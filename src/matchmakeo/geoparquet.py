@@ -0,0 +1,236 @@
+import json
+from pathlib import Path
+import shutil
+from typing import Iterable, Iterator
+
+from geopandas import GeoDataFrame
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from pyproj import CRS
+import shapely
+from sqlalchemy import MetaData, Table, func, select
+
+from .databases import Database
+from .parsing import to_wkb_elements
+from .utils import setUpLogging
+
+log = setUpLogging(__name__)
+
+__all__ = [
+    "write_geoparquet",
+    "export_geoparquet",
+    "iter_geoparquet",
+    "import_geoparquet",
+]
+
+PARTITION_COLUMNS = ["product", "month"]
+
+
+def write_geoparquet(chunks:Iterable[list[dict]],
+                     path:str|Path,
+                     product:str,
+                     time_column:str = None,
+                     geometry_column:str = "geometry",
+                     srid:int = 4326,
+                     ) -> int:
+    """Write chunks of footprint rows to a GeoParquet dataset partitioned by product and month, one chunk at a time.
+
+    Rows can come from a footprint table, `Database.match` or `FootprintIndex.match`. Geometries may be shapely
+    geometries or WKB and are stored as WKB. Files land in hive style `product=<product>/month=<YYYY-MM>` directories
+    under `path`, named after the product and chunk number. Any files of the product from before are removed first,
+    so writing it again replaces them, however the rows are chunked, rather than adding duplicates alongside them.
+
+    Params:
+        time_column(str): datetime column giving each row's month partition. By default `datetime_start`, or for
+            match results, which have no such column, product a's `datetime_start_a`.
+
+    Returns the number of rows written.
+    """
+    schema = None
+    written = 0
+
+    shutil.rmtree(Path(path) / f"product={product}", ignore_errors=True)
+
+    for i, rows in enumerate(chunks):
+        if not rows:
+            continue
+
+        geometries = [row.get(geometry_column) for row in rows]
+        if not all(g is None or isinstance(g, bytes) for g in geometries):
+            geometries = shapely.to_wkb(np.asarray(geometries, dtype=object)).tolist()
+        rows = [{**row, geometry_column: geometry} for row, geometry in zip(rows, geometries)]
+
+        table = pa.Table.from_pylist(rows)
+        # a column which is all null in one chunk takes its type from the others
+        schema = table.schema if schema is None else pa.unify_schemas([schema, table.schema])
+        table = pa.Table.from_pylist(rows, schema=schema)
+
+        if time_column is None:
+            time_column = _time_column(table.column_names)
+        months = pc.strftime(table[time_column], format="%Y-%m")
+        table = (table.append_column("product", pa.array([product] * len(table)))
+                      .append_column("month", months)
+                      .replace_schema_metadata({b"geo": _geo_metadata(geometry_column, srid)}))
+
+        pq.write_to_dataset(table, root_path=path,
+                            partition_cols=PARTITION_COLUMNS,
+                            basename_template=f"{product}-{i}-{{i}}.parquet",
+                            existing_data_behavior="overwrite_or_ignore")
+        written += len(table)
+
+    log.info(f"Wrote {written} rows of {product} to {path}")
+    return written
+
+
+def export_geoparquet(database:Database,
+                      table_name:str,
+                      path:str|Path,
+                      chunk_size:int = 100_000,
+                      geometry_column:str = "geometry",
+                      ) -> int:
+    """Stream a footprint table out of the database into a GeoParquet dataset, partitioned by product and month.
+
+    The table is read `chunk_size` rows at a time with a server side cursor, so it never has to fit in memory.
+
+    Returns the number of rows written.
+    """
+    with database.pooled_connection() as connection:
+        table = Table(table_name, MetaData(), autoload_with=connection)
+        columns = [func.ST_AsBinary(c).label(c.name) if c.name == geometry_column else c for c in table.columns]
+
+        result = connection.execution_options(stream_results=True, yield_per=chunk_size).execute(select(*columns))
+        chunks = ([{**row, geometry_column: _as_bytes(row[geometry_column])} for row in partition]
+                  for partition in result.mappings().partitions())
+
+        return write_geoparquet(chunks, path, product=table_name, geometry_column=geometry_column)
+
+
+def iter_geoparquet(path:str|Path,
+                    columns:list[str] = None,
+                    filter:ds.Expression = None,
+                    batch_size:int = 100_000,
+                    ) -> Iterator[GeoDataFrame]:
+    """Read a GeoParquet dataset in GeoDataFrames of up to `batch_size` rows.
+
+    Params:
+        columns(list[str]): columns to read, all of them by default. The geometry column is always read.
+        filter(pyarrow.dataset.Expression): rows to read, e.g. `pyarrow.dataset.field("product") == "terra"`.
+            Filters on product and month skip whole partitions without opening them.
+    """
+    dataset = _dataset(path)
+    crs = _crs(dataset.schema)
+    geometry_column = _geometry_column(dataset.schema)
+
+    for batch in _iter_batches(dataset, columns, filter, batch_size, geometry_column):
+        geometry = shapely.from_wkb(batch.column(geometry_column).to_numpy(zero_copy_only=False))
+        frame = batch.drop_columns([geometry_column]).to_pandas()
+        frame[geometry_column] = geometry
+        yield GeoDataFrame(frame, geometry=geometry_column, crs=crs)
+
+
+def import_geoparquet(path:str|Path,
+                      database:Database,
+                      table:Table|str,
+                      filter:ds.Expression = None,
+                      batch_size:int = 10_000,
+                      on_conflict:str = "nothing",
+                      ) -> int:
+    """Bulk load a GeoParquet dataset into an existing footprint table, `batch_size` rows per insert.
+
+    Only the columns the table has are loaded. The inserts run inside `Database.bulk_load`.
+
+    Params:
+        table(Table|str): the footprint table, e.g. as created by `Catalogue._create_table`, or its name.
+        filter(pyarrow.dataset.Expression): rows to load, e.g. `pyarrow.dataset.field("product") == "terra"`.
+        on_conflict(str): passed to `Database.insert_footprints`, rows already in the table are kept by default.
+
+    Returns the number of rows written.
+    """
+    dataset = _dataset(path)
+    srid = _crs(dataset.schema).to_epsg() or 4326
+    geometry_column = _geometry_column(dataset.schema)
+    written = 0
+
+    with database.pooled_connection() as connection, database.bulk_load(connection):
+        if isinstance(table, str):
+            table = Table(table, MetaData(), autoload_with=connection)
+
+        columns = [name for name in dataset.schema.names if name in table.c]
+
+        for batch in _iter_batches(dataset, columns, filter, batch_size, geometry_column):
+            geometries = to_wkb_elements(shapely.from_wkb(batch.column(geometry_column).to_numpy(zero_copy_only=False)),
+                                         srid=srid)
+            rows = batch.drop_columns([geometry_column]).to_pylist()
+            for row, geometry in zip(rows, geometries):
+                row[geometry_column] = geometry
+
+            written += database.insert_footprints(connection, table, rows, on_conflict=on_conflict)
+
+    log.info(f"Loaded {written} rows from {path} into {table.name}")
+    return written
+
+
+def _dataset(path:str|Path) -> ds.Dataset:
+    return ds.dataset(path, format="parquet", partitioning="hive")
+
+
+def _iter_batches(dataset:ds.Dataset,
+                  columns:list[str],
+                  filter:ds.Expression,
+                  batch_size:int,
+                  geometry_column:str = "geometry",
+                  ) -> Iterator[pa.RecordBatch]:
+    if columns is not None and geometry_column not in columns:
+        columns = [*columns, geometry_column]
+
+    for batch in dataset.to_batches(columns=columns, filter=filter, batch_size=batch_size):
+        if batch.num_rows:
+            yield batch
+
+
+def _geo_metadata(geometry_column:str, srid:int) -> bytes:
+    """GeoParquet 1.0 file metadata for a single WKB geometry column."""
+    return json.dumps({
+        "version": "1.0.0",
+        "primary_column": geometry_column,
+        "columns": {
+            geometry_column: {
+                "encoding": "WKB",
+                "geometry_types": [],
+                "crs": CRS.from_epsg(srid).to_json_dict(),
+            },
+        },
+    }).encode()
+
+
+def _time_column(column_names:list[str]) -> str:
+    """The column to partition rows by month on, datetime_start for footprints or datetime_start_a for matches."""
+    for name in ("datetime_start", "datetime_start_a"):
+        if name in column_names:
+            return name
+    raise ValueError(f"No datetime_start or datetime_start_a column to partition by in {column_names}, "
+                     f"pass time_column.")
+
+
+def _geometry_column(schema:pa.Schema) -> str:
+    """Name of the dataset's primary geometry column, from its GeoParquet metadata."""
+    return _geo(schema).get("primary_column", "geometry")
+
+
+def _geo(schema:pa.Schema) -> dict:
+    return json.loads((schema.metadata or {}).get(b"geo", b"{}"))
+
+
+def _crs(schema:pa.Schema) -> CRS:
+    """CRS of the dataset's primary geometry column, which GeoParquet defaults to lon/lat WGS84."""
+    metadata = _geo(schema)
+    column = metadata.get("columns", {}).get(metadata.get("primary_column"), {})
+    return CRS.from_user_input(column["crs"]) if column.get("crs") else CRS.from_user_input("OGC:CRS84")
+
+
+def _as_bytes(wkb) -> bytes|None:
+    # PostgreSQL drivers return bytea as memoryview
+    return bytes(wkb) if wkb is not None else None
@@ -0,0 +1,186 @@
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Iterable, Iterator
+
+from geopandas import GeoDataFrame
+import numpy as np
+import shapely
+
+from .footprint import Footprint
+from .product import Product
+from .utils import setUpLogging
+
+log = setUpLogging(__name__)
+
+__all__ = [
+    "FootprintIndex",
+    "MaterialisedMatch",
+]
+
+
+@dataclass
+class MaterialisedMatch:
+    """Pairs of footprints from two products, as found by `Database.match`, kept in a table of their own.
+
+    Pass to `NasaCMR.download_footprints` to add the pairs made by each batch of new footprints as it is written,
+    or to `Database.refresh_matches` to find all pairs between the tables as they are.
+
+    Params:
+        table(str): name of the match table, `matches_<table_a>_<table_b>` by default.
+    """
+
+    product_a: Product
+    product_b: Product
+    max_time_delta: timedelta
+    min_overlap: float = 0.0
+    table: str = None
+
+    @property
+    def table_name(self) -> str:
+        return self.table or f"matches_{self.product_a.table}_{self.product_b.table}"
+
+
+class FootprintIndex:
+    """In-memory footprints of a single product, sorted by acquisition start time, for matching without a database.
+
+    Matching gives the same pairs as `Database.match`: footprints which intersect and whose acquisition periods
+    are no more than `max_time_delta` apart. Footprints missing a start or end time never match, as in the database,
+    and are left out of the index.
+    """
+
+    def __init__(self, ids:Iterable, geometries:Iterable, datetime_start:Iterable, datetime_end:Iterable):
+        ids = np.asarray(ids, dtype=object)
+        geometries = np.asarray(geometries, dtype=object)
+        datetime_start = np.asarray(datetime_start, dtype="datetime64[us]")
+        datetime_end = np.asarray(datetime_end, dtype="datetime64[us]")
+
+        if not len(ids) == len(geometries) == len(datetime_start) == len(datetime_end):
+            raise ValueError("ids, geometries, datetime_start and datetime_end must all be the same length.")
+
+        # a single NaT would otherwise become the longest duration, and the time bounds of every block
+        timed = np.flatnonzero(~np.isnat(datetime_start) & ~np.isnat(datetime_end))
+        order = timed[np.argsort(datetime_start[timed], kind="stable")]
+
+        self.ids = ids[order]
+        self.geometries = geometries[order]
+        self.datetime_start = datetime_start[order]
+        self.datetime_end = datetime_end[order]
+
+        # longest acquisition period, bounds how far before a time window a footprint can start and still overlap it
+        durations = self.datetime_end - self.datetime_start
+        self.max_duration = durations.max() if len(durations) else np.timedelta64(0, "us")
+
+        self._tree = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def from_footprints(cls, footprints:Iterable[Footprint]) -> "FootprintIndex":
+        """Build an index from footprints, e.g. from `NasaCMR.iter_footprints` or `NasaCMR._download_single_date`."""
+        ids, geometries, starts, ends = [], [], [], []
+        for footprint in footprints:
+            if footprint.geometry is None:
+                continue
+            ids.append(footprint.id)
+            geometries.append(footprint.geometry)
+            starts.append(footprint.datetime_start)
+            ends.append(footprint.datetime_end)
+
+        return cls(ids, geometries, starts, ends)
+
+    @classmethod
+    def from_geodataframe(cls,
+                          gdf: GeoDataFrame,
+                          id_column: str = "id",
+                          start_column: str = "datetime_start",
+                          end_column: str = "datetime_end",
+                          ) -> "FootprintIndex":
+        """Build an index from a GeoDataFrame of footprints, e.g. one read from a footprint table."""
+        return cls(gdf[id_column].to_numpy(),
+                   gdf.geometry.to_numpy(),
+                   gdf[start_column].to_numpy(dtype="datetime64[us]"),
+                   gdf[end_column].to_numpy(dtype="datetime64[us]"))
+
+    @property
+    def tree(self) -> shapely.STRtree:
+        """Spatial index over all footprints, built on first use."""
+        if self._tree is None:
+            self._tree = shapely.STRtree(self.geometries)
+        return self._tree
+
+    def match(self,
+              other: "FootprintIndex",
+              max_time_delta: timedelta,
+              min_overlap: float = 0.0,
+              with_overlap: bool = False,
+              with_geometry: bool = False,
+              chunk_size: int = 10_000,
+              block_size: int = 200,
+              ) -> Iterator[list[dict]]:
+        """Find pairs of footprints from this index (a) and `other` (b) which intersect and were acquired within
+        `max_time_delta` of each other, yielding them in chunks of up to `chunk_size` pairs.
+
+        Footprints of a are processed `block_size` at a time. For each block, the time-sorted footprints of b are cut
+        down to those that can fall within the time tolerance with a binary search, and only those are bulk queried
+        through an STRtree for intersections, so memory stays bounded by the block rather than the product.
+
+        Params and results are the same as `Database.match`.
+        """
+        delta = np.timedelta64(max_time_delta)
+        pairs = []
+
+        for block_start in range(0, len(self), block_size):
+            block = slice(block_start, block_start + block_size)
+
+            # b footprints starting late enough to end after the block's first start, and early enough to start
+            # before its last end, allowing for the time tolerance
+            earliest = self.datetime_start[block][0] - delta - other.max_duration
+            latest = self.datetime_end[block].max() + delta
+            lo = np.searchsorted(other.datetime_start, earliest, side="left")
+            hi = np.searchsorted(other.datetime_start, latest, side="right")
+            if lo >= hi:
+                continue
+
+            tree = shapely.STRtree(other.geometries[lo:hi])
+            ia, ib = tree.query(self.geometries[block], predicate="intersects")
+            ia += block_start
+            ib += lo
+
+            # exact time window test on the spatial candidates
+            in_time = ((self.datetime_start[ia] <= other.datetime_end[ib] + delta)
+                       & (other.datetime_start[ib] <= self.datetime_end[ia] + delta))
+            ia, ib = ia[in_time], ib[in_time]
+
+            columns = {
+                "id_a": self.ids[ia],
+                "id_b": other.ids[ib],
+                "datetime_start_a": self.datetime_start[ia].tolist(),
+                "datetime_start_b": other.datetime_start[ib].tolist(),
+            }
+
+            if with_overlap or min_overlap or with_geometry:
+                intersections = shapely.intersection(self.geometries[ia], other.geometries[ib])
+                areas = shapely.area(self.geometries[ia])
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    overlap = np.where(areas > 0, shapely.area(intersections) / areas, np.nan)
+
+                if min_overlap:
+                    keep = overlap >= min_overlap
+                    columns = {k: np.asarray(v, dtype=object)[keep] for k, v in columns.items()}
+                    intersections, overlap = intersections[keep], overlap[keep]
+
+                if with_overlap or min_overlap:
+                    columns["overlap"] = overlap
+                if with_geometry:
+                    columns["geometry"] = intersections
+
+            keys = list(columns)
+            for row in zip(*columns.values()):
+                pairs.append(dict(zip(keys, row)))
+                if len(pairs) >= chunk_size:
+                    yield pairs
+                    pairs = []
+
+        if pairs:
+            yield pairs
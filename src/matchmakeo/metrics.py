@@ -0,0 +1,152 @@
+from contextlib import contextmanager
+import json
+from pathlib import Path
+import threading
+import time
+from typing import Callable, Iterator
+
+__all__ = [
+    "Metrics",
+]
+
+# called with the metric's name, the value observed and its labels
+Hook = Callable[[str, float, dict], None]
+
+
+class Metrics:
+    """Thread-safe collection of the counters and timers recorded by catalogues and databases during harvests.
+
+    Counters add up values, e.g. bytes received or rows written. Timers record durations in seconds and are
+    summarised by their count, total and maximum. Either can carry labels, e.g. the table written to.
+    Each observation is also passed to every hook, to forward it to a monitoring system as it happens.
+
+    Share one instance between a catalogue and a database to summarise a whole harvest in one place.
+
+    Metrics recorded:
+        http_request (timer): latency of requests which went to the catalogue, including retries.
+        http_bytes_received, http_retries, cache_hits (counters)
+        parse (timer), granules_parsed (counter): turning pages of responses into footprints.
+        granules_filtered (counter): footprints dropped for falling outside the queryset's region.
+        db_write (timer), rows_written (counter): inserting batches of footprints, labelled by table.
+        schema_changes (counter): columns added to footprint tables, labelled by table.
+        match_update (timer), pairs_matched (counter): adding pairs to materialised match tables, labelled by table.
+    """
+
+    def __init__(self, hooks:list[Hook] = None):
+        self.hooks = list(hooks or [])
+        self.started = time.time()
+        self._counters = {}
+        self._timers = {}
+        self._lock = threading.Lock()
+
+    def add_hook(self, hook:Hook):
+        self.hooks.append(hook)
+
+    def increment(self, name:str, value:float = 1, **labels):
+        """Add `value` to a counter."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+        self._notify(name, value, labels)
+
+    def observe(self, name:str, seconds:float, **labels):
+        """Record a duration for a timer."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            count, total, maximum = self._timers.get(key, (0, 0.0, 0.0))
+            self._timers[key] = (count + 1, total + seconds, max(maximum, seconds))
+        self._notify(name, seconds, labels)
+
+    @contextmanager
+    def timer(self, name:str, **labels) -> Iterator[None]:
+        """Context manager recording how long its body takes, even if it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def counter(self, name:str, **labels) -> float:
+        """Current value of a counter, 0 if nothing has been counted."""
+        return self._counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def total_seconds(self, name:str, **labels) -> float:
+        """Total time recorded by a timer."""
+        return self._timers.get((name, tuple(sorted(labels.items()))), (0, 0.0, 0.0))[1]
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._timers.clear()
+            self.started = time.time()
+
+    def summary(self) -> dict:
+        """Summary of everything recorded so far, in a form which can be serialised to JSON."""
+        with self._lock:
+            counters = [{"name": name, "labels": dict(labels), "value": value}
+                        for (name, labels), value in sorted(self._counters.items())]
+            timers = [{"name": name, "labels": dict(labels), "count": count, "total_seconds": total,
+                       "mean_seconds": total / count, "max_seconds": maximum}
+                      for (name, labels), (count, total, maximum) in sorted(self._timers.items())]
+
+        return {
+            "started": self.started,
+            "elapsed_seconds": time.time() - self.started,
+            "counters": counters,
+            "timers": timers,
+        }
+
+    def to_json(self, path:str|Path = None) -> str:
+        """The summary as JSON, also written to `path` if one is given."""
+        text = json.dumps(self.summary(), indent=2)
+        if path is not None:
+            Path(path).write_text(text)
+        return text
+
+    def to_prometheus(self, path:str|Path = None, prefix:str = "matchmakeo") -> str:
+        """Everything recorded so far in the Prometheus/OpenMetrics text format, also written to `path` if one is
+        given, e.g. for node_exporter's textfile collector.
+
+        Counters are exported as `<prefix>_<name>_total` and timers as summaries, `<prefix>_<name>_seconds`.
+        """
+        lines = []
+        with self._lock:
+            for name in sorted({name for name, _ in self._counters}):
+                metric = f"{prefix}_{name}"
+                lines.append(f"# TYPE {metric} counter")
+                for (n, labels), value in sorted(self._counters.items()):
+                    if n == name:
+                        lines.append(f"{metric}_total{_labels(labels)} {value}")
+
+            for name in sorted({name for name, _ in self._timers}):
+                metric = f"{prefix}_{name}_seconds"
+                lines.append(f"# TYPE {metric} summary")
+                lines.append(f"# UNIT {metric} seconds")
+                for (n, labels), (count, total, _) in sorted(self._timers.items()):
+                    if n == name:
+                        lines.append(f"{metric}_count{_labels(labels)} {count}")
+                        lines.append(f"{metric}_sum{_labels(labels)} {total}")
+        lines.append("# EOF")
+
+        text = "\n".join(lines) + "\n"
+        if path is not None:
+            Path(path).write_text(text)
+        return text
+
+    def _notify(self, name:str, value:float, labels:dict):
+        for hook in self.hooks:
+            hook(name, value, labels)
+
+    def __getstate__(self):
+        # each process records its own metrics, hooks may not survive being sent to it
+        return {"hooks": []}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+
+def _labels(labels:tuple) -> str:
+    if not labels:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in labels)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + "}"
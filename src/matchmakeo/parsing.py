@@ -0,0 +1,223 @@
+from itertools import chain
+import json
+from typing import NamedTuple
+
+from geoalchemy2 import WKBElement
+import numpy as np
+import shapely
+from shapely.affinity import translate
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+__all__ = [
+    "decode_cmr_feed",
+    "parse_cmr_geometries",
+    "normalise_geometries",
+    "NormalisedGeometries",
+    "to_wkb_elements",
+]
+
+WORLD = shapely.box(-180, -90, 180, 90)
+
+
+def decode_cmr_feed(content:bytes, keys:set[str] = None) -> list[dict]:
+    """Decode the granule entries of a CMR granules.json response body.
+
+    Uses orjson if it is installed, which decodes pages several times faster than the standard library and straight
+    from bytes, without decoding the body to a str first.
+
+    Params:
+        keys(set[str]): only keep these keys of each entry, so the rest are freed as soon as the page is decoded
+            rather than being carried through parsing.
+    """
+    feed = orjson.loads(content) if orjson is not None else json.loads(content)
+    entries = feed["feed"]["entry"]
+
+    if keys is not None:
+        entries = [{k: entry[k] for k in keys if k in entry} for entry in entries]
+    return entries
+
+
+def parse_cmr_geometries(entries:list[dict]) -> np.ndarray:
+    """Build the footprint geometry of each CMR granule entry in a page, in bulk.
+
+    CMR gives `polygons` as a list of polygons, each a list of rings of space separated "lat lon" pairs where the
+    first ring is the outer boundary and any others are holes. All rings in the page are parsed into one flat
+    coordinate buffer and turned into geometries with shapely's vectorised constructors. Granules with several
+    polygons become MultiPolygons. Granules with only a bounding `boxes` entry ("S W N E") become boxes, running past
+    180 degrees east if they cross the antimeridian, for `normalise_geometries` to split.
+
+    Returns an object array of shapely geometries, None for entries without spatial extent.
+    """
+    geometries = np.full(len(entries), None, dtype=object)
+
+    rings = []
+    ring_polygon = []
+    polygon_entry = []
+    boxes = []
+    box_entry = []
+
+    for i, entry in enumerate(entries):
+        if entry.get("polygons"):
+            for polygon in entry["polygons"]:
+                for ring in polygon:
+                    rings.append(ring.split())
+                    ring_polygon.append(len(polygon_entry))
+                polygon_entry.append(i)
+        elif entry.get("boxes"):
+            boxes.append(entry["boxes"][0].split())
+            box_entry.append(i)
+
+    if rings:
+        ring_lengths = np.fromiter(map(len, rings), dtype=np.intp, count=len(rings)) // 2
+        # "lat lon" pairs to (x, y) coordinates
+        coords = np.array(list(chain.from_iterable(rings)), dtype=np.float64).reshape(-1, 2)[:, ::-1]
+
+        linearrings = shapely.linearrings(coords, indices=np.repeat(np.arange(len(rings)), ring_lengths))
+        # the first ring of each polygon is its shell, the rest are holes
+        polygons = shapely.polygons(linearrings, indices=ring_polygon)
+
+        polygon_entry = np.asarray(polygon_entry)
+        entry_ids, first, counts = np.unique(polygon_entry, return_index=True, return_counts=True)
+
+        single = counts == 1
+        geometries[entry_ids[single]] = polygons[first[single]]
+
+        multi_ids = entry_ids[~single]
+        if len(multi_ids):
+            multi = np.isin(polygon_entry, multi_ids)
+            _, multi_index = np.unique(polygon_entry[multi], return_inverse=True)
+            geometries[multi_ids] = shapely.multipolygons(polygons[multi], indices=multi_index)
+
+    if boxes:
+        south, west, north, east = np.array(boxes, dtype=np.float64).T
+        # boxes across the antimeridian have their west edge east of their east edge
+        east = np.where(west > east, east + 360, east)
+        geometries[box_entry] = shapely.box(west, south, east, north)
+
+    return geometries
+
+
+class NormalisedGeometries(NamedTuple):
+    "Footprint geometries fixed up by `normalise_geometries`, with their bounding boxes."
+
+    geometries: np.ndarray
+    # (xmin, ymin, xmax, ymax) per geometry, NaN for missing geometries. Boxes across the antimeridian have
+    # xmin > xmax, like CMR's and STAC's bounding boxes.
+    bounds: np.ndarray
+    # footprints which cover a pole, whose boxes span every longitude
+    polar: np.ndarray
+
+
+def normalise_geometries(geometries:np.ndarray, simplify_tolerance:float = None) -> NormalisedGeometries:
+    """Make lon/lat footprints safe to index and intersect.
+
+    Footprints crossing the antimeridian, which otherwise become polygons wrapping the other way round the globe,
+    are split into MultiPolygons at 180 degrees. Footprints circling a pole are closed through it before being split.
+    Invalid geometries, e.g. with self-intersecting rings, are repaired and optionally all are simplified to
+    `simplify_tolerance` degrees, preserving their topology.
+
+    Only geometries whose bounds span more than 180 degrees of longitude, or reach beyond 180 degrees either way,
+    are checked for crossings, so the common case costs a vectorised bounds calculation.
+    """
+    geometries = np.asarray(geometries, dtype=object).copy()
+    present = ~shapely.is_missing(geometries)
+
+    bounds = shapely.bounds(geometries)
+    polar = np.zeros(len(geometries), dtype=bool)
+
+    crossing = (bounds[:, 2] - bounds[:, 0] > 180) | (bounds[:, 0] < -180) | (bounds[:, 2] > 180)
+    for i in np.flatnonzero(present & crossing):
+        geometries[i], bounds[i], polar[i] = _split_antimeridian(geometries[i])
+
+    invalid = present & ~shapely.is_valid(geometries)
+    if invalid.any():
+        geometries[invalid] = shapely.make_valid(geometries[invalid], method="structure", keep_collapsed=False)
+
+    if simplify_tolerance:
+        geometries[present] = shapely.simplify(geometries[present], simplify_tolerance, preserve_topology=True)
+
+    return NormalisedGeometries(geometries, bounds, polar)
+
+
+def _split_antimeridian(geometry:shapely.Geometry) -> tuple[shapely.Geometry, tuple, bool]:
+    """Split a geometry whose rings jump across the antimeridian, returning it with its wrapped bounds and whether
+    it covers a pole."""
+    parts = []
+    intervals = []
+    polar = False
+
+    for polygon in shapely.get_parts(geometry):
+        if polygon.geom_type != "Polygon":
+            parts.append(polygon)
+            continue
+
+        shell = _unwrap(np.asarray(polygon.exterior.coords))
+        if abs(shell[-1, 0] - shell[0, 0]) > 180:
+            # the ring goes all the way round, so it circles the pole on the side of the footprint
+            pole = 90.0 if shell[:, 1].mean() > 0 else -90.0
+            shell = np.vstack([shell, [(shell[-1, 0], pole), (shell[0, 0], pole), shell[0]]])
+            polar = True
+
+        # bring the shell back to start within [-180, 180), with its holes alongside
+        offset = -360.0 * np.floor((shell[:, 0].min() + 180) / 360)
+        shell[:, 0] += offset
+        holes = []
+        for interior in polygon.interiors:
+            hole = _unwrap(np.asarray(interior.coords))
+            hole[:, 0] += 360.0 * np.round((shell[0, 0] - hole[0, 0]) / 360)
+            holes.append(hole)
+
+        unwrapped = shapely.Polygon(shell, holes)
+        if not unwrapped.is_valid:
+            unwrapped = shapely.make_valid(unwrapped, method="structure", keep_collapsed=False)
+        west, _, east, _ = unwrapped.bounds
+        intervals.append((west, east))
+
+        # the part beyond 180 degrees east is moved back round to the western hemisphere
+        parts.extend(shapely.get_parts(shapely.intersection(unwrapped, WORLD)))
+        parts.extend(shapely.get_parts(translate(shapely.intersection(unwrapped, shapely.box(180, -90, 540, 90)), xoff=-360)))
+
+    parts = [p for p in parts if not p.is_empty and p.geom_type == "Polygon"]
+    if not parts:
+        return geometry, shapely.bounds(geometry), False
+    split = shapely.MultiPolygon(parts) if len(parts) > 1 else parts[0]
+    _, south, _, north = split.bounds
+
+    if intervals:
+        # line the parts' longitude ranges up with the first one to find the range covering them all
+        first = intervals[0][0]
+        aligned = [(w + 360.0 * np.round((first - w) / 360), e + 360.0 * np.round((first - w) / 360)) for w, e in intervals]
+        west = min(w for w, _ in aligned)
+        east = max(e for _, e in aligned)
+    else:
+        west, _, east, _ = split.bounds
+
+    if polar or east - west >= 360:
+        west, east = -180.0, 180.0
+    else:
+        west = (west + 180) % 360 - 180
+        east = (east + 180) % 360 - 180 if east != 180 else 180.0
+
+    return split, (west, south, east, north), polar
+
+
+def _unwrap(coords:np.ndarray) -> np.ndarray:
+    """Coordinates with longitude jumps of more than 180 degrees between vertices removed, so rings are continuous."""
+    coords = coords[:, :2].copy()
+    coords[:, 0] = np.unwrap(coords[:, 0], period=360)
+    return coords
+
+
+def to_wkb_elements(geometries:np.ndarray, srid:int = 4326) -> list[WKBElement|None]:
+    """Serialise geometries to extended WKB in bulk, ready to insert into a geometry column.
+
+    Extended WKB carries the SRID, so it is passed straight through to the database without being
+    converted to WKT first.
+    """
+    geometries = shapely.set_srid(np.asarray(geometries, dtype=object), srid)
+    wkbs = shapely.to_wkb(geometries, hex=True, include_srid=True)
+    return [WKBElement(wkb, srid=srid, extended=True) if wkb is not None else None for wkb in wkbs]
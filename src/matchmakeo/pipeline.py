@@ -0,0 +1,137 @@
+from collections import deque
+import queue
+import threading
+from typing import Callable, Iterable, Iterator
+
+__all__ = [
+    "Pipeline",
+    "ordered_chain",
+]
+
+# end of stream marker passed through the queues
+_DONE = object()
+
+
+class _Failure:
+    "Wraps an exception raised in a stage thread so it can be re-raised downstream."
+
+    def __init__(self, error:BaseException):
+        self.error = error
+
+
+def _put(q:queue.Queue, item, stop:threading.Event) -> bool:
+    """Put an item on a bounded queue, giving up if the pipeline is stopped. Returns whether the item was put."""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _drain(q:queue.Queue, stop:threading.Event) -> Iterator:
+    """Yield items from a queue until the end of stream marker, re-raising failures from upstream."""
+    while not stop.is_set():
+        try:
+            item = q.get(timeout=0.1)
+        except queue.Empty:
+            continue
+
+        if item is _DONE:
+            return
+        if isinstance(item, _Failure):
+            raise item.error
+        yield item
+
+
+def _produce(items:Iterable, q:queue.Queue, stop:threading.Event):
+    """Feed an iterable into a queue, followed by the end of stream marker or the exception it raised."""
+    try:
+        for item in items:
+            if not _put(q, item, stop):
+                return
+    except BaseException as e:
+        _put(q, _Failure(e), stop)
+        return
+    _put(q, _DONE, stop)
+
+
+class Pipeline:
+    """A chain of stages run concurrently, each in its own thread, connected by bounded queues.
+
+    A stage is a callable taking an iterator of items and returning an iterator of items, typically a generator.
+    Each stage can be run or benchmarked on its own by calling it directly. At most `maxsize` items wait between
+    two stages, so a slow stage holds back the ones before it rather than letting items pile up in memory.
+    An exception in any stage is re-raised to the consumer.
+
+    Params:
+        threaded(bool): run the stages in threads. If False, the stages are simply chained as generators in the
+            consumer's thread, which is easier to profile.
+    """
+
+    def __init__(self, *stages:Callable[[Iterator], Iterator], maxsize:int = 4, threaded:bool = True):
+        self.stages = stages
+        self.maxsize = maxsize
+        self.threaded = threaded
+
+    def __call__(self, source:Iterable) -> Iterator:
+        if not self.threaded:
+            items = iter(source)
+            for stage in self.stages:
+                items = stage(items)
+            return items
+
+        return self._run_threaded(source)
+
+    def _run_threaded(self, source:Iterable) -> Iterator:
+        stop = threading.Event()
+
+        items = source
+        for stage in self.stages:
+            q = queue.Queue(maxsize=self.maxsize)
+            threading.Thread(target=_produce,
+                             args=(stage(items), q, stop),
+                             name=f"pipeline-{getattr(stage, '__name__', 'stage')}",
+                             daemon=True).start()
+            items = _drain(q, stop)
+
+        try:
+            yield from items
+        finally:
+            # unblocks every stage if the consumer stops early
+            stop.set()
+
+
+def ordered_chain(func:Callable[..., Iterable], items:Iterable, max_workers:int, maxsize:int = 4) -> Iterator:
+    """Run `func(item)` for up to `max_workers` items at once and yield everything they produce, in item order.
+
+    Each item's output is buffered in its own queue of at most `maxsize` values, so workers which are ahead of the
+    consumer wait for it rather than buffering their whole output.
+    """
+    stop = threading.Event()
+    running = deque()
+    items = iter(items)
+
+    def start_next() -> bool:
+        for item in items:
+            q = queue.Queue(maxsize=maxsize)
+            threading.Thread(target=_produce, args=(_lazy(func, item), q, stop), daemon=True).start()
+            running.append(q)
+            return True
+        return False
+
+    try:
+        while len(running) < max_workers and start_next():
+            pass
+
+        while running:
+            yield from _drain(running.popleft(), stop)
+            start_next()
+    finally:
+        stop.set()
+
+
+def _lazy(func:Callable[..., Iterable], item) -> Iterator:
+    """Defer calling `func` until iteration starts, so it runs in the producing thread."""
+    yield from func(item)
@@ -8,8 +8,32 @@ __all__ = [
 
 @dataclass
 class Product:
+    """A catalogue product and the table its footprints are harvested into.
+
+    Params:
+        extra_fields(list[Field]): columns filled from each granule's properties, besides the catalogue's own.
+        projection(bool): keep only the declared fields. Otherwise every property the catalogue returns gets a column
+            of its own.
+        overflow_column(str): name of a JSON column (JSONB on PostGIS) holding the properties which have no declared
+            field, so nothing is lost while the table stays narrow. Implies `projection`.
+        simplify_tolerance(float): simplify footprints to this tolerance in degrees before storing them.
+        bbox_columns(bool): store each footprint's bounding box in indexed `xmin`, `ymin`, `xmax` and `ymax` columns,
+            with a `polar` flag, so matches are prefiltered with numeric range comparisons before exact
+            geometry tests. Boxes across the antimeridian have `xmin > xmax`.
+        partition_by(str): "month" or "year" to range partition the table on `datetime_start` (PostGIS only).
+            Partitions are created as harvests reach new periods, and `datetime_start` joins the primary key.
+    """
 
     short_name: str
     table: str
     extra_fields: list = field(default_factory=list)
+    projection: bool = False
+    overflow_column: str = None
+    simplify_tolerance: float = None
+    bbox_columns: bool = False
+    partition_by: str = None
 
+    @property
+    def projected(self) -> bool:
+        "Whether columns are limited to the declared fields."
+        return self.projection or self.overflow_column is not None
@@ -1,5 +1,11 @@
-from dataclasses import dataclass
-from datetime import date
+from dataclasses import dataclass, field
+from datetime import date, datetime
+
+import numpy as np
+from pyproj import Geod
+import shapely
+
+from .windows import DailyWindows, WindowPolicy
 
 __all__ = [
     "Queryset",
@@ -12,8 +18,44 @@ class Queryset:
 
     start_date: date
     end_date: date
-    #  spatial range
     page_size: int = 200
+    # how the date range is split into catalogue queries
+    window_policy: WindowPolicy = field(default_factory=DailyWindows)
+
+    # spatial range, footprints must intersect all of those given. Coordinates are longitude, latitude in degrees.
+    # (west, south, east, north), crossing the antimeridian if west > east
+    bounding_box: tuple[float, float, float, float] = None
+    # Polygon or MultiPolygon, holes are ignored by catalogues
+    polygon: shapely.Geometry = None
+    # (longitude, latitude, radius in metres)
+    circle: tuple[float, float, float] = None
+    # also drop footprints which the catalogue returned but which don't intersect the region exactly,
+    # catalogues may match on simplified footprints or bounding rectangles
+    post_filter: bool = False
+
+    def region(self) -> shapely.Geometry|None:
+        """The spatial range as a single geometry, or None if the queryset covers the whole globe."""
+        parts = []
+
+        if self.bounding_box is not None:
+            west, south, east, north = self.bounding_box
+            if west > east:
+                parts.append(shapely.union(shapely.box(west, south, 180, north), shapely.box(-180, south, east, north)))
+            else:
+                parts.append(shapely.box(west, south, east, north))
+
+        if self.polygon is not None:
+            parts.append(self.polygon)
+
+        if self.circle is not None:
+            lon, lat, radius = self.circle
+            azimuths = np.linspace(0, 360, 64, endpoint=False)
+            lons, lats, _ = Geod(ellps="WGS84").fwd(np.full(64, lon), np.full(64, lat), azimuths, np.full(64, radius))
+            parts.append(shapely.Polygon(zip(lons, lats)))
+
+        if not parts:
+            return None
+        return shapely.intersection_all(parts)
 
 
 @dataclass(kw_only=True)
@@ -21,3 +63,5 @@ class NasaCMRQueryset(Queryset):
     "Extends the base Queryset with parameters specific to NASA CMR queries."
     
     version: str = None
+    # only granules added or updated in CMR since this time, set automatically by incremental harvests
+    updated_since: datetime = None
@@ -0,0 +1,155 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field
+import time
+
+from .catalogues import Catalogue
+from .databases import Database
+from .product import Product
+from .queryset import Queryset
+from .utils import RateLimiter, setUpLogging
+
+log = setUpLogging(__name__)
+
+__all__ = [
+    "HarvestJob",
+    "HarvestResult",
+    "HarvestScheduler",
+    "harvest_processes",
+]
+
+
+@dataclass
+class HarvestJob:
+    "A product to harvest from a catalogue, with options passed on to `Catalogue.download_footprints`."
+
+    catalogue: Catalogue
+    product: Product
+    queryset: Queryset
+    options: dict = field(default_factory=dict)
+
+
+@dataclass
+class HarvestResult:
+    "Outcome of a harvest job, with the error it raised if it failed."
+
+    job: HarvestJob
+    rows_written: int = 0
+    seconds: float = 0.0
+    error: BaseException = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+class HarvestScheduler:
+    """Runs several products' harvests at once, sharing the database's connection pool between them.
+
+    Each job runs `download_footprints` in its own thread with its own progress bar, so a multi-product backfill
+    takes about as long as its slowest product rather than the sum of all of them. Jobs using the same catalogue
+    instance also share its HTTP session and connection pool, so its `pool_maxsize` should cover the workers of
+    all of them, as the database's `pool_size` should cover the number of jobs.
+
+    Params:
+        max_jobs(int): number of jobs run at once, all of them by default.
+        rate_limit(float): maximum number of requests per second across all jobs. Requests are served in the order
+            they are made, so jobs interleave fairly rather than one starving the others. Each catalogue's own
+            rate limit is restored after the run.
+    """
+
+    def __init__(self, database:Database, max_jobs:int = None, rate_limit:float = None):
+        self.database = database
+        self.max_jobs = max_jobs
+        self.rate_limit = rate_limit
+
+    def run(self, jobs:list[HarvestJob]) -> list[HarvestResult]:
+        """Run the jobs and return their results in the same order.
+
+        The state tables, and the match tables of any `matches` options, are created before the jobs start.
+        A failing job doesn't stop the others, its exception is logged and kept in its result.
+        """
+        if not jobs:
+            return []
+
+        # created once up front, jobs starting together would otherwise race to create them
+        matches = {match.table_name: match for job in jobs for match in job.options.get("matches") or []}
+        with self.database.pooled_connection() as connection:
+            self.database.create_state_tables(connection)
+            for match in matches.values():
+                self.database.create_match_table(connection, match)
+
+        catalogues = {id(job.catalogue): job.catalogue for job in jobs}
+        rate_limiters = {key: catalogue.rate_limiter for key, catalogue in catalogues.items()}
+        if self.rate_limit:
+            shared = RateLimiter(self.rate_limit)
+            for catalogue in catalogues.values():
+                catalogue.rate_limiter = shared
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_jobs or len(jobs), thread_name_prefix="harvest") as executor:
+                results = list(executor.map(self._run_job, jobs, range(len(jobs))))
+        finally:
+            for key, catalogue in catalogues.items():
+                catalogue.rate_limiter = rate_limiters[key]
+
+        for result in results:
+            if result.ok:
+                log.info(f"Harvested {result.rows_written} footprints of {result.job.product.table} in {result.seconds:.1f}s")
+            else:
+                log.error(f"Harvest of {result.job.product.table} failed after {result.seconds:.1f}s: {result.error!r}")
+
+        return results
+
+    def _run_job(self, job:HarvestJob, position:int) -> HarvestResult:
+        started = time.perf_counter()
+        result = HarvestResult(job=job)
+        try:
+            result.rows_written = job.catalogue.download_footprints(
+                product=job.product,
+                queryset=job.queryset,
+                database=self.database,
+                **{"progress_position": position, **job.options},
+            )
+        except Exception as e:
+            result.error = e
+        result.seconds = time.perf_counter() - started
+        return result
+
+
+def harvest_processes(catalogue:Catalogue,
+                      product:Product,
+                      queryset:Queryset,
+                      database:Database,
+                      processes:int,
+                      **options,
+                      ) -> int:
+    """Harvest a product with several worker processes sharing out its windows through the database's work queue.
+
+    Parsing responses and building geometries is CPU bound, so separate processes scale where threads don't.
+    The windows are planned here with `plan_harvest`, then each process runs `download_footprints(work_queue=True)`.
+    The same can be done across machines by running `plan_harvest` once and `download_footprints(work_queue=True)`
+    on each of them. The catalogue's rate limit applies to each process separately.
+
+    Params:
+        **options: passed on to `download_footprints` in each process.
+
+    Returns the number of rows written by all the processes.
+    """
+    catalogue.plan_harvest(product, queryset, database,
+                           **{k: options[k] for k in ("primary_key", "defer_indexes", "time_index") if k in options})
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = [executor.submit(_harvest_worker, catalogue, product, queryset, database, options)
+                   for _ in range(processes)]
+        rows_written = sum(future.result() for future in futures)
+
+    log.info(f"Harvested {rows_written} footprints of {product.table} with {processes} processes")
+    return rows_written
+
+
+def _harvest_worker(catalogue:Catalogue, product:Product, queryset:Queryset, database:Database, options:dict) -> int:
+    try:
+        return catalogue.download_footprints(product=product, queryset=queryset, database=database,
+                                             work_queue=True, **options)
+    finally:
+        database.close()
@@ -0,0 +1,112 @@
+import threading
+
+from sqlalchemy import Column, Connection, Table, inspect, text
+
+from .utils import infer_sql_type, setUpLogging, widen_sql_type
+
+log = setUpLogging(__name__)
+
+__all__ = [
+    "SchemaManager",
+]
+
+
+class SchemaManager:
+    """Keeps footprint tables' columns in step with the properties being written to them.
+
+    The column names of each table are cached after they are first read from the database, so checking a batch
+    whose properties all have columns already costs a set comparison and no queries.
+    """
+
+    def __init__(self):
+        self._columns = {}
+        # properties of each table which have been seen, but only ever as None, so have no type or column yet
+        self._untyped = {}
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # other processes start with an empty cache, which is read from the database as needed
+        return {}
+
+    def __setstate__(self, state):
+        self.__init__()
+
+    def known_columns(self, connection:Connection, table_name:str, refresh:bool = False) -> set[str]:
+        """Names of the table's columns, read from the database the first time or when `refresh` is set."""
+        with self._lock:
+            if refresh or table_name not in self._columns:
+                self._columns[table_name] = {c["name"] for c in inspect(connection).get_columns(table_name)}
+            return self._columns[table_name]
+
+    def sync_table(self, connection:Connection, table:Table) -> list[str]:
+        """Add the columns which the database table has but the `table` object doesn't, e.g. those added for
+        properties, to `table` with their reflected types. Returns the names of the columns added."""
+        missing = self.known_columns(connection, table.name) - set(table.c.keys())
+        if not missing:
+            return []
+
+        for column in inspect(connection).get_columns(table.name):
+            if column["name"] in missing:
+                table.append_column(Column(column["name"], column["type"]))
+        return sorted(missing)
+
+    def ensure_columns(self, connection:Connection, table_name:str, props:list[dict], ignore:set[str] = frozenset()) -> dict[str, str]:
+        """Add a column for every property in the batch which the table doesn't have yet, and commit.
+
+        Column types are inferred from all values of the property in the batch, not just the first row.
+        Properties which are None throughout the batch are left until a batch with a value comes along.
+
+        Params:
+            ignore(set[str]): property names which are never turned into columns.
+
+        Returns the SQL type of each column added.
+        """
+        names = set().union(*(p.keys() for p in props)) - ignore - self.known_columns(connection, table_name)
+
+        # properties which have only ever been None are looked at again once they have a value
+        untyped = self._untyped.get(table_name, set())
+        names -= {name for name in names & untyped if all(p.get(name) is None for p in props)}
+        if not names:
+            return {}
+
+        # another process may have added columns since they were cached
+        missing = names - self.known_columns(connection, table_name, refresh=True)
+        if not missing:
+            return {}
+
+        column_types = self.infer_column_types(props, missing)
+        with self._lock:
+            self._untyped[table_name] = (self._untyped.get(table_name, set()) | missing) - set(column_types)
+        if not column_types:
+            return {}
+
+        if_not_exists = "IF NOT EXISTS " if connection.dialect.name == "postgresql" else ""
+        try:
+            for name, sql_type in column_types.items():
+                connection.execute(text(f'ALTER TABLE "{table_name}" ADD COLUMN {if_not_exists}"{name}" {sql_type}'))
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+
+        log.info(f"Added columns to {table_name}: {column_types}")
+        with self._lock:
+            self._columns[table_name] = self._columns[table_name] | set(column_types)
+
+        return column_types
+
+    @staticmethod
+    def infer_column_types(props:list[dict], names:set[str]) -> dict[str, str]:
+        """SQL type for each of `names`, widened to fit every non-null value of it in the batch."""
+        column_types = {}
+        for row in props:
+            for name in names:
+                value = row.get(name)
+                if value is None:
+                    continue
+                sql_type = infer_sql_type(value)
+                if sql_type is None:
+                    continue
+                column_types[name] = widen_sql_type(column_types[name], sql_type) if name in column_types else sql_type
+
+        return column_types
@@ -1,5 +1,7 @@
-from datetime import date, datetime, timedelta
+from datetime import date, datetime, timedelta, timezone
 import logging
+import threading
+import time
 
 from pandas import Timestamp
 import shapely
@@ -8,7 +10,12 @@ __all__ = [
     "setUpLogging",
     "coords_to_polygon",
     "daterange",
+    "parse_date",
+    "parse_datetime",
+    "utcnow",
     "infer_sql_type",
+    "widen_sql_type",
+    "RateLimiter",
 ]
 
 def setUpLogging(module_name = __name__):
@@ -23,16 +30,31 @@ def coords_to_polygon(coords:list[tuple[float]]) -> str:
     """Takes an iterable of coordinate pairs and returns a WKT POLYGON string."""
     return shapely.Polygon(coords).wkt
 
-def daterange(start_date:date|str, end_date:date|str):
-    """Returns a sequence of dates separated by one day. Inclusive of start and end date."""
+def parse_date(d:date|str) -> date:
+    """Returns a date from a date or a YYYY-MM-DD string."""
+    if isinstance(d, str):
+        return datetime.strptime(d, "%Y-%m-%d").date()
+    return d
 
-    date_format_string = "%Y-%m-%d"
+def parse_datetime(d:datetime|str|None) -> datetime|None:
+    """Returns a naive UTC datetime from a datetime or an ISO 8601 string such as CMR's "2020-01-01T00:05:00.000Z"."""
+    if d is None:
+        return None
+    if isinstance(d, str):
+        d = datetime.fromisoformat(d)
+    if d.tzinfo is not None:
+        d = d.astimezone(timezone.utc).replace(tzinfo=None)
+    return d
 
-    if isinstance(start_date, str):
-        start_date = datetime.strptime(start_date, date_format_string).date()
+def utcnow() -> datetime:
+    """Returns the current time as a naive UTC datetime, the form datetimes are stored and sent to catalogues in."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+def daterange(start_date:date|str, end_date:date|str):
+    """Returns a sequence of dates separated by one day. Inclusive of start and end date."""
 
-    if isinstance(end_date, str):
-        end_date = datetime.strptime(end_date, date_format_string).date()
+    start_date = parse_date(start_date)
+    end_date = parse_date(end_date)
 
     days = int((end_date - start_date).days)  + 1
     for n in range(days):
@@ -59,3 +81,43 @@ def infer_sql_type(val) -> str:
         log.warning("Unknown type for: None")
     else:
         log.warning(f"Unknown type for: {val}")
+
+def widen_sql_type(a:str, b:str) -> str:
+    """Returns an SQL type able to hold values of both types `a` and `b`, as returned by `infer_sql_type`."""
+    if a == b:
+        return a
+    elif {a, b} == {"BIGINT", "FLOAT"}:
+        return "FLOAT"
+    elif "JSON" in (a, b):
+        return "JSON"
+    else:
+        return "TEXT"
+
+class RateLimiter:
+    """Thread-safe limiter spacing calls to at most `rate` per second."""
+
+    def __init__(self, rate:float):
+        if rate <= 0:
+            raise ValueError(f"Rate must be positive, got {rate}")
+        self.interval = 1.0 / rate
+        self._next_slot = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """Block until the next call is allowed."""
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next_slot, now)
+            self._next_slot = slot + self.interval
+        delay = slot - now
+        if delay > 0:
+            time.sleep(delay)
+
+    def __getstate__(self):
+        # each process gets a limiter of its own, locks can't be shared between them
+        return {"interval": self.interval}
+
+    def __setstate__(self, state):
+        self.interval = state["interval"]
+        self._next_slot = time.monotonic()
+        self._lock = threading.Lock()
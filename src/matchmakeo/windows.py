@@ -0,0 +1,100 @@
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta
+from typing import Callable, Iterator, NamedTuple
+
+__all__ = [
+    "Window",
+    "WindowPolicy",
+    "DailyWindows",
+    "AdaptiveWindows",
+]
+
+
+class Window(NamedTuple):
+    "A temporal query window, inclusive of `start` and exclusive of `end`."
+
+    start: datetime
+    end: datetime
+    # number of granules expected in the window, if the policy counted them
+    hits: int = None
+
+
+class WindowPolicy(ABC):
+    """Decides how a queryset's date range is split into temporal windows, one catalogue query per window."""
+
+    @abstractmethod
+    def windows(self,
+                start: datetime,
+                end: datetime,
+                count_hits: Callable[[datetime, datetime], int],
+                ) -> Iterator[Window]:
+        """Yield consecutive windows covering `start` to `end`.
+
+        Params:
+            count_hits(Callable): returns the number of granules between two datetimes,
+                used by policies that size windows by data density.
+        """
+
+
+class DailyWindows(WindowPolicy):
+    """One window per day, regardless of how many granules it contains."""
+
+    def windows(self, start, end, count_hits=None):
+        while start < end:
+            next_day = min(start + timedelta(days=1), end)
+            yield Window(start, next_day)
+            start = next_day
+
+
+class AdaptiveWindows(WindowPolicy):
+    """Windows sized by the number of granules they contain.
+
+    The range is first cut into `initial` sized windows. Windows with more than `target_hits` granules are halved
+    until they fit or reach `min_window`, and consecutive windows are merged while their combined hits stay within
+    `target_hits`. Windows with no granules are never queried.
+    """
+
+    def __init__(self,
+                 initial: timedelta = timedelta(days=32),
+                 target_hits: int = 2000,
+                 min_window: timedelta = timedelta(hours=1),
+                 ):
+        if target_hits < 1:
+            raise ValueError(f"target_hits must be at least 1, got {target_hits}")
+
+        self.initial = initial
+        self.target_hits = target_hits
+        self.min_window = min_window
+
+    def windows(self, start, end, count_hits):
+        pending = None
+
+        window_start = start
+        while window_start < end:
+            window_end = min(window_start + self.initial, end)
+
+            for window in self._split(window_start, window_end, count_hits):
+                if pending and pending.hits + window.hits <= self.target_hits:
+                    # merge sparse neighbours into a single query
+                    pending = Window(pending.start, window.end, pending.hits + window.hits)
+                else:
+                    if pending and pending.hits:
+                        yield pending
+                    pending = window
+
+            window_start = window_end
+
+        if pending and pending.hits:
+            yield pending
+
+    def _split(self, start:datetime, end:datetime, count_hits) -> Iterator[Window]:
+        """Recursively halve a window until it holds at most `target_hits` granules."""
+        hits = count_hits(start, end)
+
+        if hits > self.target_hits and (end - start) / 2 >= self.min_window:
+            # CMR temporal queries have a resolution of one second
+            middle = start + timedelta(seconds=(end - start).total_seconds() // 2)
+            yield from self._split(start, middle, count_hits)
+            yield from self._split(middle, end, count_hits)
+        else:
+            yield Window(start, end, hits)
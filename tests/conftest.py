@@ -1,3 +1,54 @@
+import pytest
+import shapely
+from sqlalchemy import create_engine, event, func
+
+from matchmakeo.databases import PostGISDatabase, SpatialiteDatabase
+
 pytest_plugins = [
     "pytest_databases.docker.postgres",
-]
\ No newline at end of file
+]
+
+
+class SQLiteDatabase(SpatialiteDatabase):
+    """A SpatialiteDatabase on plain SQLite, for when mod_spatialite isn't available.
+
+    Geometries are stored as WKT and the spatial functions matchmakeo calls are stood in for by shapely.
+    """
+
+    def _create_spatial_index(self, connection, table, column_name):
+        # plain SQLite has no R*Tree spatial indexes
+        pass
+
+    def _intersects_predicate(self, indexed, other, indexed_table):
+        return func.ST_Intersects(indexed.c.geometry, other.c.geometry) == 1
+
+
+def _spatial_functions(dbapi_connection, _):
+    wkt = shapely.from_wkt
+    # geoalchemy2 registers geometry columns, writes EWKT and reads EWKB, footprint inserts write hex EWKB
+    dbapi_connection.create_function("RecoverGeometryColumn", 5, lambda *args: 1)
+    dbapi_connection.create_function("GeomFromEWKT", 1, lambda ewkt: ewkt.split(";", 1)[-1])
+    dbapi_connection.create_function("GeomFromEWKB", 1, lambda ewkb: ewkb and shapely.from_wkb(ewkb).wkt)
+    dbapi_connection.create_function("AsEWKB", 1, lambda geometry: geometry and shapely.to_wkb(wkt(geometry)))
+    dbapi_connection.create_function("ST_Intersects", 2, lambda a, b: wkt(a).intersects(wkt(b)))
+    dbapi_connection.create_function("ST_Intersection", 2, lambda a, b: wkt(a).intersection(wkt(b)).wkt)
+    dbapi_connection.create_function("ST_Area", 1, lambda a: wkt(a).area)
+
+
+@pytest.fixture
+def sqlite_database(tmp_path) -> SQLiteDatabase:
+    """A file backed SQLiteDatabase with emulated spatial functions."""
+    db = SQLiteDatabase(tmp_path / "test.db")
+    db.engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    event.listen(db.engine, "connect", _spatial_functions)
+    yield db
+    db.close()
+
+
+@pytest.fixture
+def db(tmp_path) -> PostGISDatabase:
+    """A PostGISDatabase on a plain SQLite file, for testing what doesn't need geometries or PostgreSQL."""
+    db = PostGISDatabase(database="test_db", username="test", password="password")
+    db.engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    yield db
+    db.close()
@@ -0,0 +1,91 @@
+from datetime import date, timedelta
+import json
+
+import pytest
+import requests
+
+from matchmakeo.cache import CacheMissError, ResponseCache
+
+
+class FakeSession:
+    """Counts requests and answers each with a JSON body echoing its parameters."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def get(self, url, params=None, headers=None):
+        self.calls += 1
+        response = requests.Response()
+        response.url = url
+        response.status_code = 200
+        response.headers["CMR-Hits"] = "1"
+        response._content = json.dumps({"params": params}).encode()
+        return response
+
+
+def test_cache_hits(tmp_path):
+    """Test that repeated requests are served from disk, keyed by parameters and Search-After token."""
+    cache = ResponseCache(tmp_path / "cache.db")
+    session = FakeSession()
+
+    first = cache.get(session, "https://cmr", params={"a": 1, "b": 2})
+    again = cache.get(session, "https://cmr", params={"b": 2, "a": 1})
+    assert session.calls == 1
+    assert again.json() == first.json() == {"params": {"a": 1, "b": 2}}
+    assert again.headers["cmr-hits"] == "1"
+
+    cache.get(session, "https://cmr", params={"a": 1, "b": 2}, headers={"CMR-Search-After": "token"})
+    assert session.calls == 2
+    assert (cache.hits, cache.misses) == (1, 2)
+
+    # persists between instances
+    cache.close()
+    cache = ResponseCache(tmp_path / "cache.db", offline=True)
+    assert cache.get(session, "https://cmr", params={"a": 1, "b": 2}).json() == first.json()
+    with pytest.raises(CacheMissError):
+        cache.get(session, "https://cmr", params={"a": 3})
+    assert session.calls == 2
+
+
+def test_cache_ttl_and_eviction(tmp_path):
+    """Test that stale responses are refetched and the least recently used are evicted beyond max_size."""
+    cache = ResponseCache(tmp_path / "cache.db", ttl=timedelta(seconds=-1))
+    session = FakeSession()
+    cache.get(session, "https://cmr", params={"a": 1})
+    cache.get(session, "https://cmr", params={"a": 1})
+    assert session.calls == 2
+
+    cache = ResponseCache(tmp_path / "lru.db")
+    for i in range(3):
+        cache.get(session, "https://cmr", params={"a": i})
+    cache.get(session, "https://cmr", params={"a": 0})
+    # room for three responses
+    cache.max_size = cache.size + cache.size // 6
+    cache.get(session, "https://cmr", params={"a": 3})
+
+    assert len(cache) == 3
+    assert cache.size <= cache.max_size
+    calls = session.calls
+    cache.get(session, "https://cmr", params={"a": 0})
+    assert session.calls == calls
+    cache.get(session, "https://cmr", params={"a": 1})
+    assert session.calls == calls + 1
+
+
+def test_catalogue_uses_cache(tmp_path, monkeypatch):
+    """Test that a catalogue with a cache only goes to the network for requests it hasn't seen."""
+    from matchmakeo.catalogues import NasaCMR
+    from matchmakeo.product import Product
+    from matchmakeo.queryset import NasaCMRQueryset
+
+    session = FakeSession()
+    catalogue = NasaCMR(client_id="test", cache=ResponseCache(tmp_path / "cache.db"))
+    monkeypatch.setattr(catalogue.session, "get", session.get)
+
+    product = Product(short_name="test", table="test")
+    queryset = NasaCMRQueryset(start_date=date(2025, 1, 1), end_date=date(2025, 1, 1))
+    for _ in range(2):
+        assert catalogue._count_hits(product=product, queryset=queryset, start=date(2025, 1, 1), end=date(2025, 1, 2)) == 1
+
+    assert session.calls == 1
+    assert catalogue.metrics.counter("cache_hits") == 1
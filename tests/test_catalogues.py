@@ -1,12 +1,15 @@
+from datetime import date, datetime, timedelta
+import json
 import unittest
 
 import pytest
+from shapely import Polygon
 from pytest_databases.docker.postgres import PostgresService
 
 from matchmakeo.catalogues import NasaCMR
 from matchmakeo.databases import PostGISDatabase
 from matchmakeo.product import Product
-from matchmakeo.queryset import Queryset
+from matchmakeo.queryset import Queryset, NasaCMRQueryset
 
 def test_queryset_type_warning(postgres_service: PostgresService):
     """Test that using the wrong queryset type for the catalogue results in a warning."""
@@ -29,3 +32,395 @@ def test_queryset_type_warning(postgres_service: PostgresService):
     
     with pytest.warns(UserWarning):
         catalogue._check_queryset_type(queryset)
+
+
+class FakeResponse:
+    def __init__(self, entries, search_after=None):
+        self.status_code = 200
+        self.text = ""
+        self.content = json.dumps({"feed": {"entry": entries}}).encode()
+        self.elapsed = timedelta(milliseconds=10)
+        self.raw = None
+        self.headers = {"CMR-Search-After": search_after} if search_after else {}
+
+    def json(self):
+        return json.loads(self.content)
+
+
+def test_download_window_follows_search_after(monkeypatch):
+    """Test that all pages of a window are fetched by following the CMR-Search-After header."""
+
+    pages = {
+        None: FakeResponse([{"id": "a", "polygons": [["0 0 0 1 1 1 0 0"]]}], search_after="token-1"),
+        "token-1": FakeResponse([{"id": "b", "polygons": [["0 0 0 1 1 1 0 0"]]}], search_after="token-2"),
+        "token-2": FakeResponse([]),
+    }
+
+    def fake_get(url, params=None, headers=None):
+        return pages[headers.get("CMR-Search-After")]
+
+    catalogue = NasaCMR(client_id="test")
+    monkeypatch.setattr(catalogue.session, "get", fake_get)
+    queryset = NasaCMRQueryset(start_date=date(2025, 1, 1), end_date=date(2025, 1, 1))
+    footprints = catalogue._download_single_date(product=Product(short_name="test", table="test"),
+                                                 queryset=queryset,
+                                                 date=date(2025, 1, 1))
+
+    assert [f.id for f in footprints] == ["a", "b"]
+    assert catalogue.metrics.summary()["timers"][0]["count"] == 3
+    assert footprints[0].geometry.equals(Polygon([(0.0, 0.0), (1.0, 0.0), (1.0, 1.0), (0.0, 0.0)]))
+
+
+def test_session_configuration():
+    """Test that the catalogue session sends the Client-Id and retries transient failures."""
+    catalogue = NasaCMR(client_id="test_client", max_retries=3, pool_maxsize=4)
+
+    assert catalogue.session.headers["Client-Id"] == "test_client"
+
+    adapter = catalogue.session.get_adapter(catalogue.url)
+    assert adapter.max_retries.total == 3
+    assert 429 in adapter.max_retries.status_forcelist
+    assert adapter.max_retries.respect_retry_after_header
+    assert adapter._pool_maxsize == 4
+
+
+def test_iter_footprints(monkeypatch):
+    """Test that footprints stream lazily from every window of the queryset."""
+
+    def fake_get(url, params=None, headers=None):
+        day = params["temporal"][:10]
+        if headers.get("CMR-Search-After"):
+            return FakeResponse([])
+        return FakeResponse([{"id": day, "polygons": [["0 0 0 1 1 1 0 0"]], "time_start": f"{day}T00:00:00.000Z"}],
+                            search_after="more")
+
+    catalogue = NasaCMR(client_id="test")
+    monkeypatch.setattr(catalogue.session, "get", fake_get)
+
+    queryset = NasaCMRQueryset(start_date="2025-01-01", end_date="2025-01-03")
+    footprints = catalogue.iter_footprints(product=Product(short_name="test", table="test"), queryset=queryset, max_workers=2)
+
+    assert [f.id for f in footprints] == ["2025-01-01", "2025-01-02", "2025-01-03"]
+
+
+def test_catalogue_pickles(tmp_path):
+    """Test that a catalogue can be sent to worker processes with its rate limiter and response cache."""
+    import pickle
+
+    from matchmakeo.cache import ResponseCache
+
+    catalogue = NasaCMR(client_id="test", rate_limit=5, cache=ResponseCache(tmp_path / "cache.db", offline=True))
+    copy = pickle.loads(pickle.dumps(catalogue))
+
+    assert copy.session.headers["Client-Id"] == "test"
+    assert copy.rate_limiter.interval == 0.2
+    assert copy.cache.offline and copy.cache.path == tmp_path / "cache.db"
+
+
+def test_spatial_filters(monkeypatch):
+    """Test that the queryset's region is sent to CMR and footprints outside it are dropped when post filtering."""
+    from shapely import box
+
+    requests_sent = []
+
+    def fake_get(url, params=None, headers=None):
+        requests_sent.append(params)
+        if headers.get("CMR-Search-After"):
+            return FakeResponse([])
+        return FakeResponse([{"id": "in", "boxes": ["-61 174 -59 176"]},
+                             {"id": "out", "boxes": ["10 10 11 11"]}], search_after="more")
+
+    catalogue = NasaCMR(client_id="test")
+    monkeypatch.setattr(catalogue.session, "get", fake_get)
+
+    queryset = NasaCMRQueryset(start_date="2025-01-01", end_date="2025-01-01",
+                               bounding_box=(170, -90, -170, -50),
+                               polygon=box(-180, -70, 180, -55),
+                               post_filter=True)
+    footprints = catalogue.iter_footprints(product=Product(short_name="test", table="test"), queryset=queryset)
+
+    assert [f.id for f in footprints] == ["in"]
+    assert requests_sent[0]["bounding_box"] == "170,-90,-170,-50"
+    # anticlockwise and closed
+    assert requests_sent[0]["polygon[]"] == ["180,-70,180,-55,-180,-55,-180,-70,180,-70"]
+    assert catalogue.metrics.counter("granules_filtered") == 1
+
+    # coordinates keep their full precision and radii aren't written as exponents
+    queryset = NasaCMRQueryset(start_date="2025-01-01", end_date="2025-01-01",
+                               bounding_box=(-12.3456789, 50.1234567, -11.0000001, 51.5), circle=(0.0000001, 45.5, 2500000))
+    params = NasaCMR._spatial_params(queryset)
+    assert params["bounding_box"] == "-12.3456789,50.1234567,-11.0000001,51.5"
+    assert params["circle"] == "0.0000001,45.5,2500000"
+
+
+def test_field_projection():
+    """Test that declared fields are read from their source and converted, and other properties overflow."""
+    from sqlalchemy import Boolean, Float, String
+
+    from matchmakeo.field import Field, to_bool
+
+    product = Product(short_name="test", table="test",
+                      extra_fields=[
+                          Field("day_night_flag", "daytime", Boolean, converter=to_bool),
+                          Field("cloud_cover", "cloud_cover", Float),
+                          Field("links", "data_url", String, source="links.0.href"),
+                      ],
+                      overflow_column="properties")
+    catalogue = NasaCMR(client_id="test")
+    footprints = catalogue._parse_page([
+        {"id": "a", "boxes": ["0 0 1 1"], "time_start": "2025-01-01T00:05:00.000Z", "day_night_flag": "DAY",
+         "cloud_cover": "12.5", "links": [{"href": "https://example.com/a.hdf"}], "granule_size": "41.2"},
+        {"id": "b", "boxes": ["0 0 1 1"], "day_night_flag": "NIGHT", "cloud_cover": "unknown"},
+    ])
+
+    rows = catalogue._footprints_to_rows(footprints, product=product)
+
+    assert product.projected
+    assert rows[0]["datetime_start"] == datetime(2025, 1, 1, 0, 5)
+    assert [r["daytime"] for r in rows] == [True, False]
+    # values which can't be converted are stored as NULL
+    assert [r["cloud_cover"] for r in rows] == [12.5, None]
+    assert [r["data_url"] for r in rows] == ["https://example.com/a.hdf", None]
+    assert rows[0]["properties"] == {"boxes": ["0 0 1 1"], "granule_size": "41.2"}
+    assert catalogue._footprints_to_rows(footprints)[0].keys() == {"id", "geometry", "datetime_start", "datetime_end"}
+
+
+def test_projected_entries(monkeypatch):
+    """Test that pages for a projected product only keep the properties its fields are read from."""
+    from sqlalchemy import String
+
+    from matchmakeo.field import Field
+
+    def fake_get(url, params=None, headers=None):
+        return FakeResponse([{"id": "a", "boxes": ["0 0 1 1"], "time_start": "2025-01-01T00:00:00.000Z",
+                              "day_night_flag": "DAY", "granule_size": "41.2", "links": [{"href": "x"}]}])
+
+    catalogue = NasaCMR(client_id="test")
+    monkeypatch.setattr(catalogue.session, "get", fake_get)
+    queryset = NasaCMRQueryset(start_date=date(2025, 1, 1), end_date=date(2025, 1, 1))
+
+    projected = Product(short_name="test", table="test", projection=True,
+                        extra_fields=[Field("day_night_flag", "day_night_flag", String)])
+    [(entries, _)] = catalogue._iter_window_pages(product=projected, queryset=queryset,
+                                                  start=date(2025, 1, 1), end=date(2025, 1, 2))
+    assert entries == [{"id": "a", "boxes": ["0 0 1 1"], "time_start": "2025-01-01T00:00:00.000Z", "day_night_flag": "DAY"}]
+
+    [(entries, _)] = catalogue._iter_window_pages(product=Product(short_name="test", table="test"), queryset=queryset,
+                                                  start=date(2025, 1, 1), end=date(2025, 1, 2))
+    assert "granule_size" in entries[0]
+
+
+def test_download_footprints_resume_and_incremental(monkeypatch, sqlite_database):
+    """Test that harvests resume from their checkpoints and incremental harvests only ask CMR for updates to the
+    dates earlier harvests covered."""
+    from sqlalchemy import text
+
+    requests = []
+    time_end = {}
+
+    def fake_get(url, params=None, headers=None):
+        start = params["temporal"].split(",")[0]
+        day = start[:10]
+        requests.append((day, params.get("updated_since")))
+        entry = lambda n: {"id": f"{day}-{n}", "boxes": ["0 0 1 1"], "time_start": start,
+                           "time_end": time_end.get(f"{day}-{n}", start)}
+        # two pages per day
+        if headers.get("CMR-Search-After"):
+            return FakeResponse([entry(2)])
+        return FakeResponse([entry(1)], search_after=f"{day}-token")
+
+    catalogue = NasaCMR(client_id="test")
+    monkeypatch.setattr(catalogue.session, "get", fake_get)
+    product = Product(short_name="test", table="test")
+    query_digest = catalogue._query_digest(product, NasaCMRQueryset(start_date=date(2025, 1, 1), end_date=date(2025, 1, 1)))
+
+    def harvest(start_day, end_day, **kwargs):
+        requests.clear()
+        queryset = NasaCMRQueryset(start_date=date(2025, 1, start_day), end_date=date(2025, 1, end_day))
+        return catalogue.download_footprints(product, queryset, sqlite_database, **kwargs)
+
+    assert harvest(1, 2) == 4
+    assert [day for day, _ in requests] == ["2025-01-01", "2025-01-01", "2025-01-02", "2025-01-02"]
+
+    # completed windows are skipped, and an interrupted window continues from its last committed page
+    with sqlite_database.pooled_connection() as connection:
+        sqlite_database.save_checkpoints(connection, "test", [(datetime(2025, 1, 3), datetime(2025, 1, 4), "2025-01-03-token", False)],
+                                         query_digest=query_digest)
+    assert harvest(1, 3) == 1
+    assert requests == [("2025-01-03", None)]
+
+    # only the dates harvested before are limited to updates, January 4th has never been harvested
+    time_end["2025-01-01-1"] = "2025-01-01T12:00:00.000Z"
+    assert harvest(1, 4, incremental=True) == 8
+    updated_since = {day: since for day, since in requests}
+    assert all(updated_since[f"2025-01-0{d}"] for d in (1, 2, 3))
+    assert updated_since["2025-01-04"] is None
+
+    with sqlite_database.pooled_connection() as connection:
+        assert connection.execute(text("SELECT count(*) FROM test")).scalar() == 8
+        assert connection.execute(text("SELECT datetime_end FROM test WHERE id = '2025-01-01-1'")).scalar().startswith("2025-01-01 12:00")
+        harvests = sqlite_database.get_harvests(connection, "test", query_digest=query_digest)
+    assert set(harvests) == {(datetime(2025, 1, 1), datetime(2025, 1, 3)), (datetime(2025, 1, 1), datetime(2025, 1, 4)),
+                             (datetime(2025, 1, 1), datetime(2025, 1, 5))}
+
+
+def test_download_footprints_keeps_filtered_harvests_apart(monkeypatch, sqlite_database):
+    """Test that a harvest of a region doesn't count as a harvest of the whole globe when resuming or harvesting
+    incrementally."""
+    requests = []
+
+    def fake_get(url, params=None, headers=None):
+        start = params["temporal"].split(",")[0]
+        requests.append((start[:10], params.get("bounding_box"), params.get("updated_since")))
+        south = -80 if params.get("bounding_box") else 10
+        return FakeResponse([{"id": f"{start[:10]}-{south}", "boxes": [f"{south} 0 {south + 1} 1"], "time_start": start}])
+
+    catalogue = NasaCMR(client_id="test")
+    monkeypatch.setattr(catalogue.session, "get", fake_get)
+    product = Product(short_name="test", table="test")
+
+    def harvest(**kwargs):
+        requests.clear()
+        queryset = NasaCMRQueryset(start_date=date(2025, 1, 1), end_date=date(2025, 1, 2), **kwargs)
+        return catalogue.download_footprints(product, queryset, sqlite_database)
+
+    antarctic = (-180, -90, 180, -50)
+    assert harvest(bounding_box=antarctic) == 2
+    assert harvest() == 2
+    assert [(day, bbox) for day, bbox, _ in requests] == [("2025-01-01", None), ("2025-01-02", None)]
+    # each filter's harvests resume from their own checkpoints
+    assert harvest(bounding_box=antarctic) == 0 and requests == []
+
+    requests.clear()
+    queryset = NasaCMRQueryset(start_date=date(2025, 1, 1), end_date=date(2025, 1, 3))
+    catalogue.download_footprints(product, queryset, sqlite_database, incremental=True)
+    updated_since = {day: since for day, _, since in requests}
+    assert updated_since["2025-01-01"] and updated_since["2025-01-02"] and not updated_since["2025-01-03"]
+
+    requests.clear()
+    queryset = NasaCMRQueryset(start_date=date(2025, 1, 1), end_date=date(2025, 1, 3), bounding_box=(0, 0, 10, 10))
+    catalogue.download_footprints(product, queryset, sqlite_database, incremental=True)
+    assert not any(since for _, _, since in requests)
+
+
+def test_create_table_checks_primary_key(sqlite_database):
+    """Test that tables from earlier versions, keyed on an integer pk rather than the granule id, are rejected until
+    the id is made unique."""
+    product = Product(short_name="test", table="test")
+    catalogue = NasaCMR(client_id="test")
+
+    with sqlite_database.pooled_connection() as connection:
+        connection.exec_driver_sql("CREATE TABLE test (pk INTEGER PRIMARY KEY, id VARCHAR, geometry TEXT, "
+                                   "datetime_start DATETIME, datetime_end DATETIME)")
+        with pytest.raises(ValueError, match="CREATE UNIQUE INDEX ON test \\(id\\)"):
+            catalogue._create_table(connection, product, primary_key="id")
+
+        connection.exec_driver_sql("CREATE UNIQUE INDEX ix_test_id ON test (id)")
+        table = catalogue._create_table(connection, product, primary_key="id")
+        assert sqlite_database.insert_footprints(connection, table, [{"id": "a"}, {"id": "a"}], on_conflict="nothing") == 1
+
+
+def test_download_footprints_work_queue(monkeypatch, sqlite_database):
+    """Test that work queue workers only harvest their own dates and that the one finishing the last window builds
+    the deferred indexes and records the harvest."""
+    from sqlalchemy import inspect
+
+    from matchmakeo.windows import Window
+
+    requests = []
+
+    def fake_get(url, params=None, headers=None):
+        start = params["temporal"].split(",")[0]
+        requests.append(start[:10])
+        return FakeResponse([{"id": start[:10], "boxes": ["0 0 1 1"], "time_start": start, "time_end": start}])
+
+    catalogue = NasaCMR(client_id="test")
+    monkeypatch.setattr(catalogue.session, "get", fake_get)
+    analyzed = []
+    monkeypatch.setattr(sqlite_database, "analyze", lambda connection, table: analyzed.append(table.name))
+    product = Product(short_name="test", table="test")
+    queryset = NasaCMRQueryset(start_date=date(2025, 1, 1), end_date=date(2025, 1, 2))
+    query_digest = catalogue._query_digest(product, queryset)
+
+    def harvest(**kwargs):
+        return catalogue.download_footprints(product, queryset, sqlite_database, work_queue=True, defer_indexes=True,
+                                             **kwargs)
+
+    with sqlite_database.pooled_connection() as connection:
+        sqlite_database.create_state_tables(connection)
+        # a window of another harvest, one of a harvest with other filters, and one claimed by another worker
+        sqlite_database.enqueue_windows(connection, "test", [Window(datetime(2025, 1, 5), datetime(2025, 1, 6))],
+                                        query_digest=query_digest)
+        sqlite_database.enqueue_windows(connection, "test", [Window(datetime(2025, 1, 1), datetime(2025, 1, 2))])
+        sqlite_database.enqueue_windows(connection, "test", [Window(datetime(2025, 1, 1), datetime(2025, 1, 2))],
+                                        query_digest=query_digest)
+        sqlite_database.claim_window(connection, "test", worker="other", claim_timeout=timedelta(hours=1),
+                                     query_digest=query_digest)
+
+    assert harvest(worker="a") == 1
+    assert requests == ["2025-01-02"]
+    with sqlite_database.pooled_connection() as connection:
+        assert not analyzed and sqlite_database.get_harvests(connection, "test", query_digest=query_digest) == {}
+        assert not inspect(connection).get_indexes("test")
+        sqlite_database.complete_windows(connection, "test", [(datetime(2025, 1, 1), datetime(2025, 1, 2))],
+                                         query_digest=query_digest)
+
+    # the other worker's window is done, so the next worker to finish finalises the harvest
+    assert harvest(worker="b") == 0
+    assert requests == ["2025-01-02"] and analyzed == ["test"]
+    with sqlite_database.pooled_connection() as connection:
+        assert (sqlite_database.get_harvests(connection, "test", query_digest=query_digest).keys()
+                == {(datetime(2025, 1, 1), datetime(2025, 1, 3))})
+        assert {i["name"] for i in inspect(connection).get_indexes("test")} == {"ix_test_datetime_start", "ix_test_datetime_end"}
+        assert (sqlite_database.get_queue_status(connection, "test", query_digest=query_digest)
+                == {"pending": 1, "claimed": 0, "done": 2})
+        assert sqlite_database.get_queue_status(connection, "test") == {"pending": 1, "claimed": 0, "done": 0}
+
+
+def test_footprint_writer_completes_work_queue_windows(sqlite_database):
+    """Test that work queue windows are written and completed as soon as they are done, not when a batch fills up."""
+    from sqlalchemy import text
+
+    from matchmakeo.catalogues import _FootprintWriter
+    from matchmakeo.windows import Window
+
+    product = Product(short_name="test", table="test")
+    window = Window(datetime(2025, 1, 1), datetime(2025, 1, 2))
+
+    with sqlite_database.pooled_connection() as connection:
+        table = NasaCMR(client_id="test")._create_table(connection, product, primary_key="id")
+        sqlite_database.create_state_tables(connection)
+        sqlite_database.enqueue_windows(connection, "test", [window])
+        assert sqlite_database.claim_window(connection, "test", worker="a", claim_timeout=timedelta(hours=1)) == window
+
+        writer = _FootprintWriter(sqlite_database, connection, table, product, batch_size=1000, work_queue=True)
+        writer.add([{"id": "a", "geometry": None, "datetime_start": None, "datetime_end": None}], window=window)
+        writer.window_done(window)
+
+        assert connection.execute(text("SELECT count(*) FROM test")).scalar() == 1
+        assert sqlite_database.get_queue_status(connection, "test") == {"pending": 0, "claimed": 0, "done": 1}
+        assert sqlite_database.get_checkpoints(connection, "test") == {(window.start, window.end): (None, True)}
+
+
+def test_download_footprints_property_columns(monkeypatch, sqlite_database):
+    """Test that properties without a field are stored in columns of their own when the product has no projection."""
+    from sqlalchemy import inspect, text
+
+    entry = lambda id, **properties: {"id": id, "boxes": ["0 0 1 1"], "time_start": "2025-01-01T00:00:00.000Z", **properties}
+    pages = {
+        None: FakeResponse([entry("a", cloud_cover=12.5, granule_size=None)], search_after="token-1"),
+        "token-1": FakeResponse([entry("b", cloud_cover=3, day_night_flag="DAY", granule_size=None)]),
+    }
+
+    catalogue = NasaCMR(client_id="test")
+    monkeypatch.setattr(catalogue.session, "get", lambda url, params=None, headers=None: pages[headers.get("CMR-Search-After")])
+    queryset = NasaCMRQueryset(start_date=date(2025, 1, 1), end_date=date(2025, 1, 1))
+
+    assert catalogue.download_footprints(Product(short_name="test", table="test"), queryset, sqlite_database) == 2
+
+    with sqlite_database.pooled_connection() as connection:
+        rows = connection.execute(text("SELECT id, cloud_cover, day_night_flag FROM test ORDER BY id")).all()
+        columns = {c["name"] for c in inspect(connection).get_columns("test")}
+    assert [tuple(row) for row in rows] == [("a", 12.5, None), ("b", 3, "DAY")]
+    # properties which were always null don't have a column yet
+    assert "granule_size" not in columns and "time_start" not in columns
@@ -1,3 +1,5 @@
+from sqlalchemy.dialects import postgresql
+
 from matchmakeo.databases import PostGISDatabase
 
 def test_database_url():
@@ -20,4 +22,405 @@ def test_database_url():
 
     expected_str = f"{dialect}+{driver}://{username}:{password}@{host}:{port}/{db_name}"
 
-    assert db.url == expected_str
\ No newline at end of file
+    assert db.url == expected_str
+
+def test_insert_footprints_batch(db):
+    """Test that a batch of rows is written with a single call and committed."""
+    from sqlalchemy import Column, Integer, MetaData, String, Table, select, func
+
+    connection = db.connect()
+
+    table = Table("footprints", MetaData(), Column("pk", Integer, primary_key=True), Column("id", String))
+    table.create(connection)
+
+    assert db.insert_footprints(connection, table, []) == 0
+    assert db.insert_footprints(connection, table, [{"id": f"granule_{i}"} for i in range(10)]) == 10
+
+    assert connection.execute(select(func.count()).select_from(table)).scalar() == 10
+
+
+def test_checkpoints(db):
+    """Test that harvest checkpoints can be saved, updated and read back."""
+    from datetime import datetime
+
+    connection = db.connect()
+    db.create_state_tables(connection)
+
+    day_1 = (datetime(2025, 1, 1), datetime(2025, 1, 2))
+    day_2 = (datetime(2025, 1, 2), datetime(2025, 1, 3))
+
+    db.save_checkpoints(connection, "modis", [(*day_1, None, True), (*day_2, "token-1", False)])
+    db.save_checkpoints(connection, "modis", [(*day_2, "token-2", False)])
+
+    assert db.get_checkpoints(connection, "modis") == {day_1: (None, True), day_2: ("token-2", False)}
+    assert db.get_checkpoints(connection, "other") == {}
+
+    january, q1 = (datetime(2025, 1, 1), datetime(2025, 2, 1)), (datetime(2025, 1, 1), datetime(2025, 4, 1))
+    assert db.get_harvests(connection, "modis") == {}
+    db.save_last_harvest(connection, "modis", *january, datetime(2025, 2, 1))
+    db.save_last_harvest(connection, "modis", *january, datetime(2025, 3, 1))
+    db.save_last_harvest(connection, "modis", *q1, datetime(2025, 4, 1))
+    assert db.get_harvests(connection, "modis") == {january: datetime(2025, 3, 1), q1: datetime(2025, 4, 1)}
+
+
+def test_insert_footprints_on_conflict(db):
+    from sqlalchemy import Column, MetaData, String, Table, select
+
+    connection = db.connect()
+
+    table = Table("footprints", MetaData(), Column("id", String, primary_key=True), Column("name", String))
+    table.create(connection)
+
+    db.insert_footprints(connection, table, [{"id": "a", "name": "first"}])
+    # only the new row counts as written
+    assert db.insert_footprints(connection, table, [{"id": "a", "name": "second"}, {"id": "b", "name": "first"}], on_conflict="nothing") == 1
+    assert connection.execute(select(table.c.name).order_by(table.c.id)).scalars().all() == ["first", "first"]
+
+    db.insert_footprints(connection, table, [{"id": "a", "name": "second"}], on_conflict="update")
+    assert connection.execute(select(table.c.name).where(table.c.id == "a")).scalar() == "second"
+
+
+def test_match_query(db):
+    """Test that matching is pushed down to the database as a spatial and temporal join."""
+    from datetime import datetime, timedelta
+
+    from sqlalchemy.dialects import postgresql
+
+    from matchmakeo.product import Product
+
+    query = db._match_query(Product(short_name="MOD021KM", table="terra"),
+                            Product(short_name="MYD021KM", table="aqua"),
+                            max_time_delta=timedelta(hours=1),
+                            min_overlap=0.5)
+    sql = str(query.compile(dialect=postgresql.dialect()))
+
+    assert "FROM terra AS a, aqua AS b" in sql
+    assert "ST_Intersects(a.geometry, b.geometry)" in sql
+    assert "a.datetime_start <= b.datetime_end" in sql
+    assert "b.datetime_start <= a.datetime_end" in sql
+    assert "AS overlap" in sql
+    assert "a.ymin" not in sql
+
+    # products storing bounding boxes are prefiltered on them
+    query = db._match_query(Product(short_name="MOD021KM", table="terra", bbox_columns=True),
+                            Product(short_name="MYD021KM", table="aqua", bbox_columns=True),
+                            max_time_delta=timedelta(hours=1))
+    assert "a.ymin <= b.ymax" in str(query.compile(dialect=postgresql.dialect()))
+
+    # a period bounds both tables' start times, so their partitions can be pruned
+    query = db._match_query(Product(short_name="MOD021KM", table="terra"),
+                            Product(short_name="MYD021KM", table="aqua"),
+                            max_time_delta=timedelta(hours=1),
+                            start=datetime(2020, 1, 1), end=datetime(2020, 2, 1))
+    params = query.compile(dialect=postgresql.dialect()).params
+    assert sorted(v for v in params.values() if isinstance(v, datetime)) == [
+        datetime(2019, 12, 31, 23), datetime(2020, 1, 1), datetime(2020, 2, 1), datetime(2020, 2, 1, 1)]
+
+    # new footprints are picked out by the tables' primary key
+    query = db._match_query(Product(short_name="MOD021KM", table="terra"),
+                            Product(short_name="MYD021KM", table="aqua"),
+                            max_time_delta=timedelta(hours=1), ids_a=["a1"], key="granule_ur")
+    assert "a.granule_ur IN" in str(query.compile(dialect=postgresql.dialect()))
+
+
+def test_bbox_predicate():
+    """Test that the bounding box prefilter keeps every pair of overlapping boxes, across the antimeridian too."""
+    import itertools
+
+    from sqlalchemy import create_engine, select
+
+    boxes = [(-10, -10, 10, 10), (170, 0, -170, 10), (160, 5, -175, 20), (175, -5, 179, 5), (-179, -5, -175, 5),
+             (-180, 80, 180, 90), (20, 0, 30, 10), (-172, 0, -160, 10)]
+
+    def covers(box):
+        xmin, _, xmax, _ = box
+        return [(xmin, 180), (-180, xmax)] if xmin > xmax else [(xmin, xmax)]
+
+    def overlaps(p, q):
+        return (p[1] <= q[3] and q[1] <= p[3]
+                and any(a0 <= b1 and b0 <= a1 for (a0, a1), (b0, b1) in itertools.product(covers(p), covers(q))))
+
+    engine = create_engine("sqlite://")
+    with engine.connect() as connection:
+        connection.exec_driver_sql("CREATE TABLE boxes (id INTEGER, xmin FLOAT, ymin FLOAT, xmax FLOAT, ymax FLOAT)")
+        connection.exec_driver_sql("INSERT INTO boxes VALUES " + ", ".join(f"({i}, {', '.join(map(str, box))})" for i, box in enumerate(boxes)))
+
+        a = PostGISDatabase._footprint_table("boxes", bbox=True).alias("a")
+        b = PostGISDatabase._footprint_table("boxes", bbox=True).alias("b")
+        pairs = set(connection.execute(select(a.c.id, b.c.id).where(PostGISDatabase._bbox_predicate(a, b))).all())
+
+    assert pairs == {(i, j) for (i, p), (j, q) in itertools.product(enumerate(boxes), repeat=2) if overlaps(p, q)}
+
+
+def test_update_matches(sqlite_database):
+    """Test that only new footprints are matched into a materialised match table, with the run which found them."""
+    from datetime import datetime, timedelta
+
+    from sqlalchemy import select
+    import shapely
+
+    from matchmakeo.databases import match_runs
+    from matchmakeo.matching import MaterialisedMatch
+    from matchmakeo.product import Product
+
+    db = sqlite_database
+    terra, aqua = Product(short_name="MOD021KM", table="terra"), Product(short_name="MYD021KM", table="aqua")
+    match = MaterialisedMatch(terra, aqua, max_time_delta=timedelta(hours=1))
+    t = datetime(2020, 1, 1)
+
+    with db.pooled_connection() as connection:
+        for name in ("terra", "aqua"):
+            connection.exec_driver_sql(f"CREATE TABLE {name} (id TEXT PRIMARY KEY, geometry TEXT, datetime_start TIMESTAMP, datetime_end TIMESTAMP)")
+
+        def insert_footprints(table, rows):
+            connection.exec_driver_sql(
+                f"INSERT INTO {table} VALUES (?, ?, ?, ?)",
+                [(id, shapely.box(*bounds).wkt, str(start), str(start + timedelta(minutes=5))) for id, bounds, start in rows])
+
+        insert_footprints("aqua", [("b1", (0, 0, 2, 2), t), ("b2", (5, 5, 6, 6), t), ("b3", (0, 0, 1, 1), t + timedelta(hours=3))])
+        insert_footprints("terra", [("a1", (1, 1, 3, 3), t + timedelta(minutes=30))])
+        connection.commit()
+
+        assert db.refresh_matches(match) == 1
+
+        # a later harvest of terra only joins its new footprints against aqua
+        insert_footprints("terra", [("a2", (0, 0, 1, 1), t + timedelta(hours=3)), ("a3", (5, 5, 6, 6), t + timedelta(days=1))])
+        connection.commit()
+        run_id = db.start_match_run(connection, match)
+        assert db.update_matches(connection, match, run_id, ids_a=["a2", "a3"]) == 1
+        # pairs already found are kept
+        assert db.update_matches(connection, match, run_id, ids_a=["a1", "a2"]) == 0
+        db.finish_match_run(connection, run_id)
+
+        pairs = connection.execute(select(db._match_table(match.table_name))).mappings().all()
+        assert {(p["id_a"], p["id_b"]) for p in pairs} == {("a1", "b1"), ("a2", "b3")}
+        assert {p["run_id"] for p in pairs if p["id_a"] == "a2"} == {run_id}
+        assert pairs[0]["overlap"] == 0.25
+
+        run = connection.execute(select(match_runs).where(match_runs.c.run_id == run_id)).mappings().one()
+        assert run["pairs"] == 1 and run["max_time_delta"] == 3600 and run["finished_at"] is not None
+
+
+def test_create_indexes_sql(db):
+    """Test that PostGIS gets a GiST index on geometry and BRIN indexes on the datetime columns."""
+    from unittest.mock import MagicMock
+
+    from geoalchemy2 import Geometry
+    from sqlalchemy import Column, DateTime, MetaData, String, Table
+    from sqlalchemy.schema import CreateIndex
+
+    table = Table("terra", MetaData(),
+                  Column("id", String, primary_key=True),
+                  Column("geometry", Geometry("POLYGON", srid=4326, spatial_index=False)),
+                  Column("datetime_start", DateTime),
+                  Column("datetime_end", DateTime))
+
+    connection = MagicMock()
+    connection.dialect = postgresql.dialect()
+    db.create_indexes(connection, table, time_index="brin")
+
+    statements = [str(call.args[0]) for call in connection.execute.call_args_list]
+    assert 'CREATE INDEX IF NOT EXISTS "idx_terra_geometry" ON "terra" USING GIST ("geometry")' in statements
+    created = [str(CreateIndex(i).compile(dialect=postgresql.dialect())) for i in table.indexes]
+    assert "CREATE INDEX ix_terra_datetime_start ON terra USING brin (datetime_start)" in created
+    connection.commit.assert_called_once()
+
+
+def test_partitions(db):
+    """Test that partitioned tables are range partitioned on datetime_start and their partitions created once each."""
+    from datetime import datetime
+    from unittest.mock import MagicMock, patch
+
+    from sqlalchemy.schema import CreateTable
+
+    from matchmakeo.catalogues import NasaCMR
+    from matchmakeo.product import Product
+
+    connection = MagicMock()
+    connection.dialect = postgresql.dialect()
+    with patch("matchmakeo.catalogues.inspect") as inspect:
+        inspect.return_value.has_table.return_value = False
+        table = NasaCMR(client_id="test")._create_table(connection, Product(short_name="MOD021KM", table="terra", partition_by="month"),
+                                                        primary_key="id")
+    sql = str(CreateTable(table).compile(dialect=postgresql.dialect()))
+    assert "PRIMARY KEY (id, datetime_start)" in sql
+    assert "PARTITION BY RANGE (datetime_start)" in sql
+
+    connection = MagicMock()
+    connection.execute.return_value.scalars.return_value = ["terra_2020_01"]
+    created = db.ensure_partitions(connection, "terra", "month",
+                                   [datetime(2020, 1, 31, 23, 55), datetime(2019, 12, 31, 23, 58), None, datetime(2020, 1, 2)])
+
+    assert created == ["terra_2019_12"]
+    statements = [str(call.args[0]) for call in connection.execute.call_args_list]
+    assert statements[-1] == ('CREATE TABLE IF NOT EXISTS "terra_2019_12" PARTITION OF "terra" '
+                              "FOR VALUES FROM ('2019-12-01T00:00:00') TO ('2020-01-01T00:00:00')")
+    # known partitions are cached
+    assert db.ensure_partitions(connection, "terra", "month", [datetime(2019, 12, 1)]) == []
+    assert connection.execute.call_count == 2
+
+    assert db._partition_bounds(datetime(2020, 7, 4), "year") == (datetime(2020, 1, 1), datetime(2021, 1, 1))
+
+
+def test_engine_options():
+    from sqlalchemy.pool import QueuePool
+
+    db = PostGISDatabase(database="test_db", username="test", password="password", pool_size=2, max_overflow=3)
+
+    engine = db.create_engine()
+
+    assert db.create_engine() is engine
+    assert not engine.echo
+    assert engine.pool.size() == 2
+    assert engine.pool._max_overflow == 3
+    assert engine.pool._pre_ping
+
+    # in-memory SQLite isn't pooled, so the pool can't be sized
+    for url in ("sqlite://", "sqlite:///:memory:"):
+        engine = PostGISDatabase(database=None, username=None, password=None, db_url=url, pool_size=2).create_engine()
+        assert not isinstance(engine.pool, QueuePool)
+
+
+def test_connection_lifecycle(tmp_path):
+    """Test that pooled connections are returned to the pool and the shared connection is reused."""
+    from sqlalchemy import create_engine, text
+
+    db = PostGISDatabase(database="test_db", username="test", password="password")
+    assert db.pool_status() == {}
+    db.engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}", pool_size=2)
+
+    with db.pooled_connection() as connection:
+        connection.execute(text("SELECT 1"))
+        assert db.pool_status()["checkedout"] == 1
+    assert db.pool_status()["checkedout"] == 0
+
+    with db.transaction() as connection:
+        connection.execute(text("CREATE TABLE t (id INTEGER)"))
+
+    assert db.connect() is db.connect()
+
+    db.close()
+    assert db.engine is None
+    assert db.connection is None
+
+
+def test_spatialite_pragmas(tmp_path):
+    """Test that Spatialite connections are tuned on connect and bulk load pragmas are restored afterwards."""
+    from sqlalchemy import create_engine, event
+
+    from matchmakeo.databases import SpatialiteDatabase
+
+    db = SpatialiteDatabase(tmp_path / "test.db", pragmas={"cache_size": -1024})
+    assert "geoalchemy2_connect_sqlite_init_mode=WGS84" in db.url
+
+    # mod_spatialite isn't needed to check the pragmas
+    db.engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    event.listen(db.engine, "connect", db._set_pragmas)
+
+    with db.pooled_connection() as connection:
+        assert connection.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+        assert connection.exec_driver_sql("PRAGMA cache_size").scalar() == -1024
+        assert connection.exec_driver_sql("PRAGMA synchronous").scalar() == 1  # NORMAL
+
+        with db.bulk_load(connection):
+            assert connection.exec_driver_sql("PRAGMA synchronous").scalar() == 0  # OFF
+
+        assert connection.exec_driver_sql("PRAGMA synchronous").scalar() == 1
+        assert connection.exec_driver_sql("PRAGMA cache_size").scalar() == -1024
+
+
+def test_spatialite_insert_footprints_binds_ewkb(sqlite_database, monkeypatch):
+    """Test that Spatialite is handed footprints' WKB as it is, rather than geoalchemy2 converting each one to EWKT."""
+    import pytest
+    import shapely
+    from geoalchemy2 import Geometry, WKTElement
+    from geoalchemy2.types.dialects import sqlite as geoalchemy2_sqlite
+    from sqlalchemy import Column, MetaData, String, Table, event, text
+
+    from matchmakeo.parsing import to_wkb_elements
+
+    table = Table("footprints", MetaData(), Column("id", String, primary_key=True),
+                  Column("geometry", Geometry("GEOMETRY", srid=4326, spatial_index=False)))
+    statements = []
+    event.listen(sqlite_database.create_engine(), "before_cursor_execute",
+                 lambda conn, cursor, statement, *args: statements.append(statement))
+
+    with sqlite_database.pooled_connection() as connection:
+        table.create(connection)
+        original = geoalchemy2_sqlite.bind_processor_process
+        monkeypatch.setattr(geoalchemy2_sqlite, "bind_processor_process", lambda *args: pytest.fail("converted to EWKT"))
+        [box] = to_wkb_elements([shapely.box(0, 0, 1, 1)])
+        assert sqlite_database.insert_footprints(connection, table, [{"id": "a", "geometry": box}, {"id": "b", "geometry": None}]) == 2
+        assert "GeomFromEWKB(?)" in statements[-1]
+
+        # other geometries are still converted by geoalchemy2
+        monkeypatch.setattr(geoalchemy2_sqlite, "bind_processor_process", original)
+        sqlite_database.insert_footprints(connection, table, [{"id": "c", "geometry": WKTElement("POINT (1 2)", srid=4326)}])
+
+        rows = dict(connection.execute(text("SELECT id, geometry FROM footprints")).all())
+    assert shapely.from_wkt(rows["a"]).equals(shapely.box(0, 0, 1, 1))
+    assert rows["b"] is None and rows["c"] == "POINT(1 2)"
+
+
+def test_spatialite_match_query():
+    """Test that Spatialite matching goes through the R*Tree spatial index of product a, or of product b when only
+    the footprints of a with given ids are matched."""
+    from datetime import timedelta
+
+    from sqlalchemy.dialects import sqlite
+
+    from matchmakeo.databases import SpatialiteDatabase
+    from matchmakeo.product import Product
+
+    db = SpatialiteDatabase("test.db")
+    query = db._match_query(Product(short_name="MOD021KM", table="terra"),
+                            Product(short_name="MYD021KM", table="aqua"),
+                            max_time_delta=timedelta(hours=1))
+    sql = str(query.compile(dialect=sqlite.dialect()))
+
+    assert 'a.rowid IN (SELECT rowid \nFROM "SpatialIndex"' in sql
+    assert "search_frame = b.geometry" in sql
+    # the datetime columns are compared as stored, so their indexes can be used
+    assert "a.datetime_start <= (strftime(" in sql and "julianday" not in sql
+
+    query = db._match_query(Product(short_name="MOD021KM", table="terra"),
+                            Product(short_name="MYD021KM", table="aqua"),
+                            max_time_delta=timedelta(hours=1), ids_a=["a1"])
+    sql = str(query.compile(dialect=sqlite.dialect(), compile_kwargs={"literal_binds": True}))
+
+    assert 'b.rowid IN (SELECT rowid \nFROM "SpatialIndex" \nWHERE f_table_name = \'aqua\'' in sql
+    assert "search_frame = a.geometry" in sql
+
+
+def test_work_queue(db):
+    """Test that windows are claimed once each in order, stale claims are handed out again and completion is recorded."""
+    import pickle
+    from datetime import datetime, timedelta
+
+    from matchmakeo.windows import Window
+
+    windows = [Window(datetime(2025, 1, d), datetime(2025, 1, d + 1), hits=d) for d in (2, 1, 3)]
+
+    with db.pooled_connection() as connection:
+        db.create_state_tables(connection)
+        db.enqueue_windows(connection, "terra", windows)
+        db.enqueue_windows(connection, "terra", windows[:1])
+
+        first = db.claim_window(connection, "terra", worker="a", claim_timeout=timedelta(hours=1))
+        second = db.claim_window(connection, "terra", worker="b", claim_timeout=timedelta(hours=1))
+        assert (first, second) == (windows[1], windows[0])
+        assert db.get_queue_status(connection, "terra") == {"pending": 1, "claimed": 2, "done": 0}
+
+        db.complete_windows(connection, "terra", [(first.start, first.end)])
+        # workers only claim windows within their own dates
+        assert db.claim_window(connection, "terra", worker="a", claim_timeout=timedelta(hours=1), end=datetime(2025, 1, 3)) is None
+        assert db.claim_window(connection, "terra", worker="a", claim_timeout=timedelta(hours=1), start=datetime(2025, 1, 3)) == windows[2]
+        assert db.claim_window(connection, "terra", worker="a", claim_timeout=timedelta(hours=1)) is None
+
+        # b's claim has gone stale
+        assert db.claim_window(connection, "terra", worker="c", claim_timeout=timedelta(0)) == windows[0]
+        assert db.get_queue_status(connection, "terra") == {"pending": 0, "claimed": 2, "done": 1}
+
+    # databases are sent to worker processes without their engine
+    copy = pickle.loads(pickle.dumps(db))
+    assert copy.engine is None and copy.url == db.url
@@ -0,0 +1,90 @@
+from datetime import datetime
+
+import pytest
+import shapely
+
+pytest.importorskip("pyarrow")
+
+from matchmakeo.geoparquet import import_geoparquet, iter_geoparquet, write_geoparquet
+
+
+def _rows():
+    return [
+        {"id": "a", "geometry": shapely.box(0, 0, 1, 1), "datetime_start": datetime(2020, 1, 31, 23), "datetime_end": datetime(2020, 2, 1)},
+        {"id": "b", "geometry": shapely.box(1, 1, 2, 2), "datetime_start": datetime(2020, 2, 1, 1), "datetime_end": datetime(2020, 2, 1, 2)},
+        {"id": "c", "geometry": None, "datetime_start": datetime(2020, 2, 2), "datetime_end": datetime(2020, 2, 2)},
+    ]
+
+
+def test_geoparquet_round_trip(tmp_path):
+    """Test that rows are partitioned by product and month and read back as GeoDataFrames."""
+    import pandas as pd
+    import pyarrow.dataset as ds
+
+    rows = _rows()
+    assert write_geoparquet([rows[:2], rows[2:]], tmp_path, product="terra") == 3
+
+    assert sorted(p.name for p in (tmp_path / "product=terra").iterdir()) == ["month=2020-01", "month=2020-02"]
+
+    gdf = pd.concat(iter_geoparquet(tmp_path, filter=ds.field("month") == "2020-02"))
+    assert sorted(gdf["id"]) == ["b", "c"]
+    assert gdf.crs.to_epsg() == 4326
+    assert gdf.set_index("id").geometry["b"].equals(rows[1]["geometry"])
+    assert gdf.set_index("id").geometry["c"] is None
+
+    # writing the product again replaces its files rather than duplicating rows, however it is chunked
+    write_geoparquet([rows[:2], rows[2:]], tmp_path, product="terra")
+    assert sum(len(gdf) for gdf in iter_geoparquet(tmp_path, batch_size=1)) == 3
+    write_geoparquet([rows[:1], rows[1:2], rows[2:]], tmp_path, product="aqua")
+    write_geoparquet([rows], tmp_path, product="aqua")
+    gdf = pd.concat(iter_geoparquet(tmp_path))
+    assert gdf.groupby("product").size().to_dict() == {"aqua": 3, "terra": 3}
+
+
+def test_write_match_geoparquet(tmp_path):
+    """Test that match results, which have a start time for each side, are partitioned by product a's."""
+    rows = [{"id_a": "a", "id_b": "b", "datetime_start_a": datetime(2020, 1, 31, 23), "datetime_start_b": datetime(2020, 2, 1),
+             "overlap": 0.5, "footprint": shapely.box(0, 0, 1, 1)}]
+
+    assert write_geoparquet([rows], tmp_path, product="terra_aqua", geometry_column="footprint") == 1
+    assert [p.name for p in (tmp_path / "product=terra_aqua").iterdir()] == ["month=2020-01"]
+
+    [gdf] = iter_geoparquet(tmp_path)
+    assert gdf.geometry.name == "footprint" and gdf.geometry[0].equals(rows[0]["footprint"])
+
+    with pytest.raises(ValueError, match="time_column"):
+        write_geoparquet([[{"id": "a", "geometry": None}]], tmp_path, product="untimed")
+
+
+def test_import_geoparquet(tmp_path):
+    """Test that a dataset is bulk loaded into an existing table, keeping only the table's columns."""
+    from sqlalchemy import create_engine, Column, DateTime, MetaData, String, Table, Text, TypeDecorator, func, select
+
+    from matchmakeo.databases import PostGISDatabase
+
+    write_geoparquet([_rows()], tmp_path / "parquet", product="terra")
+
+    class HexWKB(TypeDecorator):
+        "Stands in for a geometry column without Spatialite."
+        impl = Text
+        cache_ok = True
+
+        def process_bind_param(self, value, dialect):
+            return value.desc if value is not None else None
+
+    db = PostGISDatabase(database="test_db", username="test", password="password")
+    db.engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    table = Table("terra", MetaData(),
+                  Column("id", String, primary_key=True),
+                  Column("geometry", HexWKB),
+                  Column("datetime_start", DateTime),
+                  Column("datetime_end", DateTime))
+    table.metadata.create_all(db.engine)
+
+    assert import_geoparquet(tmp_path / "parquet", db, table, batch_size=2) == 3
+    # rows already loaded are kept, and not counted as written again
+    assert import_geoparquet(tmp_path / "parquet", db, table) == 0
+
+    with db.pooled_connection() as connection:
+        assert connection.execute(select(func.count()).select_from(table)).scalar() == 3
+        assert connection.execute(select(table.c.datetime_start).where(table.c.id == "b")).scalar() == datetime(2020, 2, 1, 1)
@@ -0,0 +1,77 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import shapely
+
+from matchmakeo.footprint import Footprint
+from matchmakeo.matching import FootprintIndex
+
+
+def random_footprints(n, seed):
+    rng = np.random.default_rng(seed)
+    corners = rng.uniform(0, 50, size=(n, 2))
+    geometries = shapely.box(corners[:, 0], corners[:, 1], corners[:, 0] + 5, corners[:, 1] + 5)
+    starts = np.datetime64("2025-01-01") + rng.integers(0, 10 * 24 * 60, size=n).astype("timedelta64[m]")
+    ends = starts + rng.integers(1, 10, size=n).astype("timedelta64[m]")
+    return [f"{seed}_{i}" for i in range(n)], geometries, starts, ends
+
+
+def test_match_same_as_brute_force():
+    """Test that time pruning and blocking find exactly the pairs a brute force comparison does."""
+    a = FootprintIndex(*random_footprints(300, seed=1))
+    b = FootprintIndex(*random_footprints(400, seed=2))
+    delta = timedelta(hours=2)
+
+    expected = set()
+    for i in range(len(a)):
+        for j in range(len(b)):
+            if (shapely.intersects(a.geometries[i], b.geometries[j])
+                    and a.datetime_start[i] <= b.datetime_end[j] + np.timedelta64(delta)
+                    and b.datetime_start[j] <= a.datetime_end[i] + np.timedelta64(delta)):
+                expected.add((a.ids[i], b.ids[j]))
+
+    chunks = list(a.match(b, max_time_delta=delta, chunk_size=50, block_size=64))
+
+    assert expected
+    assert all(len(chunk) <= 50 for chunk in chunks)
+    assert {(p["id_a"], p["id_b"]) for chunk in chunks for p in chunk} == expected
+
+
+def test_match_min_overlap():
+    a = FootprintIndex(["a"], [shapely.box(0, 0, 2, 2)], [datetime(2025, 1, 1)], [datetime(2025, 1, 1, 0, 5)])
+    b = FootprintIndex(["half", "quarter"],
+                       [shapely.box(1, 0, 3, 2), shapely.box(1, 1, 3, 3)],
+                       [datetime(2025, 1, 1, 0, 30)] * 2,
+                       [datetime(2025, 1, 1, 0, 35)] * 2)
+
+    pairs = [p for chunk in a.match(b, max_time_delta=timedelta(hours=1), min_overlap=0.5, with_geometry=True) for p in chunk]
+
+    assert [(p["id_b"], p["overlap"]) for p in pairs] == [("half", 0.5)]
+    assert pairs[0]["geometry"].equals(shapely.box(1, 0, 2, 2))
+
+    # outside the time tolerance
+    assert list(a.match(b, max_time_delta=timedelta(minutes=10))) == []
+
+
+def test_from_footprints():
+    footprints = [
+        Footprint("g1", shapely.box(0, 0, 1, 1), datetime(2025, 1, 1, 0, 5), datetime(2025, 1, 1, 0, 10)),
+        Footprint("no_geometry", None, None, None),
+    ]
+    index = FootprintIndex.from_footprints(footprints)
+
+    assert len(index) == 1
+    assert index.datetime_start[0] == np.datetime64("2025-01-01T00:05")
+
+
+def test_match_skips_footprints_without_times():
+    """Test that a footprint with no end time is left out rather than stopping every other footprint matching."""
+    a = FootprintIndex(["a"], [shapely.box(0, 0, 2, 2)], [datetime(2025, 1, 1)], [datetime(2025, 1, 1, 0, 5)])
+    b = FootprintIndex(["b1", "b2", "b3"],
+                       [shapely.box(1, 1, 3, 3)] * 3,
+                       [datetime(2025, 1, 1, 0, 30), datetime(2025, 1, 1, 0, 30), None],
+                       [datetime(2025, 1, 1, 0, 35), None, datetime(2025, 1, 1, 0, 35)])
+
+    assert len(b) == 1
+    assert [p["id_b"] for chunk in a.match(b, max_time_delta=timedelta(hours=1)) for p in chunk] == ["b1"]
+    assert [(p["id_a"], p["id_b"]) for chunk in b.match(a, max_time_delta=timedelta(hours=1)) for p in chunk] == [("b1", "a")]
@@ -0,0 +1,39 @@
+import json
+
+from matchmakeo.metrics import Metrics
+
+
+def test_metrics_summary_and_hooks():
+    """Test that counters and timers are aggregated by name and labels and passed to hooks as they happen."""
+    seen = []
+    metrics = Metrics(hooks=[lambda name, value, labels: seen.append((name, value, labels))])
+
+    metrics.increment("rows_written", 10, table="terra")
+    metrics.increment("rows_written", 5, table="terra")
+    metrics.increment("rows_written", 1, table="aqua")
+    metrics.observe("db_write", 0.5, table="terra")
+    with metrics.timer("db_write", table="terra"):
+        pass
+
+    assert metrics.counter("rows_written", table="terra") == 15
+    assert metrics.counter("http_retries") == 0
+    assert seen[0] == ("rows_written", 10, {"table": "terra"})
+    assert len(seen) == 5
+
+    summary = json.loads(metrics.to_json())
+    [timer] = summary["timers"]
+    assert timer["count"] == 2 and timer["max_seconds"] == 0.5 and timer["labels"] == {"table": "terra"}
+
+
+def test_metrics_prometheus(tmp_path):
+    metrics = Metrics()
+    metrics.increment("http_bytes_received", 2048)
+    metrics.observe("db_write", 0.25, table='a"b')
+
+    text = metrics.to_prometheus(tmp_path / "matchmakeo.prom")
+
+    assert "# TYPE matchmakeo_http_bytes_received counter\nmatchmakeo_http_bytes_received_total 2048\n" in text
+    assert 'matchmakeo_db_write_seconds_count{table="a\\"b"} 1\n' in text
+    assert 'matchmakeo_db_write_seconds_sum{table="a\\"b"} 0.25\n' in text
+    assert text.endswith("# EOF\n")
+    assert (tmp_path / "matchmakeo.prom").read_text() == text
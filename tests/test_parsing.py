@@ -0,0 +1,85 @@
+import shapely
+
+from matchmakeo.parsing import parse_cmr_geometries, to_wkb_elements
+
+
+def test_parse_cmr_geometries():
+    entries = [
+        # single polygon given as "lat lon" pairs
+        {"polygons": [["0 0 0 10 10 10 10 0 0 0"]]},
+        # polygon with a hole
+        {"polygons": [["0 0 0 10 10 10 10 0 0 0", "2 2 4 2 4 4 2 4 2 2"]]},
+        # granule made of two polygons
+        {"polygons": [["0 0 0 1 1 1 0 0"], ["5 5 5 6 6 6 5 5"]]},
+        # bounding box only, "S W N E"
+        {"boxes": ["-10 20 10 40"]},
+        # no spatial extent
+        {},
+    ]
+
+    geometries = parse_cmr_geometries(entries)
+
+    assert geometries[0].equals(shapely.box(0, 0, 10, 10))
+    assert len(geometries[1].interiors) == 1
+    assert geometries[1].area == 100 - 4
+    assert geometries[2].geom_type == "MultiPolygon"
+    assert len(geometries[2].geoms) == 2
+    assert geometries[3].equals(shapely.box(20, -10, 40, 10))
+    assert geometries[4] is None
+
+
+def test_to_wkb_elements():
+    elements = to_wkb_elements([shapely.box(0, 0, 1, 1), None])
+
+    assert elements[0].srid == 4326
+    assert elements[0].extended
+    assert shapely.from_wkb(elements[0].data).equals(shapely.box(0, 0, 1, 1))
+    assert elements[1] is None
+
+
+def test_normalise_geometries():
+    from matchmakeo.parsing import normalise_geometries
+
+    geometries = [
+        # swath across the antimeridian, given with a jump from 170 to -170
+        shapely.Polygon([(170, 0), (-170, 0), (-170, 10), (170, 10)]),
+        # box across the antimeridian, "S W N E" with W > E
+        *parse_cmr_geometries([{"boxes": ["0 170 10 -170"]}]),
+        # ring round the north pole at 80 degrees
+        shapely.Polygon([(lon, 80) for lon in range(-180, 180, 30)]),
+        # self-intersecting bowtie
+        shapely.Polygon([(0, 0), (1, 1), (1, 0), (0, 1)]),
+        shapely.box(0, 0, 1, 1),
+        None,
+    ]
+
+    normalised = normalise_geometries(geometries)
+
+    for split in normalised.geometries[:2]:
+        assert split.geom_type == "MultiPolygon"
+        assert split.area == 200
+        assert not split.intersects(shapely.Point(0, 5))
+    assert normalised.bounds[0].tolist() == [170, 0, -170, 10]
+    assert normalised.bounds[1].tolist() == [170, 0, -170, 10]
+
+    assert normalised.polar.tolist() == [False, False, True, False, False, False]
+    assert normalised.geometries[2].contains(shapely.Point(0, 85))
+    assert normalised.bounds[2].tolist() == [-180, 80, 180, 90]
+
+    assert normalised.geometries[3].is_valid
+    assert normalised.geometries[4].equals(shapely.box(0, 0, 1, 1))
+    assert normalised.geometries[5] is None
+
+
+def test_decode_cmr_feed(monkeypatch):
+    import json
+
+    from matchmakeo import parsing
+
+    content = json.dumps({"feed": {"entry": [{"id": "a", "time_start": "2025-01-01T00:00:00.000Z", "links": []}]}}).encode()
+
+    # with and without orjson
+    for decoder in (parsing.orjson, None):
+        monkeypatch.setattr(parsing, "orjson", decoder)
+        assert parsing.decode_cmr_feed(content)[0]["links"] == []
+        assert parsing.decode_cmr_feed(content, keys={"id", "polygons"}) == [{"id": "a"}]
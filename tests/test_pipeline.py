@@ -0,0 +1,63 @@
+import time
+
+import pytest
+
+from matchmakeo.pipeline import Pipeline, ordered_chain
+
+
+def double(items):
+    for item in items:
+        yield item * 2
+
+
+def add_one(items):
+    for item in items:
+        yield item + 1
+
+
+@pytest.mark.parametrize("threaded", [True, False])
+def test_pipeline(threaded):
+    pipeline = Pipeline(double, add_one, maxsize=2, threaded=threaded)
+
+    assert list(pipeline(range(100))) == [i * 2 + 1 for i in range(100)]
+
+
+def test_pipeline_raises_stage_errors():
+    def fail_on_three(items):
+        for item in items:
+            if item == 3:
+                raise ValueError("bad item")
+            yield item
+
+    with pytest.raises(ValueError, match="bad item"):
+        list(Pipeline(fail_on_three, double)(range(10)))
+
+
+def test_pipeline_is_bounded():
+    """Test that a stage stops pulling from upstream when the consumer doesn't keep up."""
+    produced = []
+
+    def source(items):
+        for item in items:
+            produced.append(item)
+            yield item
+
+    results = Pipeline(source, double, maxsize=2)(range(1000))
+    assert next(results) == 0
+    time.sleep(0.2)
+
+    # a couple of items queued between each stage and in flight, nowhere near everything
+    assert len(produced) < 10
+    results.close()
+
+
+def test_ordered_chain():
+    def pages(window):
+        # later windows are quicker, but output stays in window order
+        for page in range(3):
+            time.sleep(0.01 * (4 - window))
+            yield (window, page)
+
+    results = list(ordered_chain(pages, range(4), max_workers=3, maxsize=1))
+
+    assert results == [(window, page) for window in range(4) for page in range(3)]
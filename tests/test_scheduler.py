@@ -0,0 +1,58 @@
+from datetime import date, timedelta
+import threading
+import time
+
+from sqlalchemy import inspect
+
+from matchmakeo.catalogues import Catalogue
+from matchmakeo.matching import MaterialisedMatch
+from matchmakeo.product import Product
+from matchmakeo.queryset import Queryset
+from matchmakeo.scheduler import HarvestJob, HarvestScheduler
+
+
+class SleepyCatalogue(Catalogue):
+    """Pretends to harvest by sleeping, recording the rate limiter and options each harvest ran with."""
+
+    def __init__(self, **kwargs):
+        super().__init__(url="https://example.com", **kwargs)
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def download_footprints(self, product, queryset, database, **options):
+        with self.lock:
+            self.calls.append((product.table, self.rate_limiter, options))
+        time.sleep(0.2)
+        if product.table == "broken":
+            raise RuntimeError("harvest failed")
+        return len(product.table)
+
+
+def test_scheduler_runs_jobs_concurrently(db):
+    """Test that jobs run at once under a shared rate limit and a failure doesn't stop the others."""
+    catalogue = SleepyCatalogue(rate_limit=1)
+    own_limiter = catalogue.rate_limiter
+    queryset = Queryset(start_date=date(2025, 1, 1), end_date=date(2025, 1, 1))
+    products = {name: Product(short_name=name, table=name) for name in ("terra", "aqua", "broken")}
+    match = MaterialisedMatch(products["terra"], products["aqua"], max_time_delta=timedelta(hours=1))
+    jobs = [HarvestJob(catalogue, product, queryset,
+                       options={"max_workers": 2, "matches": [match] if product.table != "broken" else []})
+            for product in products.values()]
+
+    started = time.perf_counter()
+    results = HarvestScheduler(database=db, rate_limit=10).run(jobs)
+
+    assert time.perf_counter() - started < 0.5
+    assert [r.rows_written for r in results] == [5, 4, 0]
+    assert [r.ok for r in results] == [True, True, False]
+    assert isinstance(results[2].error, RuntimeError)
+
+    limiters = {limiter for _, limiter, _ in catalogue.calls}
+    assert len(limiters) == 1 and limiters != {own_limiter}
+    assert catalogue.rate_limiter is own_limiter
+    assert sorted(options["progress_position"] for _, _, options in catalogue.calls) == [0, 1, 2]
+    assert all(options["max_workers"] == 2 for _, _, options in catalogue.calls)
+
+    # shared tables are created before the jobs start rather than raced for by them
+    tables = inspect(db.create_engine()).get_table_names()
+    assert "matchmakeo_checkpoints" in tables and "matches_terra_aqua" in tables
@@ -0,0 +1,52 @@
+from sqlalchemy import create_engine, event, inspect, text
+
+from matchmakeo.schema import SchemaManager
+
+
+def test_ensure_columns():
+    engine = create_engine("sqlite://")
+    connection = engine.connect()
+    connection.execute(text('CREATE TABLE footprints ("id" TEXT PRIMARY KEY, "geometry" TEXT)'))
+
+    schema = SchemaManager()
+    props = [
+        {"id": "a", "cloud_cover": 1, "day_night_flag": "DAY", "links": None},
+        {"id": "b", "cloud_cover": 2.5, "links": [{"href": "https://example.com"}]},
+    ]
+    schema.ensure_columns(connection, "footprints", props, ignore={"id"})
+
+    columns = {c["name"]: str(c["type"]) for c in inspect(connection).get_columns("footprints")}
+    # typed from every row in the batch, not just the first
+    assert columns["cloud_cover"] == "FLOAT"
+    assert columns["day_night_flag"] == "TEXT"
+    assert columns["links"] == "JSON"
+
+    # once the columns are known, checking a batch doesn't touch the database
+    statements = []
+    event.listen(engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+    schema.ensure_columns(connection, "footprints", props, ignore={"id"})
+    assert statements == []
+
+
+def test_infer_column_types_skips_nulls():
+    types = SchemaManager.infer_column_types([{"a": None, "b": 1}, {"a": None, "b": 2}], {"a", "b"})
+
+    assert types == {"b": "BIGINT"}
+
+
+def test_ensure_columns_remembers_null_properties():
+    """Test that properties which are always None don't send every batch back to the database."""
+    engine = create_engine("sqlite://")
+    connection = engine.connect()
+    connection.execute(text('CREATE TABLE footprints ("id" TEXT PRIMARY KEY)'))
+
+    schema = SchemaManager()
+    assert schema.ensure_columns(connection, "footprints", [{"id": "a", "granule_size": None}], ignore={"id"}) == {}
+
+    statements = []
+    event.listen(engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+    assert schema.ensure_columns(connection, "footprints", [{"id": "b", "granule_size": None}], ignore={"id"}) == {}
+    assert statements == []
+
+    # until it has a value
+    assert schema.ensure_columns(connection, "footprints", [{"id": "c", "granule_size": 41.2}], ignore={"id"}) == {"granule_size": "FLOAT"}
@@ -1,6 +1,7 @@
-from datetime import date, datetime
+from datetime import date, datetime, timezone
+import time
 
-from matchmakeo.utils import daterange
+from matchmakeo.utils import RateLimiter, daterange, parse_datetime, utcnow, widen_sql_type
 
 def test_daterange():
 
@@ -25,3 +26,37 @@ def test_daterange():
     dr = daterange(start_date, end_date)
     assert next(dr) == date(2025, 8, 1)
 
+
+def test_rate_limiter():
+    limiter = RateLimiter(rate=50)
+
+    start = time.monotonic()
+    for _ in range(6):
+        limiter.wait()
+
+    # first call is immediate, the following five are spaced 1/50 s apart
+    assert time.monotonic() - start >= 5 / 50
+
+def test_parse_datetime():
+    assert parse_datetime("2020-01-01T00:05:00.000Z") == datetime(2020, 1, 1, 0, 5)
+    assert parse_datetime("2020-01-01T01:05:00+01:00") == datetime(2020, 1, 1, 0, 5)
+    assert parse_datetime(None) is None
+
+def test_widen_sql_type():
+    assert widen_sql_type("BIGINT", "BIGINT") == "BIGINT"
+    assert widen_sql_type("BIGINT", "FLOAT") == "FLOAT"
+    assert widen_sql_type("TEXT", "JSON") == "JSON"
+    assert widen_sql_type("BOOLEAN", "TEXT") == "TEXT"
+
+
+def test_utcnow(monkeypatch):
+    # whatever the host's time zone
+    monkeypatch.setenv("TZ", "America/New_York")
+    time.tzset()
+    try:
+        now = utcnow()
+        assert now.tzinfo is None
+        assert abs((now - datetime.now(timezone.utc).replace(tzinfo=None)).total_seconds()) < 5
+    finally:
+        monkeypatch.undo()
+        time.tzset()
@@ -0,0 +1,39 @@
+from datetime import datetime, timedelta
+
+from matchmakeo.windows import AdaptiveWindows, DailyWindows
+
+
+def test_daily_windows():
+    windows = list(DailyWindows().windows(datetime(2025, 8, 1), datetime(2025, 8, 6)))
+
+    assert len(windows) == 5
+    assert windows[0].start == datetime(2025, 8, 1)
+    assert windows[-1].end == datetime(2025, 8, 6)
+
+
+def test_adaptive_windows_split_dense_and_skip_empty():
+    """Test that dense windows are split, sparse ones merged and empty stretches not queried at all."""
+
+    # 100 granules per day in January, nothing in February
+    def count_hits(start, end):
+        end = min(end, datetime(2025, 2, 1))
+        return max(0, int((end - start) / timedelta(days=1) * 100))
+
+    policy = AdaptiveWindows(initial=timedelta(days=16), target_hits=500, min_window=timedelta(hours=1))
+    windows = list(policy.windows(datetime(2025, 1, 1), datetime(2025, 3, 1), count_hits))
+
+    assert all(w.hits <= 500 for w in windows)
+    assert sum(w.hits for w in windows) == 3100
+    # windows cover the range without gaps, the empty month is folded into the last window
+    assert windows[0].start == datetime(2025, 1, 1)
+    assert all(a.end == b.start for a, b in zip(windows, windows[1:]))
+    assert all(w.start < datetime(2025, 2, 1) for w in windows)
+    # far fewer queries than one per day
+    assert len(windows) < 31
+
+
+def test_adaptive_windows_merge_sparse():
+    policy = AdaptiveWindows(initial=timedelta(days=1), target_hits=100)
+    windows = list(policy.windows(datetime(2025, 1, 1), datetime(2025, 1, 11), lambda start, end: 10))
+
+    assert windows == [(datetime(2025, 1, 1), datetime(2025, 1, 11), 100)]